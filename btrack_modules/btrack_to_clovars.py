@@ -1,4 +1,6 @@
 # Convert tables from btrack output format to CloVarS format
+# (uses ultrack_modules, run from the repository root:
+# python -m btrack_modules.btrack_to_clovars -i <input> -o <output> -t <interval>)
 
 ######################################################################
 
@@ -7,6 +9,8 @@ print("Importing Libraries...")
 from pandas import DataFrame
 from pandas import read_csv
 from argparse import ArgumentParser
+from numpy import bincount, where, zeros
+from ultrack_modules.misc.lineage_index import LineageIndex, lineage_names
 print("All libraries imported!")
 
 ######################################################################
@@ -74,25 +78,14 @@ def get_args_dict() -> dict:
 ################################################################
 #Defining other functions
 
-def get_branches(data:DataFrame) -> list:
+def get_branches(lineage:LineageIndex) -> list:
     """
     Function that return a list with lists containing all ids of cell mutually related
-    in the dataframe
-    :data: dataframe with tracking data
+    in the dataframe, parents before their children
+    :lineage: LineageIndex of the tracking data
     :return: List of branches
     """
-    branches = []
-    data.sort_values("simulation_frames")
-    for i, id in enumerate(data["id"].unique()):
-        cell_data = data[data["id"] == id]
-        is_in = False
-        for branch in branches:
-            if min(cell_data["parent"].unique()) in branch: 
-                branch.append(id)
-                is_in = True
-                break
-        if not is_in:
-            branches.append([id])
+    branches = [list(lineage.walk(root)) for root in lineage.track_ids[lineage.roots]]
     print("Got branches...")
     return branches
 
@@ -134,59 +127,38 @@ def btrack_to_clovars(input_path:str,
 
     #HARDER CASES
     
+    # lineage of the cells, btrack roots are their own parent
+    lineage = LineageIndex.from_table(data, track_column="id", parent_column="parent",
+                                      time_column="simulation_frames")
+    rows = lineage.position(data["id"].to_numpy())
+
     print("Seconds since birth...")
     # seconds_since_birth
     # Primeiro criar "frame_since_birth" e converter pra segundos
-    data.insert(0, "frame_since_birth", 0)
-    for id in data["id"].unique():
-        min_frame = min(data[data["id"] == id]["simulation_frames"])
-        data.loc[data["id"] == id, "frame_since_birth"] = data["simulation_frames"] - min_frame
+    data.insert(0, "frame_since_birth", data["simulation_frames"].to_numpy() - lineage.birth[rows])
 
     data["seconds_since_birth"] = data["frame_since_birth"]*frame_interval*60
     
     print("branch name...")
     # branch name
-    branches = get_branches(data)
-
-    for branch_index, branch in enumerate(branches):
-        for id_index, id in enumerate(branch):
-            branch_name = colony_name + "-" + str(branch_index+1)
-            data.loc[data["id"] == id, "branch_name"] = branch_name
-            
-            value = id_index
-            while True:
-                if value == 0:
-                    data.loc[data["id"] == id, "name"] = branch_name
-                    break
-                elif value <= 2:
-                    cell_data = data.loc[data["id"] == id]
-                    parent = min(cell_data["parent"])
-                    data.loc[data["id"] == id, 
-                             "name"] = data.loc[data["id"] == parent, 
-                                                "name"].iloc[0] + "."+str(value)
-                    break
-                else:
-                    value -= 2
+    names, branch_names = lineage_names(lineage, colony_name)
+    data["branch_name"] = branch_names[rows]
+    data["name"] = names[rows]
 
     print("fate...")
     # fate at next frame
-    data.insert(0, "fate_at_next_frame", "migration")
+    # a cell divides when one of its children is alive in the frame after its last one
+    children = lineage.indices
+    parents = lineage.parents[children]
+    next_frame = lineage.death[parents] + 1
+    divides = zeros(len(lineage.track_ids), dtype=bool)
+    divides[parents[(lineage.birth[children] <= next_frame) & (lineage.death[children] >= next_frame)]] = True
+
     last_frame = max(data["simulation_frames"])
+    cell_last_frame = lineage.death[rows]
+    ends = (data["simulation_frames"].to_numpy() == cell_last_frame) & (cell_last_frame != last_frame)
 
-    for id in data["id"].unique():
-        cell_last_frame = max(data.loc[data["id"] == id, "simulation_frames"])
-        
-        if cell_last_frame == last_frame: continue
-            
-        if id in data.loc[data["simulation_frames"] == cell_last_frame+1, 
-                          "parent"].unique():
-            data.loc[(data["id"] == id) & (data["simulation_frames"] == cell_last_frame),
-                     "fate_at_next_frame"] = "division"
-            continue
-        else:
-            data.loc[(data["id"] == id) & (data["simulation_frames"] == cell_last_frame), 
-                     "fate_at_next_frame"] = "death"
-    
+    data.insert(0, "fate_at_next_frame", where(ends, where(divides[rows], "division", "death"), "migration"))
             
     #Drop unwanted cols
     data = data.drop(["parent", "frame_since_birth", "root", "state", "dummy", ], axis=1)
@@ -208,13 +180,9 @@ def btrack_to_clovars(input_path:str,
 
     if only_mitosis:
         #Filter for only branches with more than one cell
-        filtered_branches = list(filter(lambda x:len(x) == 1, branches))
-        drop_ids = [item for sublist in filtered_branches for item in sublist]
-        drop_indexes = []
-        for id in drop_ids:
-            drop_indexes.extend(data.index[data["id"] == id].tolist())
-
-        data = data.drop(drop_indexes, axis= 0)
+        branch_sizes = bincount(lineage.root_of[lineage.root_of >= 0], minlength=len(lineage.track_ids))
+        roots = lineage.root_of[rows]
+        data = data[(roots >= 0) & (branch_sizes[roots] > 1)]
     
     return data
 
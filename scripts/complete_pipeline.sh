@@ -20,6 +20,10 @@ CONDA_ENV_NAME="$4"
 eval "$(conda shell.bash hook)"
 conda activate "$CONDA_ENV_NAME"
 
+# Modules import each other as ultrack_modules.*, put the repository root on the path
+REPO_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+export PYTHONPATH="$REPO_ROOT${PYTHONPATH:+:$PYTHONPATH}"
+
 # Run preprocess step
 echo "Running preprocess..."
 PREPROCESSED_DIR="$OUTPUT_BASE/preprocessed"
@@ -32,10 +36,16 @@ SEGMENTED_DIR="$OUTPUT_BASE/segmented"
 mkdir -p "$SEGMENTED_DIR"
 python ../ultrack_modules/pipeline/cellpose_segmentation.py --input "$PREPROCESSED_DIR" --output "$SEGMENTED_DIR"
 
+# Run label filtering step
+echo "Running label filtering..."
+FILTERED_DIR="$OUTPUT_BASE/filtered"
+mkdir -p "$FILTERED_DIR"
+python ../ultrack_modules/pipeline/filter_labels.py --input "$SEGMENTED_DIR" --output "$FILTERED_DIR" --config "$ULTRACK_CONFIG"
+
 # Run tracking step
 echo "Running tracking..."
 TRACKING_DIR="$OUTPUT_BASE/trackings"
 mkdir -p "$TRACKING_DIR"
-python ../ultrack_modules/pipeline/ultrack_track_segmentation.py --input "$SEGMENTED_DIR" --output "$TRACKING_DIR" --config "$ULTRACK_CONFIG"
+python ../ultrack_modules/pipeline/ultrack_track_segmentation.py --input "$FILTERED_DIR" --output "$TRACKING_DIR" --config "$ULTRACK_CONFIG"
 
 echo "Pipeline completed successfully."
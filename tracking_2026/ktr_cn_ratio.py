@@ -0,0 +1,184 @@
+"""
+Computes the KTR cytoplasm/nucleus ratio of every tracked nucleus.
+
+For each frame, a cytoplasmic ring is built around every nucleus label with a
+single distance transform of the background: every background pixel within
+the ring width gets the label of its nearest nucleus, so rings never overlap
+each other or any nucleus. Nuclear and ring mean intensities of the KTR
+channel are then taken for all labels at once with bincount.
+
+Masks are track-labelled (label == track_id), e.g. the CTC mask*.tif output.
+Output columns: frame, track_id, <name>_nuc_mean, <name>_cyto_mean,
+<name>_cn_ratio (default name: green_preprocessed, as read by
+lineage_to_timeseries.py).
+"""
+import argparse
+import glob
+import os
+import re
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+import tifffile
+from scipy.ndimage import distance_transform_edt
+
+
+def frame_number(filename):
+    """Frame of a per-frame file: the last digit group of its name (pos2_t0005.tif -> 5), None without digits."""
+    digits = re.findall(r"\d+", os.path.splitext(os.path.basename(filename))[0])
+    return int(digits[-1]) if digits else None
+
+
+def list_frames(path):
+    """
+    Returns [(frame, source)] for a folder of per-frame TIFs or a stacked TIF.
+    Files without a frame number are skipped, two files with the same frame
+    number raise a ValueError.
+    """
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, "*.tif")) + glob.glob(os.path.join(path, "*.tiff"))
+
+        frames, skipped = {}, []
+        for f in sorted(files):
+            frame = frame_number(f)
+            if frame is None:
+                skipped.append(os.path.basename(f))
+            elif frame in frames:
+                raise ValueError(f"{os.path.basename(frames[frame])} and {os.path.basename(f)} are both frame {frame}")
+            else:
+                frames[frame] = f
+
+        if skipped:
+            print(f"Skipping {len(skipped)} file(s) without a frame number: {', '.join(skipped)}")
+        return sorted(frames.items())
+
+    with tifffile.TiffFile(path) as tif:
+        n_frames = len(tif.pages)
+    return [(t, (path, t)) for t in range(n_frames)]
+
+
+def read_frame(source):
+    """Reads one frame from a file path or a (stack path, page) pair."""
+    if isinstance(source, tuple):
+        return tifffile.imread(source[0], key=source[1])
+    return tifffile.imread(source)
+
+
+def ring_masks(labels, width, gap=0):
+    """
+    Cytoplasmic rings of every label: background pixels farther than `gap`
+    and up to `gap + width` pixels from a nucleus, given to the nearest one.
+    """
+    distance, (rows, cols) = distance_transform_edt(labels == 0, return_indices=True)
+    nearest = labels[rows, cols]
+    return np.where((distance > gap) & (distance <= gap + width), nearest, 0).astype(labels.dtype)
+
+
+def source_mtime(source):
+    """Modification time of the file holding a frame."""
+    return os.path.getmtime(source[0] if isinstance(source, tuple) else source)
+
+
+def cached_rings(labels, frame, mask_source, width, gap, cache_dir):
+    """
+    Reads the rings of a frame from the cache, building and saving them
+    when missing or older than the mask they came from.
+    """
+    if cache_dir is None:
+        return ring_masks(labels, width, gap)
+
+    path = os.path.join(cache_dir, f"ring_{frame:05d}.tif")
+    if os.path.isfile(path) and os.path.getmtime(path) >= source_mtime(mask_source):
+        return tifffile.imread(path)
+
+    rings = ring_masks(labels, width, gap)
+    tifffile.imwrite(path, rings, compression="zlib")
+    return rings
+
+
+def frame_ratio(job, width, gap, cache_dir, name):
+    """Nuclear mean, ring mean and C/N ratio of every label of one frame."""
+    frame, mask_source, image_source = job
+    labels = read_frame(mask_source)
+    image = read_frame(image_source).astype(np.float64)
+
+    rings = cached_rings(labels, frame, mask_source, width, gap, cache_dir)
+
+    flat_labels = labels.ravel().astype(np.intp)
+    flat_rings = rings.ravel().astype(np.intp)
+    n = int(flat_labels.max()) + 1
+
+    nuc_area = np.bincount(flat_labels, minlength=n)
+    nuc_sum = np.bincount(flat_labels, weights=image.ravel(), minlength=n)
+    ring_area = np.bincount(flat_rings, minlength=n)[:n]
+    ring_sum = np.bincount(flat_rings, weights=image.ravel(), minlength=n)[:n]
+
+    ids = np.flatnonzero(nuc_area)
+    ids = ids[ids > 0]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        nuc_mean = nuc_sum[ids] / nuc_area[ids]
+        cyto_mean = np.where(ring_area[ids] > 0, ring_sum[ids] / np.maximum(ring_area[ids], 1), np.nan)
+        ratio = cyto_mean / nuc_mean
+
+    return pd.DataFrame({
+        "frame": frame,
+        "track_id": ids,
+        f"{name}_nuc_mean": nuc_mean,
+        f"{name}_cyto_mean": cyto_mean,
+        f"{name}_cn_ratio": ratio,
+    })
+
+
+def compute_cn_ratio(masks, image, width=5, gap=1, cache_dir=None, name="green_preprocessed", n_workers=None):
+    """C/N ratio table for all frames, processed in parallel."""
+    mask_frames = dict(list_frames(masks))
+    image_frames = list_frames(image)
+
+    # image frames follow the masks order when names do not share indices
+    if not set(mask_frames) & {t for t, _ in image_frames}:
+        image_frames = list(zip(sorted(mask_frames), [s for _, s in image_frames]))
+
+    jobs = [(t, mask_frames[t], source) for t, source in image_frames if t in mask_frames]
+
+    if cache_dir is not None:
+        cache_dir = os.path.join(cache_dir, f"rings_w{width}_g{gap}")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    worker = partial(frame_ratio, width=width, gap=gap, cache_dir=cache_dir, name=name)
+    with Pool(n_workers) as pool:
+        tables = pool.map(worker, jobs)
+
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the KTR cytoplasm/nucleus ratio per (frame, track_id).")
+
+    parser.add_argument("--masks", required=True, help="Track-labelled masks: folder of per-frame TIFs or a stacked TIF.")
+    parser.add_argument("--image", required=True, help="KTR channel: folder of per-frame TIFs or a stacked TIF.")
+    parser.add_argument("--output", required=True, help="Output CSV.")
+    parser.add_argument("--tracks", default=None, help="Optional tracking CSV (frame, track_id) to merge the ratio into.")
+    parser.add_argument("--width", type=int, default=5, help="Ring width in pixels (default: 5).")
+    parser.add_argument("--gap", type=int, default=1, help="Pixels skipped between nucleus and ring (default: 1).")
+    parser.add_argument("--name", default="green_preprocessed", help="Columns prefix (default: green_preprocessed).")
+    parser.add_argument("--ring_cache", default=None, help="Folder to cache the ring masks for reuse.")
+    parser.add_argument("--n_workers", type=int, default=None, help="Number of processes (default: all cores).")
+
+    args = parser.parse_args()
+
+    ratio_df = compute_cn_ratio(args.masks, args.image, width=args.width, gap=args.gap,
+                                cache_dir=args.ring_cache, name=args.name, n_workers=args.n_workers)
+
+    if args.tracks is not None:
+        tracks_df = pd.read_csv(args.tracks)
+        ratio_df = tracks_df.merge(ratio_df, on=["frame", "track_id"], how="left")
+
+    ratio_df.to_csv(args.output, index=False)
+    print(f"C/N ratio of {len(ratio_df)} rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,15 @@ Colunas por célula:
 
 Inclination = coeficiente angular da regressão linear (valor ~ frame);
 R2 = coeficiente de determinação da mesma regressão.
+
+Usa ultrack_modules (LineageIndex); rodado pelo caminho do arquivo, a raiz do
+repositório é adicionada ao sys.path:
+    python tracking_2026/lineage_to_timeseries.py tracks.csv series.xlsx --root 1
 """
 import argparse
+import sys
 from io import BytesIO
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
@@ -29,6 +35,12 @@ from openpyxl.drawing.image import Image as XLImage
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 
+try:
+    from ultrack_modules.misc.lineage_index import LineageIndex
+except ImportError:  # repositório fora do PYTHONPATH → usa a raiz deste checkout
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    from ultrack_modules.misc.lineage_index import LineageIndex
+
 AREA_COL = "area_px"
 NII_COL = "nii"
 ERK_COL = "green_preprocessed_cn_ratio"
@@ -71,20 +83,6 @@ def cell_metrics(g):
     ]
 
 
-def enumerate_paths(root, children):
-    """Todos os caminhos raiz->folha como listas de track_id (DFS iterativo)."""
-    paths, stack = [], [[root]]
-    while stack:
-        path = stack.pop()
-        kids = children.get(path[-1], [])
-        if not kids:
-            paths.append(path)
-        else:
-            for k in kids:
-                stack.append(path + [k])
-    return paths
-
-
 # --- Escrita da planilha ---
 GROUPS = [
     ("Frames", ["Initial", "End"], "FFFFFF"),
@@ -119,33 +117,34 @@ def write_headers(ws, row):
     return row + 2
 
 
-def tree_layout(root, children):
+def tree_layout(root, lineage):
     """Posições (x, y) dos nós: folhas espalhadas em x, pai = média dos filhos; y = -profundidade."""
-    pos, leaf_x = {}, [0]
-
-    def place(node, depth):
-        kids = children.get(node, [])
-        if not kids:
-            x = leaf_x[0]
-            leaf_x[0] += 1
-        else:
-            x = float(np.mean([place(k, depth + 1) for k in kids]))
-        pos[node] = (x, -depth)
-        return x
-
-    place(root, 0)
+    nodes = list(lineage.walk(root))
+    root_depth = lineage.depth[lineage.position(root)]
+    depth = {node: int(d - root_depth) for node, d in zip(nodes, lineage.depth[lineage.position(nodes)])}
+
+    # folhas numeradas na ordem da busca em profundidade
+    leaves = [node for node in nodes if not len(lineage.children(node))]
+    pos = {node: (x, -depth[node]) for x, node in enumerate(leaves)}
+
+    # filhos antes dos pais (ordem da busca invertida), sem recursão
+    for node in reversed(nodes):
+        if node not in pos:
+            x = float(np.mean([pos[k][0] for k in lineage.children(node).tolist()]))
+            pos[node] = (x, -depth[node])
+
     return pos
 
 
-def plot_tree(root, children, outcome_of):
+def plot_tree(root, lineage, outcome_of):
     """Desenha a árvore de linhagem e retorna um PNG em memória (BytesIO)."""
-    pos = tree_layout(root, children)
-    n_leaves = sum(1 for n in pos if not children.get(n))
+    pos = tree_layout(root, lineage)
+    n_leaves = sum(1 for n in pos if not len(lineage.children(n)))
     depth = max(-y for _, y in pos.values()) + 1
     fig, ax = plt.subplots(figsize=(max(6, n_leaves * 0.7), max(4, depth * 1.0)))
 
     for node, (x, y) in pos.items():
-        for k in children.get(node, []):
+        for k in lineage.children(node).tolist():
             kx, ky = pos[k]
             ax.plot([x, kx], [y, ky], "-", color="0.6", lw=1, zorder=1)
     for node, (x, y) in pos.items():
@@ -164,14 +163,13 @@ def plot_tree(root, children, outcome_of):
 
 
 def build_workbook(df, root):
-    children = {p: sorted(g.unique()) for p, g in df.groupby("parent_id")["track_id"]}
+    lineage = LineageIndex.from_table(df, parent_column="parent_id", time_column="frame")
     groups = {tid: g.sort_values("frame") for tid, g in df.groupby("track_id")}
 
     if root not in groups:
         raise ValueError(f"track_id raiz {root} não existe no CSV.")
 
-    paths = enumerate_paths(root, children)
-    paths.sort()
+    paths = sorted(lineage.paths(root))
 
     wb = Workbook()
     ws = wb.active
@@ -195,7 +193,7 @@ def build_workbook(df, root):
 
     outcome_of = df.groupby("track_id")["outcome"].last().to_dict()
     ws_tree = wb.create_sheet(f"Arvore_raiz_{root}")
-    ws_tree.add_image(XLImage(plot_tree(root, children, outcome_of)), "A1")
+    ws_tree.add_image(XLImage(plot_tree(root, lineage, outcome_of)), "A1")
 
     return wb, len(paths)
 
@@ -0,0 +1,156 @@
+"""
+Computes nuclear morphology features of every label of every frame.
+
+Area, centroid and eccentricity come from bincount moments over the whole
+frame. Perimeter and the convex hull (NII and solidity) are computed inside
+each label bounding box, from a single find_objects pass per frame. Frames are
+processed in parallel.
+
+  area_px       pixels of the nucleus
+  perimeter     boundary length (skimage.measure.perimeter)
+  nii           perimeter / convex hull perimeter (1 for a convex nucleus,
+                grows with blebs and folds)
+  eccentricity  same definition as regionprops
+  solidity      area / convex hull area
+
+The output is keyed by (frame, label, track_id) and is written as parquet
+when the output ends with .parquet, otherwise as CSV. With track-labelled
+masks (label == track_id, e.g. CTC mask*.tif) it can be merged straight into
+the tracking CSV read by lineage_to_timeseries.py.
+"""
+import argparse
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from scipy.ndimage import find_objects
+from scipy.spatial import ConvexHull
+from skimage.measure import perimeter
+
+from ktr_cn_ratio import list_frames, read_frame
+
+
+def frame_moments(labels):
+    """Area and eccentricity of every label (indexed by label) from bincount moments."""
+    flat = labels.ravel().astype(np.intp)
+    n = int(flat.max()) + 1
+    rows, cols = np.divmod(np.arange(flat.size, dtype=np.float64), labels.shape[1])
+
+    area = np.bincount(flat, minlength=n).astype(np.float64)
+    safe_area = np.maximum(area, 1)
+    mean_r = np.bincount(flat, weights=rows, minlength=n) / safe_area
+    mean_c = np.bincount(flat, weights=cols, minlength=n) / safe_area
+    mu_rr = np.bincount(flat, weights=rows * rows, minlength=n) / safe_area - mean_r ** 2
+    mu_cc = np.bincount(flat, weights=cols * cols, minlength=n) / safe_area - mean_c ** 2
+    mu_rc = np.bincount(flat, weights=rows * cols, minlength=n) / safe_area - mean_r * mean_c
+
+    half_trace = (mu_rr + mu_cc) / 2
+    delta = np.sqrt(np.maximum(((mu_rr - mu_cc) / 2) ** 2 + mu_rc ** 2, 0))
+    major, minor = half_trace + delta, np.maximum(half_trace - delta, 0)
+    eccentricity = np.where(major > 0, np.sqrt(1 - minor / np.where(major > 0, major, 1)), 0)
+
+    return area, eccentricity
+
+
+def hull_measures(mask):
+    """
+    Convex hull perimeter (through the pixel centres, as the perimeter) and
+    convex hull area (through the pixel corners, so it covers every pixel).
+    """
+    rows, cols = np.nonzero(mask)
+    centres = np.column_stack([rows, cols]).astype(np.float64)
+    corners = np.concatenate([centres + offset for offset in ((-0.5, -0.5), (-0.5, 0.5), (0.5, -0.5), (0.5, 0.5))])
+
+    # joggled, so lines and single pixels still give a hull
+    hull_perimeter = ConvexHull(centres, qhull_options="QJ").area if len(centres) >= 3 else 0.0
+    hull_area = ConvexHull(corners).volume
+
+    return hull_perimeter, hull_area
+
+
+def frame_morphology(job):
+    """Morphology features of every label of one frame."""
+    frame, source = job
+    labels = read_frame(source)
+
+    area, eccentricity = frame_moments(labels)
+
+    ids, perimeters, hull_perimeters, hull_areas = [], [], [], []
+    for label, slices in enumerate(find_objects(labels), start=1):
+        if slices is None:
+            continue
+        mask = labels[slices] == label
+        hull_perimeter, hull_area = hull_measures(mask)
+
+        ids.append(label)
+        perimeters.append(perimeter(mask))
+        hull_perimeters.append(hull_perimeter)
+        hull_areas.append(hull_area)
+
+    ids = np.asarray(ids, dtype=np.int64)
+    perimeters = np.asarray(perimeters, dtype=np.float64)
+    hull_perimeters = np.asarray(hull_perimeters, dtype=np.float64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        nii = np.where(hull_perimeters > 0, perimeters / hull_perimeters, np.nan)
+        solidity = area[ids] / np.asarray(hull_areas, dtype=np.float64)
+
+    return pd.DataFrame({
+        "frame": np.full(len(ids), frame, dtype=np.int32),
+        "label": ids.astype(np.int32),
+        "area_px": area[ids].astype(np.int32),
+        "perimeter": perimeters.astype(np.float32),
+        "nii": nii.astype(np.float32),
+        "eccentricity": eccentricity[ids].astype(np.float32),
+        "solidity": solidity.astype(np.float32),
+    })
+
+
+def compute_morphology(masks, n_workers=None):
+    """Morphology table of all frames, processed in parallel."""
+    with Pool(n_workers) as pool:
+        tables = pool.map(frame_morphology, list_frames(masks))
+
+    if not tables:
+        return pd.DataFrame()
+
+    morphology_df = pd.concat(tables, ignore_index=True)
+    # masks are track-labelled
+    morphology_df.insert(2, "track_id", morphology_df["label"])
+    return morphology_df
+
+
+def write_table(df, path):
+    """Writes parquet when the path ends with .parquet, CSV otherwise."""
+    if os.path.splitext(path)[1].lower() == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute nuclear morphology (area, perimeter, NII, eccentricity, solidity).")
+
+    parser.add_argument("--masks", required=True, help="Track-labelled masks: folder of per-frame TIFs or a stacked TIF.")
+    parser.add_argument("--output", required=True, help="Output table (.parquet or .csv).")
+    parser.add_argument("--tracks", default=None, help="Optional tracking CSV (frame, track_id) to merge the features into.")
+    parser.add_argument("--n_workers", type=int, default=None, help="Number of processes (default: all cores).")
+
+    args = parser.parse_args()
+
+    morphology_df = compute_morphology(args.masks, n_workers=args.n_workers)
+
+    if args.tracks is not None:
+        tracks_df = pd.read_csv(args.tracks)
+        features = morphology_df.drop(columns="label")
+        # features computed here replace older ones in the tracking table
+        tracks_df = tracks_df.drop(columns=[c for c in features.columns if c in tracks_df.columns and c not in ("frame", "track_id")])
+        morphology_df = tracks_df.merge(features, on=["frame", "track_id"], how="left")
+
+    write_table(morphology_df, args.output)
+    print(f"Morphology of {len(morphology_df)} rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
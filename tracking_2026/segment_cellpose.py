@@ -33,6 +33,9 @@ Opções:
     --tile_norm    Normalização local em tiles (padrão: 100, 0=desativado)
     --gpu          Usar GPU (padrão: True)
     --ext          Extensão das imagens no modo pasta (padrão: tif)
+
+Se o servidor de segmentação (ultrack_modules/misc/segmentation_server.py)
+estiver rodando, os frames são enviados a ele e o modelo não é recarregado.
 """
 
 import argparse
@@ -42,9 +45,14 @@ from pathlib import Path
 import numpy as np
 import tifffile
 from natsort import natsorted
-from cellpose import models, io
 from roifile import ImagejRoi
 
+try:
+    from ultrack_modules.misc.segmentation_server import server_available, segment_remote
+except ImportError:  # repositório fora do PYTHONPATH → sem servidor
+    def server_available():
+        return False
+
 
 # ── argumentos ────────────────────────────────────────────────────────────────
 
@@ -85,10 +93,11 @@ def masks_to_rois(masks, frame_index):
 
 # ── carrega frames: pasta de imagens OU stack único (auto-detecta) ────────────
 
-def load_frames(input_path, ext):
+def load_frames(input_path, ext, lazy=False):
     """
     Retorna (frames, names, mode):
-      frames : lista de arrays 2D (um por frame)
+      frames : lista de arrays 2D (um por frame); no modo pasta com lazy=True,
+               lista de caminhos (lidos pelo servidor de segmentação)
       names  : nome base de cada frame (sem extensão), usado para nomear saídas
       mode   : 'folder' ou 'stack'
     """
@@ -116,23 +125,53 @@ def load_frames(input_path, ext):
         ])
         if not files:
             raise FileNotFoundError(f"Nenhuma imagem encontrada em: {p}")
-        frames = [io.imread(str(f)) for f in files]
+        if lazy:
+            frames = [str(f) for f in files]
+        else:
+            from cellpose import io
+            frames = [io.imread(str(f)) for f in files]
         names = [f.stem for f in files]
         return frames, names, "folder"
 
     raise FileNotFoundError(f"--input não existe: {p}")
 
 
+# ── segmentação: modelo local ou servidor de segmentação ─────────────────────
+
+def make_segmenter(model_kwargs, remote):
+    """
+    Retorna uma função segment(img, **eval_kwargs) -> masks.
+    img pode ser um array 2D ou, com o servidor, o caminho do frame.
+    """
+    if remote:
+        def segment(img, **eval_kwargs):
+            if isinstance(img, str):
+                return segment_remote("cellpose", path=img,
+                                      model_kwargs=model_kwargs, eval_kwargs=eval_kwargs)
+            return segment_remote("cellpose", image=img,
+                                  model_kwargs=model_kwargs, eval_kwargs=eval_kwargs)
+        return segment
+
+    from cellpose import models
+    model = models.CellposeModel(**model_kwargs)
+
+    def segment(img, **eval_kwargs):
+        masks, _flows, _styles = model.eval(img, **eval_kwargs)
+        return masks
+    return segment
+
+
 # ── main ───────────────────────────────────────────────────────────────────────
 
 def main():
     args = parse_args()
 
     input_path = Path(args.input)
+    remote = server_available()
 
     # carrega frames (pasta ou stack)
     try:
-        frames, names, mode = load_frames(args.input, args.ext)
+        frames, names, mode = load_frames(args.input, args.ext, lazy=remote)
     except (FileNotFoundError, ValueError) as e:
         print(f"[ERRO] {e}")
         return
@@ -162,9 +201,10 @@ def main():
     print(f"  Tamanho mínimo       : {args.min_size}px")
     print(f"  Tile normalization   : {'desativado' if args.tile_norm == 0 else f'bloco {args.tile_norm}px'}")
     print(f"  GPU                  : {args.gpu}")
+    print(f"  Modelo               : {'servidor de segmentação' if remote else 'carregado localmente'}")
     print(f"{'─'*58}\n")
 
-    model = models.CellposeModel(gpu=args.gpu, pretrained_model="cpsam")
+    segment = make_segmenter({"gpu": args.gpu, "pretrained_model": "cpsam"}, remote)
 
     normalize_cfg = {"tile_norm_blocksize": args.tile_norm} if args.tile_norm > 0 else True
     diameter = args.diameter if args.diameter > 0 else None
@@ -178,7 +218,7 @@ def main():
         for frame_idx, (img, name) in enumerate(zip(frames, names), 1):
             print(f"[{frame_idx:03d}/{len(frames)}] {name} ... ", end="", flush=True)
             try:
-                masks, flows, styles = model.eval(
+                masks = segment(
                     img,
                     diameter=diameter,
                     normalize=normalize_cfg,
@@ -6,31 +6,106 @@ Python model
 # imports
 import os
 
+import numpy as np
+
+######################################
+# Define global variables
+
+# Peak tracking memory per label pixel on top of the frames themselves,
+# same estimate as tracking/ultrack_track_positions.py
+TRACKING_BYTES_PER_PIXEL = 24
+
 ######################################
 # Define helper functions
 
-def create_batches(input_folder: str, output_folder: str, batch_size: int) -> None:
+def batch_bounds(n_frames: int, batch_size: int, overlap: int = 1) -> list:
+    """
+    Split n_frames into batches sharing `overlap` frames with the next one.
+    
+    Args:
+        n_frames (int): Number of frames of the video.
+        batch_size (int): Frames per batch, overlap included.
+        overlap (int): Frames shared by subsequent batches.
+    
+    Returns:
+        list: (start, stop) frame ranges, stop excluded.
+    """
+    if overlap < 1 or batch_size <= overlap:
+        raise ValueError(f"batch_size ({batch_size}) must be greater than overlap ({overlap}) and overlap at least 1")
+    
+    bounds = []
+    start = 0
+    while True:
+        stop = min(start + batch_size, n_frames)
+        bounds.append((start, stop))
+        if stop >= n_frames:
+            return bounds
+        start = stop - overlap
+
+def get_batch_size(frame_shape: tuple, dtype, memory_budget: float, overlap: int = 1) -> int:
+    """
+    Largest batch whose tracking fits the memory budget.
+    
+    Args:
+        frame_shape (tuple): Shape of one frame.
+        dtype: Frames data type.
+        memory_budget (float): Memory available to one batch (bytes).
+        overlap (int): Frames shared by subsequent batches.
+    
+    Returns:
+        int: Frames per batch, at least overlap + 1.
+    """
+    frame_bytes = int(np.prod(frame_shape)) * (np.dtype(dtype).itemsize + TRACKING_BYTES_PER_PIXEL)
+    return max(int(memory_budget // frame_bytes), overlap + 1)
+
+def iter_batches(video, batch_size: int = None, overlap: int = 1, memory_budget: float = None):
+    """
+    Yield lazy views of a video in batches, without writing any file.
+    
+    Args:
+        video: Frames array (T, ...) - dask, zarr or NumPy.
+        batch_size (int): Frames per batch, overlap included. Chosen from
+            memory_budget when None.
+        overlap (int): Frames shared by subsequent batches.
+        memory_budget (float): Memory available to one batch (bytes).
+    
+    Yields:
+        tuple: (start, stop, overlap, batch) where batch is the lazy
+            dask view of frames [start, stop).
+    """
+    if batch_size is None:
+        if memory_budget is None:
+            raise ValueError("Either batch_size or memory_budget must be set")
+        batch_size = get_batch_size(video.shape[1:], video.dtype, memory_budget, overlap)
+    
+    # slicing zarr/NumPy arrays would read the frames, dask keeps them lazy
+    if not hasattr(video, "dask"):
+        from dask.array import from_array
+        video = from_array(video, chunks=(1, *video.shape[1:]))
+    
+    for start, stop in batch_bounds(video.shape[0], batch_size, overlap):
+        yield start, stop, overlap, video[start:stop]
+
+def create_batches(input_folder: str, output_folder: str, batch_size: int, overlap: int = 1) -> None:
     """
     Create batches of files from input_folder and save them in output_folder.
+    Prefer iter_batches, which needs no files at all.
     
     Args:
         input_folder (str): Path to the folder containing files to be batched.
         output_folder (str): Path to the folder where batches will be saved.
-        batch_size (int): Number of files per batch.
+        batch_size (int): Number of files per batch, besides the overlap.
+        overlap (int): Files shared by subsequent batches.
     """
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
     
     files = [f for f in sorted(os.listdir(input_folder)) if os.path.isfile(os.path.join(input_folder, f))]
-    total_files = len(files)
     
-    for i in range(0, total_files, batch_size):
-        batch_files = files[i:i + batch_size]
-        batch_folder = os.path.join(output_folder, f"batch_{i // batch_size + 1}")
+    for index, (start, stop) in enumerate(batch_bounds(len(files), batch_size + overlap, overlap)):
+        batch_files = files[start:stop]
+        batch_folder = os.path.join(output_folder, f"batch_{index + 1}")
         os.makedirs(batch_folder, exist_ok=True)
-        
-        if i + batch_size < total_files:
-            batch_files.append(files[i + batch_size])
 
         for file in batch_files:
             src = os.path.join(input_folder, file)
@@ -67,9 +142,17 @@ def main() -> None:
                         dest="batch_size",
                         help="Number of files per batch")
     
+    parser.add_argument("-v", "--overlap",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=1,
+                        dest="overlap",
+                        help="Number of files shared by subsequent batches")
+    
     args = parser.parse_args()
 
-    create_batches(args.input_folder, args.output_folder, args.batch_size)
+    create_batches(args.input_folder, args.output_folder, args.batch_size, args.overlap)
 
     print("Batches created successfully.")
 
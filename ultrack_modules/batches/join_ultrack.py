@@ -5,11 +5,22 @@ Module that join two ultrack tables from subsequent batches
 print("Importing required libraries...")
 from argparse import ArgumentParser
 
-from pandas import read_csv, concat
-from pandas import DataFrame
-from src.aux_funcs import print_execution_parameters, enter_to_continue
+from pandas import concat
+from pandas import DataFrame, Index
+
+import numpy as np
+
+from ultrack_modules.misc.aux_funcs import print_execution_parameters, enter_to_continue
+from ultrack_modules.misc.match_detections import match_detections
+from ultrack_modules.misc.track_store import read_tracks, write_tracks
 print("All libraries imported sucessfully!")
 
+####################################
+# Define global variables
+
+# greatest centroid distance (pixels) between the same cell in both batches
+TOLERANCE : float = 1.0
+
 ####################################
 # Define Argument Parsing Function
 
@@ -45,6 +56,14 @@ def get_args_dict() -> dict:
                         dest="output",
                         help="output_path")
     
+    parser.add_argument("-t", "--tolerance",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=TOLERANCE,
+                        dest="tolerance",
+                        help="Greatest centroid distance (pixels) between the same cell in both batches")
+    
     # creating arguments dictionary
     args_dict = vars(parser.parse_args())
 
@@ -55,45 +74,40 @@ def get_args_dict() -> dict:
 # Defining helper functions
 
 def get_ids_mapper(first_last_frame:DataFrame,
-                   second_first_frame:DataFrame) -> dict:
+                   second_first_frame:DataFrame,
+                   tolerance:float = TOLERANCE) -> dict:
     """
     Function that create a dict linking:
     second_first_frame_track_id -> first_last_frame_track_id
+    Detections are matched one to one by nearest centroid within
+    tolerance, so rounding differences between batches do not break tracks
     :second_first_frame: DataFrame | df containing data from the first frame
                                      from the second video
     :first_last_frame: DataFrame | df containing data from the last frame
                                    from the first video
+    :tolerance: float | greatest centroid distance (pixels) between matched cells
     :return: dict | dictionary linking ids
     """
-    # Create id's mapper
-    ids_mapper = {}
-    # Populate ids_mapper:
-    # Iterate over cell in second video last frame
-    for id in second_first_frame["track_id"]:
-        # Get current cell data
-        second_cell_data = second_first_frame[second_first_frame["track_id"] == id]
-        x = second_cell_data["x"].item()
-        y = second_cell_data["y"].item()
-
-        # Find overlapping track in the first video
-        first_cell_data = first_last_frame[(first_last_frame["x"] == x) & (first_last_frame["y"] == y)]
-        
-        # If there is a overlapping tracking map its id in the dict
-        if len(first_cell_data["track_id"]) > 0:
-            
-            # Map id_from_second_video : id_from _first_video
-            ids_mapper[id] = first_cell_data["track_id"].item()
-    
-    # Return filled mapper
-    return ids_mapper
+    # Match all cells of the overlapping frame at once
+    first_idx, second_idx = match_detections(first_last_frame[["x", "y"]].to_numpy(),
+                                             second_first_frame[["x", "y"]].to_numpy(),
+                                             tolerance=tolerance)
+
+    # Map id_from_second_video : id_from _first_video
+    second_ids = second_first_frame["track_id"].to_numpy()[second_idx]
+    first_ids = first_last_frame["track_id"].to_numpy()[first_idx]
+
+    return dict(zip(second_ids.tolist(), first_ids.tolist()))
 
 def join_tables(first:DataFrame, 
-                second:DataFrame) -> DataFrame:
+                second:DataFrame,
+                tolerance:float = TOLERANCE) -> DataFrame:
     """
     Function that join two tables from subsequent
     tracked batches
     :first: DataFrame | Data frame with first batch tracking data
     :second: DataFrame | Data frame with second batch tracking data
+    :tolerance: float | greatest centroid distance between matched cells
     :return: DataFrame | Data frame with both batches tracking data
     """
     # Check if there is a duplicate id column and drop it
@@ -120,19 +134,33 @@ def join_tables(first:DataFrame,
     
     # Create dict linking track_id_second:track_id_first
     ids_mapper  = get_ids_mapper(first_last_frame=first_last,
-                                 second_first_frame=second_first)
+                                 second_first_frame=second_first,
+                                 tolerance=tolerance)
+
+    if ids_mapper:
+        # Second batch ids are offset past every first batch id, so renamed
+        # tracks are exactly the ones now holding a first batch id
+        second_ids = Index(list(ids_mapper.keys()))
+        first_ids = np.fromiter(ids_mapper.values(), dtype=np.int64, count=len(ids_mapper))
 
-    for second_id, first_id in ids_mapper.items():
         # track_id
-        second.loc[second["track_id"] == second_id, "track_id"] = first_id
+        track_ids = second["track_id"].to_numpy().copy()
+        positions = second_ids.get_indexer(track_ids)
+        track_ids[positions >= 0] = first_ids[positions[positions >= 0]]
+        second["track_id"] = track_ids
+
+        # parents of the continued tracks, as in the first batch last frame
+        first_parents = first_last.set_index("track_id")[["parent_track_id", "parent_id"]]
+        continued = second["track_id"].isin(first_ids).to_numpy()
+        continued_ids = second.loc[continued, "track_id"]
+
         # parent_track_id
-        second.loc[second["track_id"] == first_id, 
-                "parent_track_id"] = first_last.loc[first_last["track_id"] == first_id, 
-                                                    "parent_track_id"].item()
-        # parent_id
-        second.loc[(second["track_id"] == first_id) & (second["t"] == last_frame_index),
-                                    "parent_id"] = first_last.loc[first_last["track_id"] == first_id,
-                                                                "parent_id"].item()
+        second.loc[continued, "parent_track_id"] = first_parents["parent_track_id"].reindex(continued_ids).to_numpy()
+
+        # parent_id, only on the overlapping frame
+        overlap = continued & (second["t"] == last_frame_index).to_numpy()
+        overlap_ids = second.loc[overlap, "track_id"]
+        second.loc[overlap, "parent_id"] = first_parents["parent_id"].reindex(overlap_ids).to_numpy()
     
     joined_df = concat([first[first["t"] != last_frame_index], second])
     
@@ -154,22 +182,24 @@ def main() -> None:
     first_path  = args_dict["first_table"]
     second_path = args_dict["second_table"]
     output_path = args_dict["output"]
+    tolerance   = args_dict["tolerance"]
     
     print_execution_parameters(args_dict)
     enter_to_continue()
 
     # Create input tables Dataframes
-    first_table  = read_csv(first_path)
-    second_table = read_csv(second_path)
+    first_table  = read_tracks(first_path)
+    second_table = read_tracks(second_path)
     
     print("Joining Tables...")
     # Assign the joined tables to a variable
     joined_table = join_tables(first=first_table,
-                               second=second_table)
+                               second=second_table,
+                               tolerance=tolerance)
     
     print("Exporting_data...")
     # Export joined table
-    joined_table.to_csv(output_path, index=False)
+    write_tracks(joined_table, output_path)
     
     print("Done!")
 
@@ -1,4 +1,4 @@
-# Module to join several ultrack output CSVs from the same video
+# Module to join several ultrack output tables (.csv or .parquet) from the same video
 
 ######################################################################
 
@@ -6,12 +6,30 @@
 print("Importing Libraries...")
 from os import listdir
 from os.path import join
-from pandas import DataFrame, read_csv
-from src.aux_funcs import enter_to_continue, print_execution_parameters, print_progress_message
-from src.tracking.ultrack.misc.tables.join_ultrack import join_tables
+from concurrent.futures import ThreadPoolExecutor
+from pandas import DataFrame, Index, concat
 from argparse import ArgumentParser
+import numpy as np
+from ultrack_modules.misc.aux_funcs import enter_to_continue, print_execution_parameters, print_progress_message
+from ultrack_modules.misc.match_detections import match_detections
+from ultrack_modules.misc.track_store import read_tracks, write_tracks, is_parquet
 print("All libraries imported!")
 
+######################################################################
+# Define global variables
+
+# greatest centroid distance (pixels) between the same cell in adjacent batches
+TOLERANCE : float = 1.0
+
+# node ids of a batch are shifted by (frame offset) * ID_FRAME_STEP
+ID_FRAME_STEP : int = 10**6
+
+# smallest overlap IoU between the same track in adjacent batches
+MIN_IOU : float = 0.5
+
+# largest dense contingency table (cells), sparser overlaps use np.unique
+MAX_DENSE_PAIRS : int = 2**26
+
 ######################################################################
 # argument parsing related functions
 
@@ -33,12 +51,36 @@ def get_args_dict() -> dict:
                         required=True,
                         dest="input_path",
                         help="Path to the folder with the ultrack outputs")
-    
+
     parser.add_argument("-o", "--output",
                         action="store",
                         required=True,
                         dest="output_path",
-                        help="Name of the csv file with all tables joined")
+                        help="Name of the table (.csv or .parquet) with all tables joined")
+
+    parser.add_argument("-t", "--tolerance",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=TOLERANCE,
+                        dest="tolerance",
+                        help="Greatest centroid distance (pixels) between the same cell in adjacent batches")
+
+    parser.add_argument("--n_workers",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=None,
+                        dest="n_workers",
+                        help="Threads used to match the overlapping frames (default: all cores)")
+
+    parser.add_argument("-v", "--overlap",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=1,
+                        dest="overlap",
+                        help="Number of frames shared by subsequent batches")
 
     # creating arguments dictionary
     args_dict = vars(parser.parse_args())
@@ -48,25 +90,333 @@ def get_args_dict() -> dict:
 
 ######################################################################
 
-# Define function
+# Define functions
+
+def overlap_mapping(first:DataFrame, second:DataFrame, tolerance:float = TOLERANCE,
+                    first_frame:int = None, second_frame:int = None) -> tuple:
+    """
+    Function that matches the cells of a frame shared by a batch and the
+    next one (by default the last frame of the first batch and the first
+    frame of the second), in the local ids of each batch
+    :first: DataFrame | batch tracking data
+    :second: DataFrame | next batch tracking data
+    :tolerance: float | greatest centroid distance between matched cells
+    :first_frame: int | local index of the shared frame in the first batch
+    :second_frame: int | local index of the shared frame in the second batch
+    :return: tuple | (first_rows, second_rows) positional indices of the matched rows
+    """
+    first_frame = first["t"].max() if first_frame is None else first_frame
+    second_frame = second["t"].min() if second_frame is None else second_frame
+
+    first_rows = np.flatnonzero(first["t"].to_numpy() == first_frame)
+    second_rows = np.flatnonzero(second["t"].to_numpy() == second_frame)
+
+    first_idx, second_idx = match_detections(first[["x", "y"]].to_numpy()[first_rows],
+                                             second[["x", "y"]].to_numpy()[second_rows],
+                                             tolerance=tolerance)
+
+    return first_rows[first_idx], second_rows[second_idx]
 
-def join_tables_list(tables:list[DataFrame]) -> DataFrame:
+def compact_labels(labels:np.ndarray) -> tuple:
+    """
+    Function that renumbers labels to 0..n-1 (0 stays background) with a
+    lookup table, linear in pixels
+    :labels: np.ndarray | flat labels
+    :return: tuple | (compact labels, original label of every compact label)
+    """
+    present = np.bincount(labels) > 0
+    present[0] = True
+    lookup = np.cumsum(present) - 1
+    return lookup[labels], np.flatnonzero(present)
+
+def iou_mapping(first_labels:np.ndarray, second_labels:np.ndarray, min_iou:float = MIN_IOU) -> tuple:
+    """
+    Function that matches the tracks of two batches by the IoU of their
+    masks over all the overlap frames, so every frame votes. The
+    contingency table of the paired labels comes from a single bincount.
+    :first_labels: np.ndarray | (O, ...) track labelled masks of the overlap in the first batch
+    :second_labels: np.ndarray | (O, ...) track labelled masks of the overlap in the second batch
+    :min_iou: float | smallest IoU of a match
+    :return: tuple | (first_tracks, second_tracks) matched track ids
+    """
+    first_flat, first_ids = compact_labels(np.asarray(first_labels).ravel().astype(np.intp))
+    second_flat, second_ids = compact_labels(np.asarray(second_labels).ravel().astype(np.intp))
+    n_first, n_second = len(first_ids), len(second_ids)
+
+    first_area = np.bincount(first_flat, minlength=n_first)
+    second_area = np.bincount(second_flat, minlength=n_second)
+
+    # pixel counts of every (first, second) pair present in both masks
+    both = (first_flat > 0) & (second_flat > 0)
+    pairs = first_flat[both] * n_second + second_flat[both]
+    if n_first * n_second <= MAX_DENSE_PAIRS:
+        counts = np.bincount(pairs, minlength=n_first * n_second)
+        pairs = np.flatnonzero(counts)
+        counts = counts[pairs]
+    else:
+        pairs, counts = np.unique(pairs, return_counts=True)
+
+    first_idx, second_idx = np.divmod(pairs, n_second)
+    iou = counts / (first_area[first_idx] + second_area[second_idx] - counts)
+
+    # greedy on decreasing IoU, each track matched once
+    order = np.argsort(-iou, kind="stable")
+    order = order[iou[order] >= min_iou]
+
+    used_first = np.zeros(n_first, dtype=bool)
+    used_second = np.zeros(n_second, dtype=bool)
+    keep = []
+    for k in order:
+        i, j = first_idx[k], second_idx[k]
+        if not used_first[i] and not used_second[j]:
+            used_first[i] = used_second[j] = True
+            keep.append(k)
+
+    keep = np.asarray(keep, dtype=np.int64)
+    return first_ids[first_idx[keep]], second_ids[second_idx[keep]]
+
+def matched_rows(first:DataFrame, second:DataFrame, first_tracks:np.ndarray, second_tracks:np.ndarray,
+                 first_frame:int, second_frame:int) -> tuple:
+    """
+    Function that finds the rows of matched tracks on the frame shared by
+    two batches, dropping pairs missing from it in either batch
+    :first: DataFrame | batch tracking data
+    :second: DataFrame | next batch tracking data
+    :first_tracks: np.ndarray | matched track ids of the first batch
+    :second_tracks: np.ndarray | matched track ids of the second batch
+    :first_frame: int | local index of the shared frame in the first batch
+    :second_frame: int | local index of the shared frame in the second batch
+    :return: tuple | (first_rows, second_rows) positional indices of the matched rows
+    """
+    first_at = np.flatnonzero(first["t"].to_numpy() == first_frame)
+    second_at = np.flatnonzero(second["t"].to_numpy() == second_frame)
+
+    first_pos = Index(first["track_id"].to_numpy()[first_at]).get_indexer(first_tracks)
+    second_pos = Index(second["track_id"].to_numpy()[second_at]).get_indexer(second_tracks)
+
+    both = (first_pos >= 0) & (second_pos >= 0)
+    return first_at[first_pos[both]], second_at[second_pos[both]]
+
+def track_parents(table:DataFrame, max_id:int) -> np.ndarray:
+    """
+    Function that returns the parent track of every track of a batch
+    :table: DataFrame | batch tracking data
+    :max_id: int | greatest track id of the batch
+    :return: np.ndarray | parent track id indexed by track id (-1 if none)
+    """
+    parents = np.full(max_id + 1, -1, dtype=np.int64)
+    tracks = table.drop_duplicates("track_id")
+    parents[tracks["track_id"].to_numpy()] = tracks["parent_track_id"].to_numpy()
+    return parents
+
+class BatchStitcher:
+    """
+    Joins the trackings of subsequent batches (each batch sharing `overlap`
+    frames with the previous one) in a single pass. Batches may be added
+    in any order, as they finish tracking; each one is shifted and remapped
+    with array lookups as soon as the batches before it are in, composing
+    the overlap matches into one global track id table. Tracks are cut at
+    the middle frame of each overlap, frames before it are kept from the
+    previous batch and frames from it on from the next one.
+    Tracks are matched by centroid on the cut frame or, when the batches
+    track labelled masks are given, by mask IoU over all overlap frames.
+    :tolerance: float | greatest centroid distance between matched cells
+    :overlap: int | frames shared by subsequent batches
+    :min_iou: float | smallest overlap IoU between matched tracks (IoU mode)
+    """
+    def __init__(self, tolerance:float = TOLERANCE, overlap:int = 1, min_iou:float = MIN_IOU):
+        self.tolerance = tolerance
+        self.min_iou = min_iou
+        self.overlap = overlap
+        self.pending = {}
+        self.stitched = []
+        self.previous = None
+        self.frame_offset = 0
+        self.track_offset = 0
+
+    def add(self, index:int, table:DataFrame, match:tuple = None, start:int = None,
+            labels = None, track_match:tuple = None) -> None:
+        """
+        Function that adds a batch and stitches every batch now in order
+        :index: int | batch position in the video (zero based)
+        :table: DataFrame | batch tracking data
+        :match: tuple | precomputed overlap_mapping with the previous batch
+        :start: int | first frame of the batch in the video, if None it is
+                      taken from the previous batch last tracked frame and the overlap
+        :labels: track labelled masks of the batch (zarr or NumPy), enables IoU matching
+        :track_match: tuple | precomputed iou_mapping with the previous batch
+        """
+        self.pending[index] = (table, match, start, labels, track_match)
+
+        while len(self.stitched) in self.pending:
+            self._stitch(*self.pending.pop(len(self.stitched)))
+
+    def _stitch(self, table:DataFrame, match:tuple = None, start:int = None,
+                labels = None, track_match:tuple = None) -> None:
+        """
+        Function that shifts and remaps the next batch in order
+        :table: DataFrame | batch tracking data
+        :match: tuple | precomputed overlap_mapping with the previous batch
+        :start: int | first frame of the batch in the video
+        :labels: track labelled masks of the batch
+        :track_match: tuple | precomputed iou_mapping with the previous batch
+        """
+        # Drop duplicated id columns
+        if "id.1" in table.columns:
+            table = table.drop(columns="id.1")
+
+        previous = self.previous
+        if start is not None:
+            self.frame_offset = start
+
+        # first frame kept from this batch
+        cut = self.overlap // 2 if previous is not None else 0
+
+        track_ids = table["track_id"].to_numpy()
+        max_id = int(track_ids.max())
+
+        # global id of every local track id
+        global_ids = np.arange(max_id + 1, dtype=np.int64) + self.track_offset
+
+        parent_ids = table["parent_id"].to_numpy().copy()
+        parent_ids[parent_ids >= 0] += self.frame_offset * ID_FRAME_STEP
+
+        if previous is not None:
+            first_frame = self.frame_offset + cut - previous["start"]
+
+            if track_match is None and labels is not None and previous["labels"] is not None:
+                shared = previous["start"] + len(previous["labels"]) - self.frame_offset
+                track_match = iou_mapping(previous["labels"][self.frame_offset - previous["start"]:],
+                                          labels[:shared], self.min_iou)
+
+            if track_match is not None:
+                first_tracks, second_tracks = (np.asarray(item, dtype=np.int64) for item in track_match)
+                first_rows, second_rows = matched_rows(previous["table"], table, first_tracks, second_tracks,
+                                                       first_frame, cut)
+            else:
+                if match is None:
+                    match = overlap_mapping(previous["table"], table, self.tolerance,
+                                            first_frame=first_frame, second_frame=cut)
+                first_rows, second_rows = match
+                first_tracks = previous["track_id"][first_rows]
+                second_tracks = track_ids[second_rows]
+
+            # continued tracks keep the id of the previous batch
+            global_ids[second_tracks] = previous["global_ids"][first_tracks]
+
+            # rows at the cut link to the previous batch, or start a track
+            at_cut = np.flatnonzero(table["t"].to_numpy() == cut)
+            if cut > 0:
+                parent_ids[at_cut] = -1
+            parent_ids[second_rows] = previous["parent_id"][first_rows]
+
+            # the overlap from the cut on is kept from this batch
+            last = self.stitched[-1]
+            self.stitched[-1] = last[last["t"] < self.frame_offset + cut]
+
+        # global parent track of every local track id
+        local_parents = track_parents(table, max_id)
+        has_parent = (local_parents > 0) & (local_parents <= max_id)
+        global_parents = np.where(has_parent, global_ids[np.clip(local_parents, 0, max_id)], -1)
+
+        if previous is not None:
+            # continued tracks keep the parent of the previous batch
+            global_parents[second_tracks] = previous["global_parents"][first_tracks]
+
+        # Apply offsets and remaps
+        batch = table.copy()
+        batch["t"] = table["t"].to_numpy() + self.frame_offset
+        batch["id"] = table["id"].to_numpy() + self.frame_offset * ID_FRAME_STEP
+        batch["track_id"] = global_ids[track_ids]
+        batch["parent_track_id"] = global_parents[track_ids]
+        batch["parent_id"] = parent_ids
+
+        self.stitched.append(batch[batch["t"] >= self.frame_offset + cut])
+
+        # local lookups of this batch for the next overlap
+        self.previous = {"table"            : table,
+                         "start"            : self.frame_offset,
+                         "labels"           : labels,
+                         "track_id"         : track_ids,
+                         "parent_id"        : parent_ids,
+                         "global_ids"       : global_ids,
+                         "global_parents"   : global_parents}
+
+        # next batch start, unless given
+        self.frame_offset = int(batch["t"].max()) - (self.overlap - 1)
+        self.track_offset += max_id
+
+    def result(self) -> DataFrame:
+        """
+        Function that concatenates the stitched batches
+        :return: DataFrame | table with the joined data of all batches
+        """
+        if self.pending:
+            raise ValueError(f"Batches missing before batch {min(self.pending)}, "
+                             f"only {len(self.stitched)} batches could be stitched")
+
+        return concat(self.stitched, ignore_index=True)
+
+def stitch_batches(tables:list[DataFrame], tolerance:float = TOLERANCE, n_workers:int = None,
+                   overlap:int = 1, starts:list = None, labels:list = None,
+                   min_iou:float = MIN_IOU) -> DataFrame:
+    """
+    Function that joins the trackings of subsequent batches in a single
+    pass. The overlaps are matched independently, in parallel, and all
+    batches are concatenated once.
+    :tables: list | DataFrames with the batches tracking data, in order
+    :tolerance: float | greatest centroid distance between matched cells
+    :n_workers: int | threads used to match the overlaps
+    :overlap: int | frames shared by subsequent batches
+    :starts: list | first frame of every batch in the video, if None each
+                    batch starts overlap frames before the previous batch last tracked frame
+    :labels: list | track labelled masks of every batch, if set tracks are
+                    matched by mask IoU over the overlap frames
+    :min_iou: float | smallest overlap IoU between matched tracks
+    :return: DataFrame | table with the joined data from all batches
+    """
+    if starts is None:
+        starts = [0]
+        for table in tables[:-1]:
+            starts.append(starts[-1] + int(table["t"].max()) - (overlap - 1))
+
+    # Match every overlap at once, on its middle frame
+    cut = overlap // 2
+    first_frames = [start + cut - previous for previous, start in zip(starts[:-1], starts[1:])]
+
+    with ThreadPoolExecutor(n_workers) as executor:
+        if labels is None:
+            matches = list(executor.map(overlap_mapping, tables[:-1], tables[1:], [tolerance] * (len(tables) - 1),
+                                        first_frames, [cut] * (len(tables) - 1)))
+        else:
+            # masks of the frames shared by each pair of batches
+            firsts = [labels[k][start - starts[k]:] for k, start in enumerate(starts[1:])]
+            seconds = [labels[k + 1][:len(first)] for k, first in enumerate(firsts)]
+            track_matches = list(executor.map(iou_mapping, firsts, seconds, [min_iou] * len(firsts)))
+
+    stitcher = BatchStitcher(tolerance, overlap, min_iou)
+    for index, table in enumerate(tables):
+        print_progress_message("Stitching batches: ", index, len(tables))
+        if labels is None:
+            stitcher.add(index, table, matches[index - 1] if index > 0 else None, start=starts[index])
+        else:
+            stitcher.add(index, table, start=starts[index],
+                         track_match=track_matches[index - 1] if index > 0 else None)
+
+    return stitcher.result()
+
+def join_tables_list(tables:list[DataFrame], tolerance:float = TOLERANCE, n_workers:int = None,
+                     overlap:int = 1) -> DataFrame:
     """
     Function that receives a tables_list with several ultrack outputs from batches
     from the same video and returns a DataFrame with all csvs data together
     :tables: list | List with DataFrames
+    :tolerance: float | greatest centroid distance between matched cells
+    :n_workers: int | threads used to match the overlaps
+    :overlap: int | frames shared by subsequent batches
     :return: DataFrame | table with the joined data from the tables list
     """
-
-    # Current file = first file in the folder
-    current = tables[0]
-
-    # for each file in the folder join current with the next one
-    for index, i in enumerate(tables[1:]):
-        print_progress_message("Joining trackings: ", index, len(tables[1:]))
-        current = join_tables(current, i)
-
-    return current
+    return stitch_batches(tables, tolerance=tolerance, n_workers=n_workers, overlap=overlap)
 
 ######################################################################
 # Define main function
@@ -74,32 +424,36 @@ def join_tables_list(tables:list[DataFrame]) -> DataFrame:
 def main() -> None:
     """
     Module main function
-    :return: None 
+    :return: None
     """
     # Get arguments
     args_dict = get_args_dict()
-    
+
     # Assign arguments to variables
     input_path = args_dict["input_path"]
     output_path = args_dict["output_path"]
-    
+
     # Print execution parameters and wait user response
     print_execution_parameters(args_dict)
     enter_to_continue()
-    
-    # Get a list of files in order
-    files = list(map(lambda x : join(input_path, x), sorted(listdir(input_path))))
+
+    # Get a list of the tables in order
+    files = [join(input_path, x) for x in sorted(listdir(input_path))
+             if x.lower().endswith(".csv") or is_parquet(x)]
 
     # open all files
-    tables = list(map(read_csv, files))
-        
+    tables = list(map(read_tracks, files))
+
     # Join tables
-    joined_data = join_tables_list(tables=tables)
-    
+    joined_data = join_tables_list(tables=tables,
+                                   tolerance=args_dict["tolerance"],
+                                   n_workers=args_dict["n_workers"],
+                                   overlap=args_dict["overlap"])
+
     # Export data
-    joined_data.to_csv(output_path, index=False)    
-    
-    
+    write_tracks(joined_data, output_path)
+
+
 ######################################################################
 # Call main function
 if __name__ == "__main__":
@@ -1,7 +1,7 @@
 """
 Complete tracking pipeline using ultrack
 input = cell video
-output = tracking.csv
+output = tracking.csv (or tracking.parquet)
 """
 ####################################
 print("Importing required libraries...")
@@ -16,12 +16,24 @@ from dask.array.core import Array
 from dask.array import from_zarr
 
 from os.path import join
-from os import makedirs
+from os import makedirs, cpu_count
 
-from src.aux_funcs import print_execution_parameters, enter_to_continue
-from src.tracking.misc.create_batches import create_batches, save_dask_image_batch
-from src.tracking.ultrack.misc.tables.join_ultrack_batches_output import join_tables_list
-from src.tracking.ultrack.tracking.ultrack_track_video import track_video
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from ultrack import load_config
+
+from psutil import virtual_memory
+
+from zarr import open as open_zarr
+
+from ultrack_modules.misc.aux_funcs import print_execution_parameters, enter_to_continue, print_progress_message
+from ultrack_modules.batches.create_batches import iter_batches
+from ultrack_modules.batches.join_ultrack_batches_output import BatchStitcher
+from ultrack_modules.tracking.ultrack_track_video import track_video
+from ultrack_modules.tracking.ultrack_track_positions import BYTES_PER_PIXEL, config_cores, get_concurrency
+from ultrack_modules.tracking.ultrack_track_engine import TRACK_LABELS
+from ultrack_modules.misc.track_store import write_tracks
 
 print("All libraries imported sucessfully!")
 
@@ -68,6 +80,69 @@ def get_args_dict() -> dict:
                         dest="batch_size",
                         help="add this to save the aligned images")
     
+    parser.add_argument("--overlap",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=1,
+                        dest="overlap",
+                        help="Number of frames shared by subsequent batches")
+    
+    parser.add_argument("--batch_memory",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=None,
+                        dest="batch_memory",
+                        help="Memory budget of one batch in GB, sets the batch size instead of --batch_size")
+    
+    parser.add_argument("--stitch",
+                        action="store",
+                        required=False,
+                        default="centroid",
+                        choices=STITCH_MODES,
+                        dest="stitch",
+                        help="How batches are stitched: centroid matching on the overlap middle frame, "
+                             "or IoU of the track labelled masks over all overlap frames")
+    
+    parser.add_argument("--output_format",
+                        action="store",
+                        required=False,
+                        default="csv",
+                        choices=tuple(OUTPUT_FORMATS),
+                        dest="output_format",
+                        help="Format of the tracking table: csv or parquet (columnar, typed, faster to read back)")
+    
+    parser.add_argument("--parallel",
+                        action="store_true",
+                        required=False,
+                        dest="parallel",
+                        help="add this to track batches concurrently, each in its own working directory")
+    
+    parser.add_argument("--cores",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=None,
+                        dest="cores",
+                        help="Cores available to the parallel mode (default: all)")
+    
+    parser.add_argument("--memory",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=None,
+                        dest="memory",
+                        help="Memory available to the parallel mode in GB (default: 80%% of the available memory)")
+    
+    parser.add_argument("--n_workers",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=None,
+                        dest="n_workers",
+                        help="Cap on the config workers/threads of each batch in parallel mode (default: as in the config)")
+    
     parser.add_argument("--save_aligned_images",
                         action="store_true",
                         required=False,
@@ -85,6 +160,14 @@ def get_args_dict() -> dict:
 # Create global variables
 SAVE_ALIGNED_IMAGES : bool = False
 BATCH_SIZE : int           = 30
+OVERLAP : int              = 1
+BATCH_MEMORY : float       = None
+STITCH_MODES : tuple       = ("centroid", "iou")
+OUTPUT_FORMATS : dict      = {"csv"     : "tracking.csv",
+                              "parquet" : "tracking.parquet"}
+
+# tracking of every finished batch, saved in its working directory
+BATCH_TRACKS : str         = "tracks.parquet"
 
 ####################################
 # Defining helper functions
@@ -106,16 +189,121 @@ def save_dask_image(image:Array, block_info = None,**kwargs) -> Array:
     return image   
     
 
-def tracking_pipeline(input_path:str, config_file:str ,output_path:str) -> None:
+def batch_working_dir(output_path:str, index:int) -> str:
+    """
+    Function that returns the private working directory of a batch
+    :output_path: str | pipeline output folder
+    :index: int | batch index
+    :return: str | working directory
+    """
+    return join(output_path, "batches", f"batch_{index:04d}")
+
+def batch_labels(working_dir:str):
+    """
+    Function that opens the track labelled masks of a tracked batch
+    :working_dir: str | batch working directory
+    :return: zarr.Array | track labelled masks, read lazily
+    """
+    return open_zarr(join(working_dir, TRACK_LABELS), mode="r")
+
+def _track_batch_job(job:tuple) -> tuple:
+    """
+    Function that tracks one batch in its private working directory
+    :job: tuple | (index, batch, config_file, working_dir, n_workers)
+    :return: tuple | (index, batch tracks DataFrame)
+    """
+    index, batch, config_file, working_dir, n_workers = job
+    
+    tracks_df = track_video(video=batch, config_file=config_file,
+                            working_dir=working_dir, config_workers=n_workers)
+    
+    return index, tracks_df
+
+def track_batches_parallel(batches:list,
+                           config_file:str,
+                           output_path:str,
+                           stitcher:BatchStitcher,
+                           cores:int = None,
+                           memory:float = None,
+                           n_workers:int = None,
+                           stitch:str = "centroid") -> None:
+    """
+    Function that tracks the batches concurrently, as many at once as the
+    cores and memory allow, each one with its own working directory and
+    database, adding every tracking to the stitcher as soon as it finishes.
+    Every finished tracking is also saved in its working directory, so a
+    failed batch (worker error or crash) does not discard the others; the
+    failed batches are reported once all batches are done.
+    :batches: list | (start, stop, overlap, dask.Array) batches of the video
+    :config_file: str | path to ultrack configuration file
+    :output_path: str | output folder, the working directories go to output_path/batches
+    :stitcher: BatchStitcher | stitcher receiving the batches trackings
+    :cores: int | cores available (default: all)
+    :memory: float | memory available in bytes (default: 80% of the available memory)
+    :n_workers: int | cap on the config workers/threads of each batch
+    :stitch: str | "centroid" or "iou" (passes the batches masks to the stitcher)
+    :return: None
+    """
+    cores = cores or cpu_count() or 1
+    memory = memory or 0.8 * virtual_memory().available
+    
+    config = load_config(config_file)
+    cores_per_batch = config_cores(config) if n_workers is None else min(config_cores(config), n_workers)
+    memory_per_batch = max(float(batch.size) * (batch.dtype.itemsize + BYTES_PER_PIXEL) for *_, batch in batches)
+    
+    n_concurrent = get_concurrency(len(batches), cores_per_batch, memory_per_batch, cores, memory)
+    print(f"Tracking {len(batches)} batches, {n_concurrent} at once")
+    
+    jobs = [(index, batch, config_file, batch_working_dir(output_path, index), n_workers)
+            for index, (*_, batch) in enumerate(batches)]
+    
+    # spawn, worker processes must be able to start their own pools
+    with ProcessPoolExecutor(n_concurrent, mp_context=get_context("spawn")) as executor:
+        futures = {executor.submit(_track_batch_job, job) : job[0] for job in jobs}
+        
+        # stream trackings into the stitcher as they finish
+        failed = {}
+        for done, future in enumerate(as_completed(futures)):
+            try:
+                index, tracks_df = future.result()
+            except Exception as error:
+                # a crashed worker (BrokenProcessPool) fails every batch not yet finished
+                failed[futures[future]] = error
+                print(f"Batch {futures[future]} failed: {error!r}")
+                continue
+            
+            write_tracks(tracks_df, join(jobs[index][3], BATCH_TRACKS))
+            labels = batch_labels(jobs[index][3]) if stitch == "iou" else None
+            stitcher.add(index, tracks_df, start=batches[index][0], labels=labels)
+            print_progress_message("Tracked batches: ", done, len(jobs))
+    
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(jobs)} batches failed: "
+                           + ", ".join(f"batch {index} ({error!r})" for index, error in sorted(failed.items()))
+                           + f". The trackings of the other batches are saved as {BATCH_TRACKS} "
+                           + f"in their working directories under {join(output_path, 'batches')}")
+
+def tracking_pipeline(input_path:str, config_file:str ,output_path:str,
+                      parallel:bool = False, cores:int = None,
+                      memory:float = None, n_workers:int = None,
+                      stitch:str = "centroid", output_format:str = "csv") -> None:
     """
     Complete tracking pipeline function, from video to tracking
     :input_path: str | path where the cell images are
     :output_path: str | path to save the output
+    :parallel: bool | track batches concurrently, each in its own working directory
+    :cores: int | cores available to the parallel mode
+    :memory: float | memory available to the parallel mode (bytes)
+    :n_workers: int | cap on the config workers/threads of each batch
+    :stitch: str | "centroid" or "iou" stitching of the batches
+    :output_format: str | "csv" or "parquet" tracking table
     """
     
     # get access to global variables
     global SAVE_ALIGNED_IMAGES
     global BATCH_SIZE
+    global OVERLAP
+    global BATCH_MEMORY
     
     # open images
     images : Array = imread(join(input_path, "*"))
@@ -136,28 +324,37 @@ def tracking_pipeline(input_path:str, config_file:str ,output_path:str) -> None:
         save_images.map_blocks(save_dask_image, dtype=save_images.dtype,
                                   output_dir = aligned_dir, prefix = "aligned").compute()
     
-    # create batches
-    batches = create_batches(input_video = aligned_images, 
-                             batch_size = BATCH_SIZE)
+    # create batches, lazy views of the video
+    batch_size = None if BATCH_MEMORY else BATCH_SIZE
+    batches = list(iter_batches(aligned_images, batch_size=batch_size,
+                                overlap=OVERLAP, memory_budget=BATCH_MEMORY))
     
-    # create list to store batches tracks
-    batches_tracks = []
+    # batches trackings are stitched as they arrive
+    stitcher = BatchStitcher(overlap=OVERLAP)
     
+    if parallel:
+        track_batches_parallel(batches, config_file, output_path, stitcher,
+                               cores=cores, memory=memory, n_workers=n_workers, stitch=stitch)
     
-    # iterate over batches:
-    for index, batch in enumerate(batches):
-        
-        # track batch
-        batch_tracking = track_video(video=batch, config_file=config_file)
+    else:
+        # iterate over batches:
+        for index, (start, stop, overlap, batch) in enumerate(batches):
+            
+            # IoU stitching reads the masks of every batch, so each one keeps its own working directory
+            working_dir = batch_working_dir(output_path, index) if stitch == "iou" else None
+            
+            # track batch
+            batch_tracking = track_video(video=batch, config_file=config_file, working_dir=working_dir)
 
-        # save track
-        batches_tracks.append(batch_tracking)
+            # stitch track
+            labels = batch_labels(working_dir) if stitch == "iou" else None
+            stitcher.add(index, batch_tracking, start=start, labels=labels)
 
     # join all tracks
-    joined_tracks = join_tables_list(tables=batches_tracks)
+    joined_tracks = stitcher.result()
     
     # export
-    joined_tracks.to_csv(join(output_path, "tracking.csv"), index=False)
+    write_tracks(joined_tracks, join(output_path, OUTPUT_FORMATS[output_format]))
     
     # overlay
 
@@ -171,6 +368,8 @@ def main() -> None:
     # get access to global variables
     global SAVE_ALIGNED_IMAGES
     global BATCH_SIZE
+    global OVERLAP
+    global BATCH_MEMORY
 
     # Getting cli arguments dict
     args_dict = get_args_dict()
@@ -183,13 +382,19 @@ def main() -> None:
     # edit global variables
     SAVE_ALIGNED_IMAGES = args_dict["save_aligned_images"]
     BATCH_SIZE          = args_dict["batch_size"]
+    OVERLAP             = args_dict["overlap"]
+    BATCH_MEMORY        = args_dict["batch_memory"] * 1e9 if args_dict["batch_memory"] else None
     
     # cli interface
     print_execution_parameters(args_dict)
     enter_to_continue()
     
     # call pipeline function
-    tracking_pipeline(input_path=input_path, config_file=config_file ,output_path=output_path)
+    tracking_pipeline(input_path=input_path, config_file=config_file ,output_path=output_path,
+                      parallel=args_dict["parallel"], cores=args_dict["cores"],
+                      memory=args_dict["memory"] * 1e9 if args_dict["memory"] else None,
+                      n_workers=args_dict["n_workers"], stitch=args_dict["stitch"],
+                      output_format=args_dict["output_format"])
     
     print("Done!")
     
@@ -4,7 +4,17 @@ Python model
 
 ######################################
 # imports
-from pandas import DataFrame, read_csv
+from pandas import DataFrame, Categorical
+
+import numpy as np
+
+from ultrack_modules.misc.track_store import load_track_table, write_tracks
+from ultrack_modules.misc.lineage_index import LineageIndex
+
+######################################
+# Define global variables
+
+FATES : list = ["mitosis", "lived", "death"]
 
 ######################################
 # Define helper functions
@@ -19,25 +29,17 @@ def add_fate_to_ultrack_table(ultrack_table : DataFrame) -> DataFrame:
     return : DataFrame | Ultrack DataFrame with fate collumn added
     """
     
-    new_table = ultrack_table
-
-    # Get max_frame
-    max_frame = ultrack_table.t.max()
-    
-    # get parent_ids
-    parent_ids = ultrack_table[ultrack_table["track_id"].isin(ultrack_table["parent_track_id"])].track_id.unique()
+    lineage = LineageIndex.from_table(ultrack_table)
 
-    last_frame_ids = new_table[new_table["t"] == max_frame].track_id.unique()
+    # parents are mitosis, tracks reaching the last frame lived, the others died
+    is_parent = lineage.n_children() > 0
+    lived = lineage.death == lineage.death.max()
 
-    for id in ultrack_table.track_id.unique():
-        if id in parent_ids:
-            new_table.loc[new_table.track_id == id, "fate"] = "mitosis"
-        elif id in last_frame_ids:
-            new_table.loc[new_table.track_id == id, "fate"] = "lived"
-        else:
-            new_table.loc[new_table.track_id == id, "fate"] = "death"
+    codes = np.where(is_parent, 0, np.where(lived, 1, 2)).astype(np.int8)
+    rows = lineage.position(ultrack_table["track_id"].to_numpy())
+    ultrack_table["fate"] = Categorical.from_codes(codes[rows], categories=FATES)
 
-    return new_table
+    return ultrack_table
 
 ######################################
 # Define main function
@@ -54,7 +56,7 @@ def main() -> None:
                         action="store",
                         required=True,
                         dest="input",
-                        help="Ultrack table (.csv)")
+                        help="Ultrack table (.csv or .parquet)")
    
     parser.add_argument("-o", "--output",
                         action="store",
@@ -65,13 +67,13 @@ def main() -> None:
 
     args_dict = vars(parser.parse_args())
 
-    input_df = read_csv(args_dict["input"])
+    input_df, _, _ = load_track_table(args_dict["input"])
 
     output_df = add_fate_to_ultrack_table(input_df)
 
     save_path = args_dict["output"] if args_dict["output"] else args_dict["input"]
     
-    output_df.to_csv(save_path, index = False)
+    write_tracks(output_df, save_path)
 
 
 ######################################
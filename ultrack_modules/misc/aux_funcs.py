@@ -0,0 +1,41 @@
+"""
+Module with small cli helpers shared by the command line modules
+"""
+####################################
+# Defining helper functions
+
+def print_execution_parameters(params_dict:dict) -> None:
+    """
+    Function that prints the execution parameters of a module
+    :params_dict: dict | parameter name -> value (e.g. the cli arguments)
+    :return: None
+    """
+    print("--Execution parameters--")
+
+    # aligning values after the longest parameter name
+    width = max(map(len, params_dict), default=0)
+    for name, value in params_dict.items():
+        print(f"{name.ljust(width)} : {value}")
+
+def enter_to_continue() -> None:
+    """
+    Function that waits the user to press enter before continuing
+    :return: None
+    """
+    input("Press 'Enter' to continue or 'Ctrl+C' to quit...")
+
+def print_progress_message(base_string:str, current_iteration:int, total_iterations:int) -> None:
+    """
+    Function that prints a progress message on the same line
+    :base_string: str | message printed before the progress
+    :current_iteration: int | current iteration (zero based)
+    :total_iterations: int | total number of iterations
+    :return: None
+    """
+    current = current_iteration + 1
+    percentage = 100 * current / max(total_iterations, 1)
+
+    end = "\n" if current >= total_iterations else ""
+    print(f"\r{base_string}{current} of {total_iterations} ({percentage:.1f}%)", end=end, flush=True)
+
+# End of current module
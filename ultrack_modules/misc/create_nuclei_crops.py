@@ -7,13 +7,16 @@ in a given dimension.
 # imports
 
 from multiprocessing import Pool
-from pandas import DataFrame, read_csv
+from pandas import DataFrame
 from functools import partial
 from glob import glob
 from os import makedirs
 from os.path import join
 from PIL import Image
 
+from ultrack_modules.misc.track_store import read_tracks
+from ultrack_modules.misc.track_index import TrackIndex
+
 ###########################
 # define helper functions
 
@@ -49,10 +52,9 @@ def crop_from_group(track_id, group, input_images, input_folder,
         filename = f"id{track_id}_t{t}_({x},{y}).tif"
         crop.save(join(id_folder, filename))
 
-    last_frame = group.t.max()
-    last_frame_data = group[group.t == last_frame]
-
-    x, y = int(last_frame_data.x.iloc[0]), int(last_frame_data.y.iloc[0])
+    # rows are in time order, the last one is the last frame
+    last_frame = int(group.t.iloc[-1])
+    x, y = int(group.x.iloc[-1]), int(group.y.iloc[-1])
 
     # Set cropping coordinates
     left = x - width // 2
@@ -73,7 +75,8 @@ def crop_from_group(track_id, group, input_images, input_folder,
         crop.save(join(id_folder, filename))
 
 def create_crops_from_folder(input_table:DataFrame, input_images_path:str,
-                             output_folder:str, width = 100, height = 100) -> None:
+                             output_folder:str, width = 100, height = 100,
+                             index:TrackIndex = None) -> None:
     """
     Function that creates crops from folder
     """
@@ -81,11 +84,12 @@ def create_crops_from_folder(input_table:DataFrame, input_images_path:str,
     # Create ordered list of images
     images = sorted(glob(join(input_images_path,"*.tif")))
 
-    # Group df by frame
-    grouped_df = input_table.groupby("track_id")
+    # track offsets, rows of every track in time order
+    if index is None:
+        index = TrackIndex.from_table(input_table)
 
     # Create tasks
-    tasks = [(track_id, group) for track_id, group in grouped_df]
+    tasks = [(track_id, input_table.take(rows)) for track_id, rows in index.tracks()]
 
     max_frame = int(input_table.t.max())
 
@@ -122,7 +126,7 @@ def main() -> None:
                         action="store",
                         required=True,
                         dest="input_table",
-                        help="Ultrack output table (.csv)")
+                        help="Ultrack output table (.csv or .parquet)")
 
     parser.add_argument("-im", "--input_images",
                         action="store",
@@ -152,15 +156,17 @@ def main() -> None:
 
     args_dict = vars(parser.parse_args())
 
-    # Open dataframe
-    df = read_csv(args_dict["input_table"])
+    # Open dataframe and its index (reused while the table is unchanged)
+    df = read_tracks(args_dict["input_table"])
+    index = TrackIndex.for_table(args_dict["input_table"], df)
 
     # Call main function
     create_crops_from_folder(input_table=df,
                              input_images_path=args_dict["input_folder"],
                              output_folder=args_dict["output"],
                              width=args_dict["width"],
-                             height=args_dict["height"])
+                             height=args_dict["height"],
+                             index=index)
 
 ##########################
 # run code if runned directly
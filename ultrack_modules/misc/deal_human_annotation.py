@@ -5,6 +5,10 @@ Module that handles human annotation and fits the tracking data to the annotatio
 # imports
 from pandas import DataFrame, read_csv
 
+import numpy as np
+
+from ultrack_modules.misc.track_store import load_track_table, write_tracks, assign_label
+
 #####################################
 # Define helper functions
 
@@ -12,52 +16,45 @@ from pandas import DataFrame, read_csv
 def deal_with_annotation(annotation_df: DataFrame, tracking_df: DataFrame) -> DataFrame:
     """
     Fit the tracking data to the human annotation.
+    Track ids stay numeric: the daughter split off an annotated mitosis
+    gets the next free track id, with the mother as its parent track.
     """
-    # make sure df types
-    annotation_df["id"] = annotation_df["id"].astype(str)
-    annotation_df["frame"] = annotation_df["frame"].astype(float)
-    tracking_df["t"] = tracking_df["t"].astype(float)
+    # annotation ids may come as "12.0" strings or numbers
+    annotation_ids = annotation_df["id"].astype(float).astype("int64").to_numpy()
+    annotation_frames = annotation_df["frame"].astype(float).to_numpy()
 
-    tracking_df["track_id"] = tracking_df["track_id"].astype(float).astype(str)
-    tracking_df["parent_track_id"] = tracking_df["parent_track_id"].astype(float).astype(str)
+    next_id = int(tracking_df["track_id"].max()) + 1
 
-    # iterate through the annotation DataFrame
-    for index, row in annotation_df.iterrows():
-        fate = row["destino"]
+    # iterate through the annotation rows
+    for fate, id, frame in zip(annotation_df["destino"], annotation_ids, annotation_frames):
+        track_ids = tracking_df["track_id"].to_numpy()
+        t = tracking_df["t"].to_numpy()
         match fate:
             case "certo":
                 # If the annotation is correct, keep the tracking data as is
                 continue
             case "troca" | "meio":
                 # remove rows with wrong id
-                id = row["id"]
-                tracking_df = tracking_df[tracking_df["track_id"] != id]
+                tracking_df = tracking_df[track_ids != id].reset_index(drop=True)
             case "mitose":
-                frame = row["frame"]
-                id = row["id"]
                 # change the id of the cell from the frame onwards
-                new_id = id.replace(".0", ".1")
-                tracking_df.loc[
-                    (tracking_df["track_id"] == id) & (tracking_df["t"] >= frame),
-                    "track_id"
-                ] = new_id
+                new_id = next_id
+                next_id += 1
 
-                tracking_df.loc[
-                    tracking_df["parent_track_id"] == id, "parent_track_id"
-                ] = new_id
+                parent_track_ids = tracking_df["parent_track_id"].to_numpy().copy()
+                parent_track_ids[parent_track_ids == id] = new_id
 
-                tracking_df.loc[tracking_df["track_id"] == new_id, "parent_track_id"] = id
+                daughter = (track_ids == id) & (t >= frame)
+                parent_track_ids[daughter] = id
+                tracking_df["parent_track_id"] = parent_track_ids
+                tracking_df["track_id"] = np.where(daughter, new_id, track_ids).astype(track_ids.dtype)
 
-                tracking_df.loc[tracking_df["track_id"] == id, "fate"] = "mitosis"
+                assign_label(tracking_df, (track_ids == id) & ~daughter, "fate", "mitosis")
 
             case "morte":
                 # remove the cell from the frame onwards
-                frame = row["frame"]
-                id = row["id"]
-                tracking_df = tracking_df[
-                    ~((tracking_df["track_id"] == id) & (tracking_df["t"] > frame))
-                ]
-                tracking_df.loc[tracking_df["track_id"] == id, "fate"] = "death"
+                tracking_df = tracking_df[~((track_ids == id) & (t > frame))].reset_index(drop=True)
+                assign_label(tracking_df, tracking_df["track_id"].to_numpy() == id, "fate", "death")
 
     return tracking_df
 
@@ -87,7 +84,7 @@ def main() -> None:
         "-t",
         required=True,
         dest="tracking_file",
-        help="Path to the tracking data file (CSV format).",
+        help="Path to the tracking data file (CSV or Parquet format).",
     )
 
     parser.add_argument(
@@ -95,20 +92,20 @@ def main() -> None:
         "-o",
         required=True,
         dest="output_file",
-        help="Path to save the fitted tracking data (CSV format).",
+        help="Path to save the fitted tracking data (CSV or Parquet format).",
     )
 
     args = parser.parse_args()
 
     # Load the files
     annotation_df: DataFrame = read_csv(args.annotation_file)
-    tracking_df: DataFrame = read_csv(args.tracking_file)
+    tracking_df, _, _ = load_track_table(args.tracking_file)
 
     # Deal with annotation
     fitted_tracking_df: DataFrame = deal_with_annotation(annotation_df=annotation_df, tracking_df=tracking_df)
 
     # Save the fitted tracking data
-    fitted_tracking_df.to_csv(args.output_file, index=False)
+    write_tracks(fitted_tracking_df, args.output_file)
 
 
 #####################################
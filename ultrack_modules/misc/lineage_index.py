@@ -0,0 +1,189 @@
+"""
+Module that builds a compact lineage index of a tracking table (children
+in CSR arrays, roots, generations, birth/death frames and a topological
+order) once, so lineage-walking tools do not scan the table per track
+"""
+####################################
+from pandas import DataFrame
+
+import numpy as np
+
+####################################
+# Defining helper functions
+
+class LineageIndex:
+    """
+    Lineage graph of the tracks of a table. Tracks are stored by position
+    in track_ids (sorted); the children of track position i are
+    indices[indptr[i]:indptr[i + 1]], ordered by track id. A track whose
+    parent is missing from the table (-1, 0 in CTC tables) or is itself
+    (btrack roots) is a root.
+    """
+    def __init__(self, track_ids:np.ndarray, parent_track_ids:np.ndarray, t:np.ndarray = None):
+        """
+        :track_ids: np.ndarray | track id of every row
+        :parent_track_ids: np.ndarray | parent track id of every row
+        :t: np.ndarray | frame of every row, gives birth/death when set
+        """
+        track_ids = np.asarray(track_ids)
+        parent_track_ids = np.asarray(parent_track_ids)
+
+        # first row (in time) of every track gives its parent
+        order = np.argsort(track_ids, kind="stable") if t is None else np.lexsort((np.asarray(t), track_ids))
+        self.track_ids, first = np.unique(track_ids[order], return_index=True)
+        n_tracks = len(self.track_ids)
+
+        parents = self.position(parent_track_ids[order][first])
+        self.parents = np.where(parents == np.arange(n_tracks), -1, parents)
+
+        self.birth = self.death = None
+        if t is not None:
+            sorted_t = np.asarray(t)[order]
+            last = np.append(first[1:], len(order)) - 1
+            self.birth, self.death = sorted_t[first], sorted_t[last]
+
+        # CSR children, ordered by track id
+        has_parent = np.flatnonzero(self.parents >= 0)
+        self.indices = has_parent[np.argsort(self.parents[has_parent], kind="stable")]
+        self.indptr = np.zeros(n_tracks + 1, dtype=np.intp)
+        np.cumsum(np.bincount(self.parents[has_parent], minlength=n_tracks), out=self.indptr[1:])
+
+        self.roots = np.flatnonzero(self.parents < 0)
+        self._walk_levels()
+
+    @classmethod
+    def from_table(cls,
+                   table:DataFrame,
+                   track_column:str = "track_id",
+                   parent_column:str = "parent_track_id",
+                   time_column:str = "t") -> "LineageIndex":
+        """
+        Function that builds the index from a tracking table
+        :table: DataFrame | tracking data, one or more rows per track
+        :track_column: str | track id column
+        :parent_column: str | parent track id column
+        :time_column: str | frame column, None to skip birth/death
+        :return: LineageIndex | lineage of the table tracks
+        """
+        t = None if time_column is None else table[time_column].to_numpy()
+        return cls(table[track_column].to_numpy(), table[parent_column].to_numpy(), t)
+
+    def _walk_levels(self) -> None:
+        """
+        Function that walks the lineage breadth first from the roots, giving
+        the topological order, the generation (depth) and the root of every
+        track. Tracks in parent cycles are never reached and keep depth -1.
+        :return: None
+        """
+        n_tracks = len(self.track_ids)
+        self.depth = np.full(n_tracks, -1, dtype=np.int32)
+        self.root_of = np.full(n_tracks, -1, dtype=np.intp)
+
+        levels, frontier, level = [], self.roots, 0
+        self.root_of[frontier] = frontier
+        while len(frontier):
+            self.depth[frontier] = level
+            levels.append(frontier)
+
+            counts = self.indptr[frontier + 1] - self.indptr[frontier]
+            starts = np.repeat(self.indptr[frontier] - np.cumsum(counts) + counts, counts)
+            children = self.indices[starts + np.arange(counts.sum())]
+            self.root_of[children] = np.repeat(self.root_of[frontier], counts)
+
+            frontier, level = children, level + 1
+
+        self.order = np.concatenate(levels) if levels else np.empty(0, dtype=np.intp)
+
+    def position(self, track_ids) -> np.ndarray:
+        """
+        Function that gives the positions of track ids in the index
+        :track_ids: array | track ids
+        :return: np.ndarray | positions, -1 for unknown ids
+        """
+        track_ids = np.asarray(track_ids)
+        if not len(self.track_ids):
+            return np.full(track_ids.shape, -1, dtype=np.intp)
+
+        positions = np.minimum(np.searchsorted(self.track_ids, track_ids), len(self.track_ids) - 1)
+
+        return np.where(self.track_ids[positions] == track_ids, positions, -1)
+
+    def _root_position(self, track_id) -> int:
+        """
+        Function that gives the position of the track a walk starts at
+        :track_id: int | track id
+        :return: int | position
+        """
+        position = int(self.position(track_id))
+        if position < 0:
+            raise ValueError(f"track {track_id} is not in the lineage index")
+        return position
+
+    def children(self, track_id) -> np.ndarray:
+        """
+        Function that gives the children of a track
+        :track_id: int | track id
+        :return: np.ndarray | children track ids
+        """
+        position = self.position(track_id)
+        if position < 0:
+            return self.track_ids[:0]
+        return self.track_ids[self.indices[self.indptr[position]:self.indptr[position + 1]]]
+
+    def n_children(self) -> np.ndarray:
+        """
+        Function that counts the children of every track
+        :return: np.ndarray | number of children by track position
+        """
+        return np.diff(self.indptr)
+
+    def walk(self, root):
+        """
+        Generator of the tracks of a lineage, depth first, parents before
+        their children and children in track id order
+        :root: int | track id the walk starts at
+        :yield: int | track id
+        """
+        stack = [self._root_position(root)]
+        while stack:
+            position = stack.pop()
+            yield self.track_ids[position].item()
+            stack.extend(self.indices[self.indptr[position]:self.indptr[position + 1]][::-1])
+
+    def paths(self, root = None):
+        """
+        Generator of the root to leaf paths of the lineages
+        :root: int | track id of the lineage root, all roots if None
+        :yield: list | track ids from the root to a leaf
+        """
+        roots = self.roots if root is None else [self._root_position(root)]
+        for start in roots:
+            stack = [[start]]
+            while stack:
+                path = stack.pop()
+                kids = self.indices[self.indptr[path[-1]]:self.indptr[path[-1] + 1]]
+                if not len(kids):
+                    yield self.track_ids[path].tolist()
+                stack.extend(path + [kid] for kid in kids[::-1])
+
+def lineage_names(lineage:LineageIndex, colony_name:str) -> tuple:
+    """
+    Function that names every track in CloVarS format: roots are
+    "<colony>-<n>" and the i-th child of a cell is "<parent name>.<i>"
+    :lineage: LineageIndex | lineage of the table tracks
+    :colony_name: str | name of the colony
+    :return: tuple | (names, branch_names) arrays by track position
+    """
+    names = np.full(len(lineage.track_ids), "", dtype=object)
+    names[lineage.roots] = [f"{colony_name}-{index+1}" for index in range(len(lineage.roots))]
+
+    # parents are named before their children
+    for position in lineage.order:
+        children = lineage.indices[lineage.indptr[position]:lineage.indptr[position + 1]]
+        names[children] = [f"{names[position]}.{index+1}" for index in range(len(children))]
+
+    branch_names = np.where(lineage.root_of >= 0, names[lineage.root_of], "")
+
+    return names, branch_names
+
+# End of current module
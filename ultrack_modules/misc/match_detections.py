@@ -0,0 +1,50 @@
+"""
+Module that matches two sets of detections by centroid distance,
+shared by the stitching steps (tiles, batches, appended frames)
+"""
+####################################
+from scipy.spatial import cKDTree
+
+import numpy as np
+
+####################################
+# Defining helper functions
+
+def match_detections(first_xy:np.ndarray,
+                     second_xy:np.ndarray,
+                     tolerance:float = 1.0) -> tuple:
+    """
+    Function that matches detections one to one, nearest pairs first,
+    ignoring pairs farther apart than tolerance
+    :first_xy: np.ndarray | (N, D) coordinates of the first set
+    :second_xy: np.ndarray | (M, D) coordinates of the second set
+    :tolerance: float | greatest distance between matched detections
+    :return: tuple | (first_indices, second_indices) of matched pairs
+    """
+    first_xy = np.asarray(first_xy, dtype=np.float64)
+    second_xy = np.asarray(second_xy, dtype=np.float64)
+
+    if len(first_xy) == 0 or len(second_xy) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    # every candidate pair within tolerance
+    pairs = cKDTree(first_xy).sparse_distance_matrix(cKDTree(second_xy), tolerance,
+                                                     output_type="ndarray")
+
+    order = np.argsort(pairs["v"], kind="stable")
+    first_idx, second_idx = pairs["i"][order], pairs["j"][order]
+
+    # greedy: accept a pair only if both detections are still free
+    used_first = np.zeros(len(first_xy), dtype=bool)
+    used_second = np.zeros(len(second_xy), dtype=bool)
+    keep = np.zeros(len(order), dtype=bool)
+
+    for k, (i, j) in enumerate(zip(first_idx, second_idx)):
+        if not used_first[i] and not used_second[j]:
+            used_first[i] = used_second[j] = True
+            keep[k] = True
+
+    return first_idx[keep].astype(np.int64), second_idx[keep].astype(np.int64)
+
+# End of current module
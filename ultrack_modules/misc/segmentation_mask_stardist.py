@@ -6,20 +6,51 @@ from argparse import ArgumentParser
 
 from dask.array.image import imread
 from dask.array.core import Array
+from dask.array import from_zarr, from_array
 
 from os.path import join
+from functools import lru_cache
+from multiprocessing import get_context
+from math import ceil, isqrt
 
 from skimage.io import imsave
 
 from ultrack.imgproc import normalize
 from ultrack.utils.array import array_apply
 
-from stardist.models import StarDist2D
+# the segmentation server is optional, without the repository on the
+# path the model is loaded locally
+try:
+    from ultrack_modules.misc.segmentation_server import server_available, segment_remote
+except ImportError:
+    def server_available() -> bool:
+        return False
+
+import zarr
 
 from numpy import zeros_like
 from numpy import int32
 import numpy as np
 
+####################################
+# Define global variables
+
+MODEL_NAME : str = "2D_versatile_fluo"
+
+# predict_instances_big tiling parameters, DEFAULT_BLOCK_SIZE is used
+# unless a memory budget is given
+DEFAULT_BLOCK_SIZE : int = 560
+MIN_OVERLAP : int       = 96
+MIN_BLOCK_SIZE : int    = 4 * MIN_OVERLAP
+BLOCK_MULTIPLE : int    = 16
+
+# Rough peak memory StarDist needs per tile pixel (float32 input, probability,
+# 32 rays and the U-Net activations kept alive during prediction)
+BYTES_PER_PIXEL : int   = 4 * 96
+
+# Model loaded once by each worker process
+_WORKER_MODEL = None
+
 ####################################
 # Define Argument Parsing Function
 
@@ -32,6 +63,12 @@ def get_args_dict() -> dict:
     parser = ArgumentParser(description="Module that receives a video and exports a segmentation mask using stardist")
     parser.add_argument("-i", "--input", required=True, help="Folder where the cell images are stored")
     parser.add_argument("-o", "--output", required=True, help="Folder to save the segmentation masks")
+    parser.add_argument("--zarr", required=False, default=None, dest="zarr_path",
+                        help="Write labels into this on-disk chunked zarr array instead of RAM")
+    parser.add_argument("--n_workers", required=False, type=int, default=1,
+                        help="Number of worker processes, each holding one loaded model (zarr mode)")
+    parser.add_argument("--memory_budget", required=False, type=float, default=None,
+                        help=f"Memory budget per worker in GB, used to pick the prediction block size (default: blocks of {DEFAULT_BLOCK_SIZE})")
     return vars(parser.parse_args())
 
 ####################################
@@ -42,19 +79,162 @@ def save_images(image:Array, name="Image", block_info = None, **kwargs) -> Array
     imsave(join(kwargs.get("folder"), filename), image)
     return image
 
-def segment_photo(image: Array, model: StarDist2D) -> np.ndarray:
+@lru_cache(maxsize=None)
+def load_model(model_name:str = MODEL_NAME) -> "StarDist2D":
+    """
+    Function that loads a pretrained StarDist model only once per process
+    :model_name: str | name of the pretrained model
+    :return: StarDist2D | loaded model
+    """
+    # imported here so runs served by the segmentation server skip TensorFlow
+    from stardist.models import StarDist2D
+
+    return StarDist2D.from_pretrained(model_name)
+
+def get_block_size(frame_shape:tuple, memory_budget:float = None) -> int:
+    """
+    Function that picks the predict_instances_big block size that
+    fits a memory budget
+    :frame_shape: tuple | (Y, X) shape of a single frame
+    :memory_budget: float | memory available for one prediction (bytes),
+                            None keeps DEFAULT_BLOCK_SIZE
+    :return: int | block size, multiple of BLOCK_MULTIPLE
+    """
+    if memory_budget is None:
+        return DEFAULT_BLOCK_SIZE
+
+    # largest tile (block + overlap on both sides) that fits the budget
+    tile_side = isqrt(int(memory_budget // BYTES_PER_PIXEL))
+    block_size = (tile_side - 2 * MIN_OVERLAP) // BLOCK_MULTIPLE * BLOCK_MULTIPLE
+
+    # a block bigger than the frame is just the whole frame
+    frame_side = ceil(max(frame_shape) / BLOCK_MULTIPLE) * BLOCK_MULTIPLE
+
+    return int(min(max(block_size, MIN_BLOCK_SIZE), max(frame_side, MIN_BLOCK_SIZE)))
+
+def segment_photo(image: Array, model: "StarDist2D", block_size:int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
     """
-    Receives a Dask Array (a block), converts it to NumPy, segments it, and returns NumPy result.
+    Receives a frame (NumPy or Dask block), segments it, and returns NumPy result.
     """
-    image_np = image.compute()  # Convert block to NumPy
+    image_np = np.asarray(image)  # no-op for NumPy, computes Dask blocks
     frame = normalize(image_np, gamma=2.0)
     labels, _ = model.predict_instances_big(
-        frame, "YX", block_size=560, min_overlap=96, show_progress=False,
+        frame, "YX", block_size=block_size, min_overlap=MIN_OVERLAP, show_progress=False,
     )
     return labels.astype(np.int32)
 
-def segment_array(video:Array) -> Array:
-    model = StarDist2D.from_pretrained("2D_versatile_fluo")
+def _init_worker(model_name:str) -> None:
+    """
+    Worker initializer, loads the model once for the whole worker life
+    :model_name: str | name of the pretrained model
+    """
+    global _WORKER_MODEL
+    _WORKER_MODEL = load_model(model_name)
+
+def _segment_frame_job(job:tuple) -> int:
+    """
+    Function that segments one frame and writes it into the labels zarr
+    :job: tuple | (t, frame, labels_path, block_size)
+    :return: int | index of the segmented frame
+    """
+    t, frame, labels_path, block_size = job
+
+    labels = zarr.open(labels_path, mode="r+")
+    labels[t] = segment_photo(frame, _WORKER_MODEL, block_size=block_size)
+
+    return t
+
+def segment_array_to_zarr(video:Array,
+                          labels_path:str,
+                          n_workers:int = 1,
+                          memory_budget:float = None,
+                          model_name:str = MODEL_NAME) -> Array:
+    """
+    Function that segments a video frame by frame, writing the labels
+    into an on-disk zarr array chunked by frame
+    :video: dask.Array | (T, Y, X) video to be segmented
+    :labels_path: str | path of the zarr array to be created
+    :n_workers: int | number of worker processes, each one loads one model
+    :memory_budget: float | memory budget per worker (bytes), None for DEFAULT_BLOCK_SIZE
+    :model_name: str | name of the pretrained model
+    :return: dask.Array | lazy view over the written labels
+    """
+    n_frames = video.shape[0]
+    block_size = get_block_size(video.shape[1:], memory_budget)
+
+    # one chunk per frame, so workers never write to the same chunk
+    zarr.open(labels_path, mode="w", shape=video.shape,
+              chunks=(1, *video.shape[1:]), dtype=int32)
+
+    jobs = ((t, np.asarray(video[t]), labels_path, block_size) for t in range(n_frames))
+
+    if n_workers > 1:
+        # spawn, as TensorFlow is not fork safe
+        with get_context("spawn").Pool(n_workers, initializer=_init_worker,
+                                       initargs=(model_name,)) as pool:
+            for _ in pool.imap_unordered(_segment_frame_job, jobs):
+                pass
+    else:
+        _init_worker(model_name)
+        for job in jobs:
+            _segment_frame_job(job)
+
+    return from_zarr(labels_path)
+
+def segment_array_remote(video:Array,
+                         labels_path:str = None,
+                         memory_budget:float = None,
+                         model_name:str = MODEL_NAME) -> Array:
+    """
+    Function that segments a video frame by frame using the running
+    segmentation server, which keeps the model loaded between calls
+    :video: dask.Array | (T, Y, X) video to be segmented
+    :labels_path: str | if set, labels are written to this zarr array
+    :memory_budget: float | memory budget of the server (bytes), None for DEFAULT_BLOCK_SIZE
+    :model_name: str | name of the pretrained model
+    :return: Array | segmentation labels
+    """
+    if labels_path is not None:
+        labels = zarr.open(labels_path, mode="w", shape=video.shape,
+                           chunks=(1, *video.shape[1:]), dtype=int32)
+    else:
+        labels = np.zeros(video.shape, dtype=int32)
+
+    eval_kwargs = {"block_size": get_block_size(video.shape[1:], memory_budget)}
+
+    for t in range(video.shape[0]):
+        labels[t] = segment_remote("stardist", image=np.asarray(video[t]),
+                                   model_kwargs={"model_name": model_name},
+                                   eval_kwargs=eval_kwargs)
+
+    if labels_path is not None:
+        return from_zarr(labels_path)
+
+    return from_array(labels, chunks=(1, *video.shape[1:]))
+
+def segment_array(video:Array,
+                  labels_path:str = None,
+                  n_workers:int = 1,
+                  memory_budget:float = None) -> Array:
+    """
+    Function that segments a video using StarDist
+    :video: dask.Array | (T, Y, X) video to be segmented
+    :labels_path: str | if set, labels are written to this zarr array
+                        instead of being allocated in RAM
+    :n_workers: int | number of worker processes (zarr mode only)
+    :memory_budget: float | memory budget per worker (bytes), None for DEFAULT_BLOCK_SIZE
+    :return: Array | segmentation labels
+    """
+    if server_available():
+        print("Using running segmentation server...")
+        return segment_array_remote(video, labels_path, memory_budget=memory_budget)
+
+    if labels_path is not None:
+        return segment_array_to_zarr(video, labels_path,
+                                     n_workers=n_workers,
+                                     memory_budget=memory_budget)
+
+    model = load_model(MODEL_NAME)
     stardist_labels = zeros_like(video, dtype=int32)
 
     array_apply(
@@ -62,8 +242,9 @@ def segment_array(video:Array) -> Array:
         out_array=stardist_labels,
         func=segment_photo,
         model=model,
+        block_size=get_block_size(video.shape[1:], memory_budget),
     )
-    
+
     return stardist_labels
 
 ####################################
@@ -72,11 +253,21 @@ def main() -> None:
     args_dict = get_args_dict()
     input_folder    = args_dict["input"]
     output_folder   = args_dict["output"]
-    
+    zarr_path       = args_dict["zarr_path"]
+    n_workers       = args_dict["n_workers"]
+    memory_budget   = args_dict["memory_budget"]
+
+    # GB to bytes, no budget keeps the default block size
+    if memory_budget is not None:
+        memory_budget *= 1e9
+
     input_video = imread(join(input_folder, "*"))
-    
-    segmentation_masks = segment_array(video=input_video)
-    
+
+    segmentation_masks = segment_array(video=input_video,
+                                       labels_path=zarr_path,
+                                       n_workers=n_workers,
+                                       memory_budget=memory_budget)
+
     segmentation_masks.map_blocks(save_images, dtype=segmentation_masks.dtype, folder=output_folder).compute()
 
 ####################################
@@ -0,0 +1,358 @@
+"""
+Module that keeps segmentation models loaded in a long-lived local
+worker and serves segmentation jobs over a Unix socket.
+
+Start it once per node, from the repository root:
+    python -m ultrack_modules.misc.segmentation_server --preload cellpose:cpsam stardist:2D_versatile_fluo
+
+While it runs, segment_cellpose.py, pipeline/cellpose_segmentation.py and
+segment_array send their frames to it instead of building their own model.
+The socket and the connection key live in a folder only the user can open
+($XDG_RUNTIME_DIR, or a 0700 folder in the temporary directory), so other
+users can neither reach the server nor authenticate to it.
+"""
+####################################
+from argparse import ArgumentParser
+
+from multiprocessing.connection import Listener, Client
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing import resource_tracker, AuthenticationError
+
+from os import environ, remove, makedirs, stat, getuid
+from os import open as os_open, fdopen, O_WRONLY, O_CREAT, O_EXCL
+from os.path import exists, join
+from secrets import token_bytes
+from tempfile import gettempdir
+
+import numpy as np
+
+####################################
+# Define global variables
+
+# socket (unless LABSINAL_SEGMENTATION_SOCKET is set) and connection key,
+# both inside the per-user runtime folder (see get_runtime_dir)
+SOCKET_NAME : str   = "labsinal_segmentation.sock"
+KEY_NAME : str      = "labsinal_segmentation.key"
+KEY_BYTES : int     = 32
+
+# Models loaded by the server, keyed by backend and constructor arguments
+_MODELS : dict = {}
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Long-lived segmentation worker that keeps models loaded"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-s", "--socket",
+                        action="store",
+                        required=False,
+                        default=None,
+                        dest="socket_path",
+                        help="Unix socket to listen on, inside the per-user runtime folder by default")
+
+    parser.add_argument("--preload",
+                        action="store",
+                        required=False,
+                        nargs="*",
+                        default=[],
+                        dest="preload",
+                        help="Models to load at startup, as backend:model (e.g. cellpose:cpsam)")
+
+    parser.add_argument("--cpu",
+                        action="store_true",
+                        required=False,
+                        dest="cpu",
+                        help="Load preloaded cellpose models on CPU")
+
+    parser.add_argument("--stop",
+                        action="store_true",
+                        required=False,
+                        dest="stop",
+                        help="Stop a running server and exit")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining runtime folder helper functions
+
+def get_runtime_dir() -> str:
+    """
+    Function that gives the per-user folder holding the socket and the key:
+    $XDG_RUNTIME_DIR, or a folder of the user in the temporary directory,
+    created with mode 0700
+    :return: str | runtime folder
+    """
+    directory = environ.get("XDG_RUNTIME_DIR") or join(gettempdir(), f"labsinal-{getuid()}")
+    makedirs(directory, mode=0o700, exist_ok=True)
+
+    # refuse folders another user owns or can open
+    status = stat(directory)
+    if status.st_uid != getuid() or status.st_mode & 0o077:
+        raise PermissionError(f"{directory} must belong to the current user with mode 0700")
+
+    return directory
+
+def get_socket_path() -> str:
+    """
+    Function that gives the default socket of the server
+    :return: str | LABSINAL_SEGMENTATION_SOCKET, or the socket in the runtime folder
+    """
+    return environ.get("LABSINAL_SEGMENTATION_SOCKET") or join(get_runtime_dir(), SOCKET_NAME)
+
+def get_authkey() -> bytes:
+    """
+    Function that gives the secret connection key of the user, a random
+    key created on first use in the runtime folder (mode 0600)
+    :return: bytes | connection key
+    """
+    path = join(get_runtime_dir(), KEY_NAME)
+
+    try:
+        descriptor = os_open(path, O_WRONLY | O_CREAT | O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as file:
+            return file.read()
+
+    key = token_bytes(KEY_BYTES)
+    with fdopen(descriptor, "wb") as file:
+        file.write(key)
+
+    return key
+
+####################################
+# Defining server helper functions
+
+def get_model(backend:str, model_kwargs:dict):
+    """
+    Function that returns a loaded model, building it only on first use
+    :backend: str | "cellpose" or "stardist"
+    :model_kwargs: dict | arguments used to build the model
+    :return: loaded model
+    """
+    key = (backend, tuple(sorted(model_kwargs.items())))
+
+    if key not in _MODELS:
+        print(f"Loading {backend} model {model_kwargs}...")
+        if backend == "cellpose":
+            from cellpose import models
+            _MODELS[key] = models.CellposeModel(**model_kwargs)
+        elif backend == "stardist":
+            from ultrack_modules.misc.segmentation_mask_stardist import load_model
+            _MODELS[key] = load_model(**model_kwargs)
+        else:
+            raise ValueError(f"Unknown segmentation backend: {backend}")
+
+    return _MODELS[key]
+
+def read_job_image(job:dict) -> np.ndarray:
+    """
+    Function that gets the image of a job, either from a path
+    or from a shared memory block created by the client
+    :job: dict | segmentation job
+    :return: np.ndarray | image to be segmented
+    """
+    if job.get("path") is not None:
+        if job["backend"] == "cellpose":
+            from cellpose import io
+            return io.imread(job["path"])
+        from tifffile import imread
+        return imread(job["path"])
+
+    name, shape, dtype = job["shm"]
+    shm = SharedMemory(name=name)
+    # the client owns the block, do not let this process unlink it on exit
+    resource_tracker.unregister(shm._name, "shared_memory")
+    image = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    shm.close()
+
+    return image
+
+def run_job(job:dict) -> dict:
+    """
+    Function that runs one segmentation job
+    :job: dict | segmentation job
+    :return: dict | {"masks": labels} or {"error": message}
+    """
+    try:
+        model = get_model(job["backend"], job.get("model_kwargs", {}))
+        image = read_job_image(job)
+        eval_kwargs = job.get("eval_kwargs", {})
+
+        if job["backend"] == "cellpose":
+            masks, _, _ = model.eval(image, **eval_kwargs)
+        else:
+            from ultrack_modules.misc.segmentation_mask_stardist import segment_photo
+            masks = segment_photo(image, model, **eval_kwargs)
+
+        return {"masks": masks}
+
+    except Exception as error:
+        return {"error": f"{type(error).__name__}: {error}"}
+
+def serve(socket_path:str = None, preload:list = ()) -> None:
+    """
+    Function that listens for segmentation jobs until a stop request
+    :socket_path: str | Unix socket to listen on, see get_socket_path if None
+    :preload: list | (backend, model_kwargs) pairs to load at startup
+    """
+    socket_path = socket_path or get_socket_path()
+
+    if server_available(socket_path):
+        raise RuntimeError(f"A segmentation server is already listening on {socket_path}")
+
+    for backend, model_kwargs in preload:
+        get_model(backend, model_kwargs)
+
+    # remove socket left behind by a dead server
+    if exists(socket_path):
+        remove(socket_path)
+
+    with Listener(socket_path, family="AF_UNIX", authkey=get_authkey()) as listener:
+        print(f"Segmentation server listening on {socket_path}")
+        while True:
+            with listener.accept() as conn:
+                while True:
+                    try:
+                        job = conn.recv()
+                    except EOFError:
+                        break
+
+                    op = job.get("op") if isinstance(job, dict) else None
+                    if op == "stop":
+                        conn.send({"ok": True})
+                        return
+                    if op == "ping":
+                        conn.send({"ok": True})
+                    elif op == "segment":
+                        conn.send(run_job(job))
+                    else:
+                        conn.send({"error": f"Unknown job: {op!r}"})
+
+####################################
+# Defining client helper functions
+
+def server_available(socket_path:str = None) -> bool:
+    """
+    Function that checks whether a segmentation server is running
+    :socket_path: str | Unix socket of the server, see get_socket_path if None
+    :return: bool | True if the server answered
+    """
+    socket_path = socket_path or get_socket_path()
+    if not exists(socket_path):
+        return False
+
+    try:
+        with Client(socket_path, family="AF_UNIX", authkey=get_authkey()) as conn:
+            conn.send({"op": "ping"})
+            return conn.recv().get("ok", False)
+    except (OSError, EOFError, AuthenticationError):
+        return False
+
+def segment_remote(backend:str,
+                   image:np.ndarray = None,
+                   path:str = None,
+                   model_kwargs:dict = None,
+                   eval_kwargs:dict = None,
+                   socket_path:str = None) -> np.ndarray:
+    """
+    Function that segments an image using the running server.
+    Images are passed through shared memory, paths are read by the server.
+    :backend: str | "cellpose" or "stardist"
+    :image: np.ndarray | image to be segmented
+    :path: str | path to the image, used when image is None
+    :model_kwargs: dict | arguments used to build the model
+    :eval_kwargs: dict | arguments used to run the model
+    :socket_path: str | Unix socket of the server, see get_socket_path if None
+    :return: np.ndarray | segmentation labels
+    """
+    socket_path = socket_path or get_socket_path()
+    job = {"op"             : "segment",
+           "backend"        : backend,
+           "model_kwargs"   : model_kwargs or {},
+           "eval_kwargs"    : eval_kwargs or {},
+           "path"           : path,
+           "shm"            : None}
+
+    shm = None
+    try:
+        if path is None:
+            image = np.ascontiguousarray(image)
+            shm = SharedMemory(create=True, size=max(image.nbytes, 1))
+            np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+            job["shm"] = (shm.name, image.shape, image.dtype.str)
+
+        with Client(socket_path, family="AF_UNIX", authkey=get_authkey()) as conn:
+            conn.send(job)
+            reply = conn.recv()
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    if "error" in reply:
+        raise RuntimeError(f"Segmentation server failed: {reply['error']}")
+
+    return reply["masks"]
+
+def stop_server(socket_path:str = None) -> None:
+    """
+    Function that asks a running server to stop
+    :socket_path: str | Unix socket of the server, see get_socket_path if None
+    """
+    with Client(socket_path or get_socket_path(), family="AF_UNIX", authkey=get_authkey()) as conn:
+        conn.send({"op": "stop"})
+        conn.recv()
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    # Assign cli arguments to variables
+    socket_path = args_dict["socket_path"]
+
+    if args_dict["stop"]:
+        stop_server(socket_path)
+        print("Segmentation server stopped.")
+        return
+
+    # parse backend:model pairs into constructor arguments
+    preload = []
+    for item in args_dict["preload"]:
+        backend, model_name = item.split(":", 1)
+        if backend == "cellpose":
+            preload.append((backend, {"gpu": not args_dict["cpu"], "pretrained_model": model_name}))
+        else:
+            preload.append((backend, {"model_name": model_name}))
+
+    serve(socket_path=socket_path, preload=preload)
+
+    print("Done!")
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
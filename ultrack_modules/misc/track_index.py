@@ -0,0 +1,311 @@
+"""
+Module that indexes the frames and tracks of a tracking table (offsets
+into frame and track sorted row orders, per-frame KD-trees built on first
+use), so tools slice a frame or a track without scanning the table
+"""
+####################################
+from os import stat
+from os.path import exists
+
+from pandas import DataFrame
+from scipy.spatial import cKDTree
+
+import numpy as np
+
+####################################
+# Define global variables
+
+# the index of <table> is saved as <table><INDEX_SUFFIX>
+INDEX_SUFFIX : str = ".index.npz"
+
+# coordinate columns of the spatial queries
+COORDINATE_COLUMNS : tuple = ("x", "y")
+
+# ids are looked up in a dense table while its span is at most this many
+# times the number of ids, by binary search otherwise
+DENSE_SPAN_FACTOR : int = 8
+
+####################################
+# Defining helper functions
+
+def get_lookup(values:np.ndarray) -> tuple:
+    """
+    Function that builds a dense position table of sorted unique ids,
+    so an id is located with one array access
+    :values: np.ndarray | sorted unique ids
+    :return: tuple | (first id, positions by id - first id), None if too sparse
+    """
+    if not len(values):
+        return 0, None
+
+    first, span = int(values[0]), int(values[-1]) - int(values[0]) + 1
+    if span > DENSE_SPAN_FACTOR * len(values) + 1024:
+        return first, None
+
+    lookup = np.full(span, -1, dtype=np.intp)
+    lookup[values.astype(np.int64) - first] = np.arange(len(values))
+
+    return first, lookup
+
+def get_offsets(sorted_values:np.ndarray) -> tuple:
+    """
+    Function that gives the runs of equal values of a sorted array:
+    values[i] spans offsets[i]:offsets[i + 1]
+    :sorted_values: np.ndarray | sorted values
+    :return: tuple | (values, offsets) arrays, offsets has one extra item
+    """
+    values, starts = np.unique(sorted_values, return_index=True)
+
+    return values, np.append(starts, len(sorted_values)).astype(np.intp)
+
+def get_index_path(table_path:str) -> str:
+    """
+    Function that gives the path of the index saved next to a table
+    :table_path: str | .parquet or .csv table
+    :return: str | index path
+    """
+    return f"{table_path}{INDEX_SUFFIX}"
+
+def get_source_key(table_path:str) -> np.ndarray:
+    """
+    Function that identifies the version of a table file, so a saved index
+    is only reused while its table is unchanged
+    :table_path: str | .parquet or .csv table
+    :return: np.ndarray | (size, modification time in ns)
+    """
+    status = stat(table_path)
+
+    return np.array([status.st_size, status.st_mtime_ns], dtype=np.int64)
+
+class TrackIndex:
+    """
+    Frame and track index of a tracking table. Rows are referred to by
+    position in the table: frame frames[i] is the rows
+    frame_order[frame_offsets[i]:frame_offsets[i + 1]] and track
+    track_ids[i] is track_order[track_offsets[i]:track_offsets[i + 1]],
+    in time order. Tables sorted by t (e.g. Parquet written by
+    write_tracks) have frame_order equal to their row order.
+    """
+    ARRAYS : tuple = ("frame_order", "frames", "frame_offsets",
+                      "track_order", "track_ids", "track_offsets", "coordinates")
+
+    def __init__(self,
+                 frame_order:np.ndarray,
+                 frames:np.ndarray,
+                 frame_offsets:np.ndarray,
+                 track_order:np.ndarray,
+                 track_ids:np.ndarray,
+                 track_offsets:np.ndarray,
+                 coordinates:np.ndarray):
+        """
+        :frame_order: np.ndarray | rows sorted by frame
+        :frames: np.ndarray | sorted frames of the table
+        :frame_offsets: np.ndarray | start of every frame in frame_order, plus the end
+        :track_order: np.ndarray | rows sorted by (track_id, t)
+        :track_ids: np.ndarray | sorted track ids of the table
+        :track_offsets: np.ndarray | start of every track in track_order, plus the end
+        :coordinates: np.ndarray | (N, D) coordinates of every row, in table order
+        """
+        self.frame_order, self.frames, self.frame_offsets = frame_order, frames, frame_offsets
+        self.track_order, self.track_ids, self.track_offsets = track_order, track_ids, track_offsets
+        self.coordinates = coordinates
+
+        self._frame_lookup = get_lookup(frames)
+        self._track_lookup = get_lookup(track_ids)
+        self._trees = {}
+
+    @classmethod
+    def from_table(cls,
+                   table:DataFrame,
+                   coordinate_columns:tuple = COORDINATE_COLUMNS,
+                   time_column:str = "t",
+                   track_column:str = "track_id") -> "TrackIndex":
+        """
+        Function that builds the index of a tracking table
+        :table: DataFrame | tracking data
+        :coordinate_columns: tuple | columns of the spatial queries, missing ones are skipped
+        :time_column: str | frame column
+        :track_column: str | track id column, None for detection tables
+        :return: TrackIndex | index of the table rows
+        """
+        t = table[time_column].to_numpy()
+
+        frame_order = np.argsort(t, kind="stable")
+        frames, frame_offsets = get_offsets(t[frame_order])
+
+        if track_column is None or track_column not in table.columns:
+            track_order = np.empty(0, dtype=np.intp)
+            track_ids, track_offsets = track_order, np.zeros(1, dtype=np.intp)
+        else:
+            track_ids = table[track_column].to_numpy()
+            track_order = np.lexsort((t, track_ids))
+            track_ids, track_offsets = get_offsets(track_ids[track_order])
+
+        columns = [column for column in coordinate_columns if column in table.columns]
+        coordinates = table[columns].to_numpy(dtype=np.float32)
+
+        return cls(frame_order, frames, frame_offsets, track_order, track_ids, track_offsets, coordinates)
+
+    @classmethod
+    def load(cls, path:str) -> "TrackIndex":
+        """
+        Function that loads an index saved by save
+        :path: str | .npz index
+        :return: TrackIndex | index of the table rows
+        """
+        with np.load(path) as arrays:
+            return cls(*(arrays[name] for name in cls.ARRAYS))
+
+    def save(self, path:str, source_key:np.ndarray = None) -> None:
+        """
+        Function that saves the offset arrays of the index (KD-trees are
+        rebuilt on first use)
+        :path: str | .npz index
+        :source_key: np.ndarray | version of the indexed table, see get_source_key
+        :return: None
+        """
+        arrays = {name : getattr(self, name) for name in self.ARRAYS}
+        if source_key is not None:
+            arrays["source_key"] = source_key
+
+        with open(path, "wb") as file:
+            np.savez(file, **arrays)
+
+    @classmethod
+    def for_table(cls,
+                  table_path:str,
+                  table:DataFrame,
+                  coordinate_columns:tuple = COORDINATE_COLUMNS) -> "TrackIndex":
+        """
+        Function that gives the index of a table file: the one saved next to
+        it if the table did not change since, otherwise a new one, which is
+        saved for the next tools. The table must be read in file row order.
+        :table_path: str | .parquet or .csv table
+        :table: DataFrame | tracking data read from table_path
+        :coordinate_columns: tuple | columns of the spatial queries
+        :return: TrackIndex | index of the table rows
+        """
+        index_path, source_key = get_index_path(table_path), get_source_key(table_path)
+        n_coordinates = sum(column in table.columns for column in coordinate_columns)
+
+        if exists(index_path):
+            with np.load(index_path) as arrays:
+                saved_key = arrays["source_key"] if "source_key" in arrays.files else None
+            if saved_key is not None and np.array_equal(saved_key, source_key):
+                index = cls.load(index_path)
+                if len(index.frame_order) == len(table) and index.coordinates.shape[1] == n_coordinates:
+                    return index
+
+        index = cls.from_table(table, coordinate_columns)
+        try:
+            index.save(index_path, source_key)
+        except OSError:
+            # read-only folders just rebuild the index every time
+            pass
+
+        return index
+
+    def _position(self, lookup:tuple, values:np.ndarray, value) -> int:
+        """
+        Function that locates an id in sorted unique ids
+        :lookup: tuple | output of get_lookup for values
+        :values: np.ndarray | sorted unique ids
+        :value: int | id
+        :return: int | position, -1 for unknown ids
+        """
+        first, table = lookup
+        if table is not None:
+            value = int(value) - first
+            return int(table[value]) if 0 <= value < len(table) else -1
+
+        position = int(np.searchsorted(values, value))
+        return position if position < len(values) and values[position] == value else -1
+
+    def frame_rows(self, t) -> np.ndarray:
+        """
+        Function that gives the rows of a frame
+        :t: int | frame
+        :return: np.ndarray | table row positions, empty for frames without rows
+        """
+        position = self._position(self._frame_lookup, self.frames, t)
+        if position < 0:
+            return self.frame_order[:0]
+
+        return self.frame_order[self.frame_offsets[position]:self.frame_offsets[position + 1]]
+
+    def track_rows(self, track_id) -> np.ndarray:
+        """
+        Function that gives the rows of a track, in time order
+        :track_id: int | track id
+        :return: np.ndarray | table row positions, empty for unknown tracks
+        """
+        position = self._position(self._track_lookup, self.track_ids, track_id)
+        if position < 0:
+            return self.track_order[:0]
+
+        return self.track_order[self.track_offsets[position]:self.track_offsets[position + 1]]
+
+    def tracks(self):
+        """
+        Generator of the tracks of the table
+        :yield: tuple | (track id, table row positions in time order)
+        """
+        for position, track_id in enumerate(self.track_ids.tolist()):
+            yield track_id, self.track_order[self.track_offsets[position]:self.track_offsets[position + 1]]
+
+    def tree(self, t) -> cKDTree:
+        """
+        Function that gives the KD-tree of the coordinates of a frame,
+        built on first use
+        :t: int | frame
+        :return: cKDTree | tree over the rows of frame_rows(t), None if the frame is empty
+        """
+        t = int(t)
+        if t not in self._trees:
+            rows = self.frame_rows(t)
+            self._trees[t] = cKDTree(self.coordinates[rows]) if len(rows) else None
+
+        return self._trees[t]
+
+    def query_radius(self, t, points:np.ndarray, radius:float, p:float = 2) -> list:
+        """
+        Function that finds the rows of a frame within a distance of points
+        :t: int | frame
+        :points: np.ndarray | (M, D) query coordinates, or a single (D,) point
+        :radius: float | greatest distance
+        :p: float | Minkowski norm, np.inf gives a square (box) neighbourhood
+        :return: list | table row positions (np.ndarray) near every point
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        tree = self.tree(t)
+        if tree is None:
+            return [self.frame_order[:0] for _ in points]
+
+        rows = self.frame_rows(t)
+        neighbours = tree.query_ball_point(points, radius, p=p)
+
+        return [rows[np.sort(np.asarray(near, dtype=np.intp))] for near in neighbours]
+
+    def query_nearest(self, t, points:np.ndarray, k:int = 1, max_distance:float = np.inf) -> tuple:
+        """
+        Function that finds the k nearest rows of a frame to points
+        :t: int | frame
+        :points: np.ndarray | (M, D) query coordinates
+        :k: int | number of neighbours
+        :max_distance: float | greatest distance, farther neighbours are missing
+        :return: tuple | (distances, rows) of shape (M, k), missing ones are inf and -1
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        tree = self.tree(t)
+        if tree is None:
+            return np.full((len(points), k), np.inf), np.full((len(points), k), -1, dtype=np.intp)
+
+        distances, near = tree.query(points, k=k, distance_upper_bound=max_distance)
+        distances, near = distances.reshape(len(points), k), near.reshape(len(points), k)
+
+        rows = self.frame_rows(t)
+        found = near < len(rows)
+
+        return distances, np.where(found, rows[np.minimum(near, len(rows) - 1)], -1)
+
+# End of current module
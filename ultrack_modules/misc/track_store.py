@@ -0,0 +1,303 @@
+"""
+Module that reads and writes tracking tables as Parquet (columnar, fixed
+schema) or CSV, chosen by the file extension, so every stage can exchange
+tables without re-parsing text
+"""
+####################################
+from os.path import splitext
+
+from pandas import DataFrame, Categorical, CategoricalDtype, read_csv, read_parquet
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import csv as pa_csv
+
+####################################
+# Define global variables
+
+PARQUET_SUFFIXES : tuple = (".parquet", ".pq")
+
+# fixed dtypes of the tracking columns, other columns keep their own.
+# Node ids (id, parent_id) encode the frame, so they do not fit int32.
+# fate is categorical, written to Parquet as a dictionary column; tools
+# adding new labels go through assign_label
+TRACK_SCHEMA : dict = {"id"                 : "int64",
+                       "parent_id"          : "int64",
+                       "track_id"           : "int32",
+                       "parent_track_id"    : "int32",
+                       "t"                  : "int32",
+                       "z"                  : "float32",
+                       "y"                  : "float32",
+                       "x"                  : "float32",
+                       "fate"               : "category"}
+
+# numeric part of the schema, cast in Arrow by load_track_table
+NUMERIC_SCHEMA : dict = {column : dtype for column, dtype in TRACK_SCHEMA.items() if dtype != "category"}
+
+# node id columns, downcast to int32 by load_track_table when their values fit
+NODE_ID_COLUMNS : tuple = ("id", "parent_id")
+
+# rows per Parquet row group, row groups are skipped by their t/track_id statistics
+ROW_GROUP_SIZE : int = 1_000_000
+
+####################################
+# Defining helper functions
+
+def is_parquet(path:str) -> bool:
+    """
+    Function that tells whether a path is a Parquet table
+    :path: str | table path
+    :return: bool | True for .parquet/.pq
+    """
+    return splitext(str(path))[1].lower() in PARQUET_SUFFIXES
+
+def apply_schema(tracks_df:DataFrame) -> DataFrame:
+    """
+    Function that casts the tracking columns to TRACK_SCHEMA. Integer
+    columns holding missing values are left as they are.
+    :tracks_df: DataFrame | tracking data
+    :return: DataFrame | tracking data with the schema dtypes
+    """
+    dtypes = {}
+    for column, dtype in TRACK_SCHEMA.items():
+        if column not in tracks_df.columns or tracks_df[column].dtype == dtype:
+            continue
+        if dtype.startswith("int") and tracks_df[column].isna().any():
+            continue
+        dtypes[column] = dtype
+
+    return tracks_df.astype(dtypes) if dtypes else tracks_df
+
+def get_filters(t_range:tuple = None, track_ids = None) -> list:
+    """
+    Function that builds the row filters on t and track_id
+    :t_range: tuple | (first, last) frames, both included, None for no limit
+    :track_ids: iterable | track ids to keep
+    :return: list | pyarrow style filters, None if no filter
+    """
+    filters = []
+    if t_range is not None:
+        first, last = t_range
+        if first is not None:
+            filters.append(("t", ">=", int(first)))
+        if last is not None:
+            filters.append(("t", "<=", int(last)))
+    if track_ids is not None:
+        filters.append(("track_id", "in", [int(item) for item in track_ids]))
+
+    return filters or None
+
+def filter_rows(tracks_df:DataFrame, filters:list) -> DataFrame:
+    """
+    Function that applies the row filters to an in-memory table
+    :tracks_df: DataFrame | tracking data
+    :filters: list | output of get_filters
+    :return: DataFrame | filtered tracking data
+    """
+    keep = np.ones(len(tracks_df), dtype=bool)
+    for column, operator, value in filters or []:
+        values = tracks_df[column].to_numpy()
+        if operator == ">=":
+            keep &= values >= value
+        elif operator == "<=":
+            keep &= values <= value
+        else:
+            keep &= np.isin(values, value)
+
+    return tracks_df[keep].reset_index(drop=True) if not keep.all() else tracks_df
+
+def read_tracks(path:str,
+                columns:list = None,
+                t_range:tuple = None,
+                track_ids = None) -> DataFrame:
+    """
+    Function that reads a tracking table. Parquet tables only read the
+    requested columns and skip row groups outside the t/track_id filters;
+    CSV tables are parsed and filtered afterwards.
+    :path: str | .parquet or .csv table
+    :columns: list | columns to read, all if None
+    :t_range: tuple | (first, last) frames to keep, both included
+    :track_ids: iterable | track ids to keep
+    :return: DataFrame | tracking data with the schema dtypes
+    """
+    filters = get_filters(t_range, track_ids)
+
+    if is_parquet(path):
+        tracks_df = read_parquet(path, columns=columns, filters=filters)
+    else:
+        # filter columns must be read, then dropped
+        usecols = None if columns is None else list(dict.fromkeys([*columns, *(item[0] for item in filters or [])]))
+        # float and categorical columns are parsed straight to their dtype, ints are cast once checked for missing values
+        dtypes = {column : dtype for column, dtype in TRACK_SCHEMA.items() if not dtype.startswith("int")}
+        tracks_df = filter_rows(read_csv(path, usecols=usecols, dtype=dtypes), filters)
+        if columns is not None:
+            tracks_df = tracks_df[columns]
+
+    return apply_schema(tracks_df)
+
+def write_tracks(tracks_df:DataFrame, path:str) -> None:
+    """
+    Function that writes a tracking table, as Parquet (schema dtypes,
+    rows ordered by t so row groups can be skipped by frame) or CSV
+    :tracks_df: DataFrame | tracking data
+    :path: str | .parquet or .csv table
+    """
+    if not is_parquet(path):
+        tracks_df.to_csv(path, index=False)
+        return
+
+    tracks_df = apply_schema(tracks_df)
+    if "t" in tracks_df.columns:
+        tracks_df = tracks_df.sort_values("t", kind="stable")
+
+    tracks_df.to_parquet(path, index=False, row_group_size=ROW_GROUP_SIZE)
+
+def compact_batch(batch:pa.RecordBatch) -> pa.RecordBatch:
+    """
+    Function that casts a batch of an Arrow tracking table to the compact
+    dtypes: schema dtypes and float32 floats. Node ids stay int64 until
+    the whole table is read (see downcast_node_ids). Integer columns read
+    as floats are cast safely, so non integral values raise ArrowInvalid.
+    :batch: pyarrow.RecordBatch | tracking data
+    :return: pyarrow.RecordBatch | compact tracking data
+    """
+    fields = []
+    for field in batch.schema:
+        dtype = field.type
+        if field.name in NUMERIC_SCHEMA:
+            dtype = pa.from_numpy_dtype(np.dtype(NUMERIC_SCHEMA[field.name]))
+        elif pa.types.is_floating(dtype):
+            dtype = pa.float32()
+        fields.append(pa.field(field.name, dtype))
+
+    return batch.cast(pa.schema(fields))
+
+def downcast_node_ids(table:pa.Table) -> pa.Table:
+    """
+    Function that casts the node id columns of an Arrow tracking table
+    to int32 when all their values fit
+    :table: pyarrow.Table | tracking data
+    :return: pyarrow.Table | tracking data with compact node ids
+    """
+    limits = np.iinfo(np.int32)
+    for column in NODE_ID_COLUMNS:
+        if column not in table.column_names:
+            continue
+        bounds = pc.min_max(table[column]).as_py()
+        if bounds["min"] is not None and limits.min <= bounds["min"] and bounds["max"] <= limits.max:
+            table = table.set_column(table.column_names.index(column), column, table[column].cast(pa.int32()))
+
+    return table
+
+def sort_table(table:pa.Table) -> pa.Table:
+    """
+    Function that sorts an Arrow tracking table by (track_id, t) one
+    column at a time, so only one column is ever held twice
+    :table: pyarrow.Table | tracking data
+    :return: pyarrow.Table | sorted tracking data
+    """
+    order = pc.sort_indices(table, sort_keys=[("track_id", "ascending"), ("t", "ascending")])
+
+    names, columns = table.column_names, []
+    for _ in names:
+        columns.append(table.column(0).take(order))
+        table = table.remove_column(0)
+
+    return pa.table(columns, names=names)
+
+def sort_tracks(tracks_df:DataFrame) -> DataFrame:
+    """
+    Function that sorts a tracking table by (track_id, t), so the rows of
+    every track are contiguous and in time order
+    :tracks_df: DataFrame | tracking data
+    :return: DataFrame | sorted tracking data with a fresh index
+    """
+    order = np.lexsort((tracks_df["t"].to_numpy(), tracks_df["track_id"].to_numpy()))
+
+    # already sorted tables are not copied
+    if (order[1:] > order[:-1]).all():
+        return tracks_df.reset_index(drop=True)
+
+    return tracks_df.take(order).reset_index(drop=True)
+
+def get_track_offsets(tracks_df:DataFrame) -> tuple:
+    """
+    Function that gives the rows of every track of a table sorted by
+    (track_id, t): track track_ids[i] spans rows offsets[i]:offsets[i + 1]
+    :tracks_df: DataFrame | tracking data sorted by sort_tracks
+    :return: tuple | (track_ids, offsets) arrays, offsets has one extra item
+    """
+    track_ids = tracks_df["track_id"].to_numpy()
+
+    starts = np.flatnonzero(np.diff(track_ids)) + 1 if len(track_ids) else np.empty(0, dtype=np.intp)
+    offsets = np.concatenate([[0], starts, [len(track_ids)]]) if len(track_ids) else np.zeros(1, dtype=np.intp)
+
+    return track_ids[offsets[:-1]], offsets
+
+def load_track_table(path:str,
+                     columns:list = None,
+                     t_range:tuple = None,
+                     track_ids = None) -> tuple:
+    """
+    Function that loads a tracking table in compact form (TRACK_SCHEMA
+    dtypes, see compact_batch; text columns become categoricals), sorted by
+    (track_id, t), with the rows of each track. The file is streamed and
+    cast batch by batch in Arrow, so no wide int64/float64/object copy
+    of the table is ever held in memory.
+    :path: str | .parquet or .csv table
+    :columns: list | columns to read, all if None (t and track_id are always read)
+    :t_range: tuple | (first, last) frames to keep, both included
+    :track_ids: iterable | track ids to keep
+    :return: tuple | (tracks_df, track_ids, offsets), see get_track_offsets
+    """
+    filters = get_filters(t_range, track_ids)
+    if columns is not None:
+        columns = list(dict.fromkeys(["track_id", "t", *columns]))
+
+    # text columns are read dictionary encoded, schema columns straight in their dtype
+    if is_parquet(path):
+        text_columns = [field.name for field in pq.read_schema(path) if pa.types.is_string(field.type)]
+        file_format = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=text_columns))
+    else:
+        # ids written by pandas next to missing values are float formatted ("1.0"),
+        # integer columns are parsed as float64 (exact below 2**53) and cast by compact_batch
+        dtypes = {column : pa.float64() if dtype.startswith("int") else pa.from_numpy_dtype(np.dtype(dtype))
+                  for column, dtype in NUMERIC_SCHEMA.items()}
+        file_format = ds.CsvFileFormat(convert_options=pa_csv.ConvertOptions(column_types=dtypes,
+                                                                             auto_dict_encode=True,
+                                                                             strings_can_be_null=True))
+
+    # the file is streamed, only its compact batches are kept
+    batches = ds.dataset(path, format=file_format).to_batches(columns=columns,
+                                                              filter=pq.filters_to_expression(filters) if filters else None)
+    table = pa.Table.from_batches([compact_batch(batch) for batch in batches])
+
+    table = sort_table(downcast_node_ids(table))
+    tracks_df = table.to_pandas(strings_to_categorical=True, self_destruct=True, split_blocks=True)
+    del table
+
+    return (tracks_df, *get_track_offsets(tracks_df))
+
+def assign_label(tracks_df:DataFrame, rows, column:str, value:str) -> None:
+    """
+    Function that writes a label to some rows of a text column, adding it
+    to the categories when the column is categorical
+    :tracks_df: DataFrame | tracking data, edited in place
+    :rows: array | boolean mask or row positions
+    :column: str | label column (e.g. fate)
+    :value: str | label
+    :return: None
+    """
+    if column not in tracks_df.columns:
+        tracks_df[column] = Categorical(np.full(len(tracks_df), None, dtype=object), categories=[value])
+
+    labels = tracks_df[column]
+    if isinstance(labels.dtype, CategoricalDtype) and value not in labels.cat.categories:
+        tracks_df[column] = labels.cat.add_categories([value])
+
+    tracks_df.iloc[rows, tracks_df.columns.get_loc(column)] = value
+
+# End of current module
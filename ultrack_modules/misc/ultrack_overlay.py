@@ -6,7 +6,7 @@ Module that given a ultrack output table add ids numbers over the cell video
 # imports
 
 from multiprocessing import Pool
-from pandas import DataFrame, read_csv
+from pandas import DataFrame
 from functools import partial
 from glob import glob
 from os import makedirs
@@ -14,6 +14,9 @@ from os.path import join, basename
 from PIL import Image
 from PIL import ImageDraw, ImageFont
 
+from ultrack_modules.misc.track_store import read_tracks
+from ultrack_modules.misc.track_index import TrackIndex
+
 ###########################
 # define helper functions
 
@@ -51,7 +54,7 @@ def add_overlay_from_group(t, group, input_images, output_folder, phenotype="",
 
 def create_crops_from_folder(input_table: DataFrame, input_images_path: str,
                              output_folder: str, add_frame: bool,
-                             phenotype: str) -> None:
+                             phenotype: str, index: TrackIndex = None) -> None:
     """
     Function that creates crops from folder
     """
@@ -59,13 +62,15 @@ def create_crops_from_folder(input_table: DataFrame, input_images_path: str,
     # Create ordered list of images
     images = sorted(glob(join(input_images_path, "*.tif")))
 
-    # index dataframe by t for fast lookup
-    grouped_df = dict(tuple(input_table.groupby("t")))
+    # frame offsets for fast lookup
+    if index is None:
+        index = TrackIndex.from_table(input_table)
 
     # Create tasks for every frame in folder
     tasks = []
     for t, image_path in enumerate(images):
-        group = grouped_df.get(t, None)  # None if no detections
+        rows = index.frame_rows(t)
+        group = input_table.take(rows) if len(rows) else None  # None if no detections
         tasks.append((t, group))
 
     # Run in parallel
@@ -100,7 +105,7 @@ def main() -> None:
                         action="store",
                         required=True,
                         dest="input_table",
-                        help="Ultrack output table (.csv)")
+                        help="Ultrack output table (.csv or .parquet)")
 
     parser.add_argument("-im", "--input_images",
                         action="store",
@@ -125,8 +130,9 @@ def main() -> None:
 
     args_dict = vars(parser.parse_args())
 
-    # Open dataframe
-    df = read_csv(args_dict["input_table"])
+    # Open dataframe and its index (reused while the table is unchanged)
+    df = read_tracks(args_dict["input_table"])
+    index = TrackIndex.for_table(args_dict["input_table"], df)
 
     # make sure output folder exists
     makedirs(args_dict["output"], exist_ok=True)
@@ -136,7 +142,8 @@ def main() -> None:
                              input_images_path=args_dict["input_folder"],
                              output_folder=args_dict["output"],
                              add_frame = args_dict["add_frame"],
-                             phenotype = args_dict["phenotype"])
+                             phenotype = args_dict["phenotype"],
+                             index = index)
 
 ##########################
 # run code if runned directly
@@ -6,12 +6,14 @@ print("Importing required libraries...")
 from argparse import ArgumentParser
 
 
-from pandas import read_csv
-from pandas import DataFrame
+from pandas import DataFrame, Categorical
 from math import sqrt
 from math import pi
 from numpy import ndarray
 from numpy import append
+from numpy import diff, repeat, where, zeros
+from ultrack_modules.misc.track_store import load_track_table, sort_tracks, get_track_offsets
+from ultrack_modules.misc.lineage_index import LineageIndex, lineage_names
 print("All libraries imported sucessfully!")
 
 ####################################
@@ -35,7 +37,7 @@ def get_args_dict() -> dict:
                         action="store",
                         required=True,
                         dest="input_table",
-                        help="Path to a table from ultrack (.csv)")
+                        help="Path to a table from ultrack (.csv or .parquet)")
 
     parser.add_argument("-o", "--output",
                         action="store",
@@ -95,33 +97,6 @@ def convert_time_related_columns(input_table:DataFrame,
 
     return input_table
     
-def fix_branch_name_generation(table:DataFrame, index:int, generation = 0) -> None:
-    """
-    Function that receives a tracking df and a root cell index
-    and modifies the table to fill, generation, name and branch name
-    columns in CloVarS format
-    :table: DataFrame | trackings df
-    :index: int | root cell track_id
-    :generation: int | default = 0 | generation of index cell
-    :return: None 
-    """
-    children = table.loc[table["parent_track_id"] == index, "track_id"].unique()
-    if any(children):
-        for i, item in enumerate(children):
-            # fix generation
-            table.loc[table["track_id"] == item, "generation"] = generation+1
-            
-            # fix branch name
-            branch_name = table[table["track_id"] == index].get("branch_name").unique()[0]
-            table.loc[table["track_id"] == item, "branch_name"] = branch_name
-            
-            # fix name
-            name = table[table["track_id"] == index].get("name").unique()[0] + f".{i+1}"
-            table.loc[table["track_id"] == item, "name"] = name
-            
-            table = fix_branch_name_generation(table, item, generation=generation+1)
-    return table
-
 def ultrack_to_clovars(input_table:DataFrame,
                        time_interval:float,
                        colony_name:str,
@@ -133,6 +108,10 @@ def ultrack_to_clovars(input_table:DataFrame,
     :time_interval: float | time between frames (minutes)
     :return: DataFrame | converted table
     """
+    # rows of every track, in time order
+    input_table = sort_tracks(input_table)
+    _, offsets = get_track_offsets(input_table)
+    
     # resolve time related columns
     input_table = convert_time_related_columns(input_table, time_interval)
     
@@ -141,71 +120,39 @@ def ultrack_to_clovars(input_table:DataFrame,
     input_table["treatment_name"] = treatment_name
     input_table["signal_value"] = 0
     
-    # Resolve branch_name, generation and name
-    root_ids = input_table.loc[input_table["parent_track_id"] == -1, "track_id"].unique()
+    # Resolve branch_name, generation and name, from the lineage of the tracks
+    lineage = LineageIndex.from_table(input_table, time_column="simulation_frames")
+    names, branch_names = lineage_names(lineage, colony_name)
     
-    input_table["name"] = ""
-    input_table["generation"] = -1   
-    input_table["branch_name"] = ""
-
-    for index, item in enumerate(root_ids):
-        branch_name = colony_name + "-" + str(index+1)
-        
-        input_table.loc[input_table["track_id"] == item, "branch_name"] = branch_name
-        input_table.loc[input_table["track_id"] == item, "name"] = branch_name
-        input_table.loc[input_table["track_id"] == item, "generation"] = 0
-        
+    track_lengths = diff(offsets)
+    input_table["name"] = repeat(names, track_lengths)
+    input_table["generation"] = repeat(lineage.depth, track_lengths)
+    input_table["branch_name"] = repeat(branch_names, track_lengths)
         
-        input_table = fix_branch_name_generation(table=input_table,index=item)
-        
-    # Resolve seconds_since_birth
-    input_table["seconds_since_birth"] = 0
+    # Resolve seconds_since_birth, rows are sorted by (track_id, t)
+    # so the first row of every track is its birth
+    seconds = input_table["simulation_seconds"].to_numpy()
+    seconds_since_birth = seconds - repeat(seconds[offsets[:-1]], track_lengths)
+
+    # whole seconds stay integers, as in the earlier tables
+    if (seconds_since_birth == seconds_since_birth.round()).all():
+        seconds_since_birth = seconds_since_birth.astype("int64")
+    input_table["seconds_since_birth"] = seconds_since_birth
     
+    # Resolve fate at next frame
     
-    # Iterate over each cell assigning current second - birth second to
-    # seconds since birth
-    for id in input_table["track_id"].unique():
-        
-        birth_second = min(input_table.loc[input_table["track_id"] == id, 
-                                           "simulation_seconds"])
-        input_table.loc[input_table["track_id"] == id, 
-                        "seconds_since_birth"] = input_table["simulation_seconds"] - birth_second
+    # a row without its track in the next frame is a division (parent tracks) or a death
+    frames = input_table["simulation_frames"].to_numpy()
+    rows_track_ids = input_table["track_id"].to_numpy()
     
-    # Resolve fate at next frame
+    has_next = zeros(len(frames), dtype=bool)
+    has_next[:-1] = (rows_track_ids[1:] == rows_track_ids[:-1]) & (frames[1:] == frames[:-1] + 1)
     
-    # define default value
-    input_table["fate_at_next_frame"] = "migration"
-
-    # create variables for the last and current frame
-    max_frame = max(input_table["simulation_frames"])
-    current_frame = 0
-    # create variable for current frame track_ids
-    current_ids = input_table.loc[input_table["simulation_frames"] == current_frame, "track_id"].unique()
+    ends = ~has_next & (frames < frames.max())
+    is_parent = repeat(lineage.n_children() > 0, track_lengths)
     
-    while current_frame < max_frame:
-        # discover track_ids from the next frame
-        next_ids = input_table.loc[input_table["simulation_frames"] == current_frame+1, "track_id"].unique()
-        
-        # iterate over current ids
-        for id in current_ids:
-            # if current frame id is not in the next frame
-            if id not in next_ids:
-                # check if it is a parent
-                parent_track_ids = input_table["parent_track_id"].unique()
-                # if it is not a parent, it is dead
-                if id not in parent_track_ids:
-                    input_table.loc[(input_table["simulation_frames"] == current_frame)  &
-                                    (input_table["track_id"] == id), 
-                                    "fate_at_next_frame"] = "death"
-                # if it is, it is dividing
-                else:
-                    input_table.loc[(input_table["simulation_frames"] == current_frame)  &
-                                    (input_table["track_id"] == id), 
-                                    "fate_at_next_frame"] = "division"
-        # increment current frame
-        current_frame += 1
-        # make current ids <- next ids
-        current_ids = next_ids.copy()
+    input_table["fate_at_next_frame"] = Categorical.from_codes(where(ends, where(is_parent, 2, 1), 0).astype("int8"),
+                                                               categories=["migration", "death", "division"])
     
     # filter only wanted
     input_table = input_table.drop(['parent_id', 'parent_track_id', 'id'], axis=1)
@@ -247,7 +194,7 @@ def main() -> None:
     treatment_name   = args_dict["treatment_name"]
     
     # Open input table
-    input_table = read_csv(input_path)
+    input_table, _, _ = load_track_table(input_path)
     
     # Convert table
     converted_table = ultrack_to_clovars(input_table = input_table,
@@ -7,9 +7,9 @@ the last frame from a parent cell (mitosis frame)
 from argparse import ArgumentParser
 
 from pandas import DataFrame
-from pandas import read_csv
 
-from numpy import delete, where
+from ultrack_modules.misc.track_store import load_track_table, sort_tracks, get_track_offsets, write_tracks
+from ultrack_modules.misc.lineage_index import LineageIndex
 
 ####################################
 # Define Argument Parsing Function
@@ -32,7 +32,7 @@ def get_args_dict() -> dict:
                         action="store",
                         required=True,
                         dest="input",
-                        help="Ultrack table (.csv)")
+                        help="Ultrack table (.csv or .parquet)")
 
     parser.add_argument("-o", "--output_table",
                         action="store",
@@ -58,33 +58,15 @@ def isolate_mitosis(table:DataFrame) -> DataFrame:
     :return: pandas.DaraFrame | mitosis table
     """
 
-    # Define parents list
-    parents = table["parent_track_id"].unique()
+    # rows of every track, in time order
+    table = sort_tracks(table)
+    _, offsets = get_track_offsets(table)
 
-    # Remove -1 index
-    parents = delete(parents, where(parents == -1))
+    # last row of every parent track, both are ordered by track id
+    lineage = LineageIndex.from_table(table)
+    last_rows = offsets[1:][lineage.n_children() > 0] - 1
 
-    # Create dict to create dataframe
-    data_dict = {"track_id" : parents,
-                 "t" : [],
-                 "x" : [],
-                 "y" : []}
-
-    # populate dict for each parent
-    for parent in parents:
-        parent_data = table[table["track_id"] == parent]
-
-        max_t = parent_data["t"].max()
-
-        mitosis_data = parent_data[parent_data["t"] == max_t]
-
-        if len(mitosis_data) > 0:
-
-            data_dict["t"].append(max_t)
-            data_dict["x"].append(mitosis_data["x"].item())
-            data_dict["y"].append(mitosis_data["y"].item())
-
-    mitosis_table = DataFrame(data=data_dict)
+    mitosis_table = table.iloc[last_rows][["track_id", "t", "x", "y"]].reset_index(drop=True)
 
     return mitosis_table
 
@@ -104,13 +86,13 @@ def main() -> None:
     output_path = args_dict["output"]
 
     # Open table
-    input_table = read_csv(input_path)
+    input_table, _, _ = load_track_table(input_path, columns=["parent_track_id", "x", "y"])
 
     # Call mitosis function
     mitosis_table = isolate_mitosis(table = input_table)
 
     # Save table
-    mitosis_table.to_csv(output_path, index=False)
+    write_tracks(mitosis_table, output_path)
 
     print("Done!")
     
@@ -8,6 +8,7 @@ from warnings import filterwarnings
 from pandas import DataFrame, read_csv, merge, concat
 import matplotlib.pyplot as plt
 import seaborn as sns
+from ultrack_modules.misc.track_store import read_tracks
 
 ######################################
 # Define helper functions
@@ -147,7 +148,7 @@ def main() -> None:
     args_dict : dict = vars(parser.parse_args())
 
     # Open tables
-    tracking_df : DataFrame    = read_csv(args_dict["tracking_table"])
+    tracking_df : DataFrame    = read_tracks(args_dict["tracking_table"])
 
     ground_truth_df: DataFrame = read_csv(args_dict["ground_truth"])
     
@@ -4,9 +4,10 @@ Module that creates a distribution plot for detected mitosis, ground truth and t
 
 #############################################
 # imports
-from pandas import DataFrame, read_csv
+from pandas import DataFrame
 import seaborn as sns
 import matplotlib.pyplot as plt
+from ultrack_modules.misc.track_store import read_tracks
 
 #############################################
 # Define helper functions
@@ -33,11 +34,11 @@ def main() -> None:
                         action="store",
                         dest="input",
                         required=True,
-                        help="Input table (.csv)")
+                        help="Input table (.csv or .parquet)")
 
     args_dict = vars(parser.parse_args())
 
-    input_df = read_csv(args_dict["input"])
+    input_df = read_tracks(args_dict["input"])
 
     mitosis_distribution(input_df)
 
@@ -8,9 +8,13 @@ Module that evaluates the proportion of right mitosis
 from argparse import ArgumentParser
 
 from pandas import DataFrame
-from pandas import read_csv, merge
+from pandas import read_csv
+
+import numpy as np
 
 from ultrack_modules.mitosis_evaluation.isolate_mitosis import isolate_mitosis
+from ultrack_modules.misc.track_store import read_tracks, load_track_table
+from ultrack_modules.misc.track_index import TrackIndex
 
 ####################################
 # Define Argument Parsing Function
@@ -39,7 +43,7 @@ def get_args_dict() -> dict:
                         action="store",
                         required=True,
                         dest="tracking_table",
-                        help="Table from ultrack (.csv)")
+                        help="Table from ultrack (.csv or .parquet)")
 
     parser.add_argument("--t-tolerance", "-tt",
                         action="store",
@@ -97,28 +101,24 @@ def evaluate_mitosis(ground_truth : DataFrame,
     # Create true/false positive/negative variables
     tp = fp = fn = 0
 
+    # ground truth frames and positions are indexed once, a square
+    # neighbourhood (p=inf) of side 2 * p_tolerance is a box query
+    gt_index = TrackIndex.from_table(ground_truth, track_column=None)
+    matched = np.zeros(len(ground_truth), dtype=bool)
+
     # Populate variables
     # loop
     l_gt = len(ground_truth)
-    for id in tracking["track_id"].unique():
-        # Get tracking data
-        tracking_data   = tracking[tracking["track_id"] == id]
-
-        tracking_t      = tracking_data.t.item()
-        tracking_x      = tracking_data.x.item()
-        tracking_y      = tracking_data.y.item()
-
-        filtered_dataset = ground_truth[(ground_truth.t >= tracking_t - t_tolerance) &
-                                        (ground_truth.t <= tracking_t + t_tolerance) &
-                                        (ground_truth.x >= tracking_x - p_tolerance) &
-                                        (ground_truth.x <= tracking_x + p_tolerance) &
-                                        (ground_truth.y >= tracking_y - p_tolerance) &
-                                        (ground_truth.y <= tracking_y + p_tolerance)]
+    for tracking_t, tracking_x, tracking_y in zip(tracking.t.to_numpy(), tracking.x.to_numpy(), tracking.y.to_numpy()):
+        near = [gt_index.query_radius(t, (tracking_x, tracking_y), p_tolerance, p=np.inf)[0]
+                for t in range(int(tracking_t) - t_tolerance, int(tracking_t) + t_tolerance + 1)]
+        near = np.concatenate(near)
 
-        ground_truth = (merge(ground_truth ,filtered_dataset,indicator=True, how='outer')
-                        .query('_merge=="left_only"').drop('_merge', axis=1))
+        # ground truth mitosis are matched at most once
+        near = near[~matched[near]]
+        matched[near] = True
 
-        if len(filtered_dataset) > 0:
+        if len(near) > 0:
             tp += 1
 
     fp = len(tracking) - tp
@@ -153,10 +153,12 @@ def main() -> None:
 
     # Open tables
     ground_truth_table  = read_csv(ground_truth_path)
-    mitosis_table      = read_csv(tracking_table_path)
 
-    if not is_mitosis:
-        mitosis_table = isolate_mitosis(mitosis_table)
+    if is_mitosis:
+        mitosis_table = read_tracks(tracking_table_path)
+    else:
+        tracking_table, _, _ = load_track_table(tracking_table_path, columns=["parent_track_id", "x", "y"])
+        mitosis_table = isolate_mitosis(tracking_table)
     
     # Run evaluation function
     precision, recall, f1 = evaluate_mitosis(ground_truth= ground_truth_table,
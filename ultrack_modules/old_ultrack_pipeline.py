@@ -18,8 +18,8 @@ from dask.array import from_zarr
 from os.path import join
 from os import makedirs
 
-from src.aux_funcs import print_execution_parameters, enter_to_continue
-from src.tracking.ultrack.tracking.ultrack_track_video import track_video
+from ultrack_modules.misc.aux_funcs import print_execution_parameters, enter_to_continue
+from ultrack_modules.tracking.ultrack_track_video import track_video
 
 print("All libraries imported sucessfully!")
 
@@ -6,11 +6,23 @@ Module that segments cells using Cellpose (cyto3 model)
 import os
 import numpy as np
 from tifffile import imread, imwrite
-from cellpose import models, io
-import torch
 from tqdm import tqdm
 from argparse import ArgumentParser
 
+# the segmentation server is optional, without the repository on the
+# path the model is loaded locally
+try:
+    from ultrack_modules.misc.segmentation_server import server_available, segment_remote
+except ImportError:
+    def server_available() -> bool:
+        return False
+
+#########################################
+# Define global variables
+
+# cellpose falls back to CPU by itself when no GPU is available
+SERVER_MODEL_KWARGS = {"model_type": "cyto3", "gpu": True}
+
 #########################################
 # Define helper functions
 
@@ -20,10 +32,10 @@ def segment_with_cellpose(image_path:str, model) -> tuple:
 
     params:
     image_path:str | path to input image
-    model: Cellpose model instance
+    model: Cellpose model instance, None to use the running segmentation server
 
     returns:
-    original image, mask, flow
+    original image, mask, flow (None when segmented by the server)
     """
     img = imread(image_path)
 
@@ -31,6 +43,12 @@ def segment_with_cellpose(image_path:str, model) -> tuple:
     if img.ndim > 2:
         img = img[0] if img.shape[0] < img.shape[-1] else img[..., 0]
 
+    if model is None:
+        masks = segment_remote("cellpose", image=img,
+                               model_kwargs=SERVER_MODEL_KWARGS,
+                               eval_kwargs={"diameter": None})
+        return img, masks, None
+
     masks, flows, _ = model.eval(img, diameter=None)
     return img, masks, flows
 
@@ -42,9 +60,17 @@ def run_cellpose_segmentation(input_path:str, output_path:str):
     input_path:str  | path to folder containing input images
     output_path:str | path to folder where masks will be saved
     """
-    # Check GPU availability
-    use_gpu = torch.cuda.is_available()
-    model = models.CellposeModel(model_type='cyto3', gpu=use_gpu)
+    if server_available():
+        # models are already loaded by the segmentation server
+        print("Using running segmentation server...")
+        model = None
+    else:
+        import torch
+        from cellpose import models
+
+        # Check GPU availability
+        use_gpu = torch.cuda.is_available()
+        model = models.CellposeModel(model_type='cyto3', gpu=use_gpu)
 
     # List input images
     filenames = sorted([f for f in os.listdir(input_path) if f.lower().endswith(('.tif', '.tiff'))])
@@ -55,7 +81,7 @@ def run_cellpose_segmentation(input_path:str, output_path:str):
     for image_path, filename in tqdm(zip(filepaths, filenames), total=len(filenames), desc="Running Cellpose"):
         img, masks, flows = segment_with_cellpose(image_path, model)
         out_path = os.path.join(output_path, filename)
-        io.imsave(out_path, masks.astype(np.uint8))
+        imwrite(out_path, masks.astype(np.uint8))
 
 #########################################
 # Define main function
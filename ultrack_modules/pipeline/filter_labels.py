@@ -0,0 +1,279 @@
+"""
+Module that filters segmentation labels before tracking, removing
+debris, merged blobs and cells touching the image border
+"""
+#########################################
+# Imports
+import os
+import tomllib
+import numpy as np
+from tifffile import imread, imwrite
+from scipy.ndimage import find_objects
+from multiprocessing import Pool
+from functools import partial
+from tqdm import tqdm
+from argparse import ArgumentParser
+
+#########################################
+# Define helper functions
+
+def smallest_label_dtype(n_labels:int, min_dtype=np.uint8) -> np.dtype:
+    """
+    Function that returns the smallest unsigned dtype able to hold n_labels
+
+    params:
+    n_labels:int | greatest label value to be stored
+    min_dtype | smallest dtype allowed
+
+    returns:
+    numpy dtype
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if np.dtype(dtype).itemsize >= np.dtype(min_dtype).itemsize and n_labels <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+def label_properties(frame:np.ndarray) -> dict:
+    """
+    Function that computes area, border contact and eccentricity
+    for every label of a frame in a single bincount/find_objects pass
+
+    params:
+    frame:np.ndarray | 2D labels image
+
+    returns:
+    dict of arrays indexed by label (index 0 is the background)
+    """
+    flat = frame.ravel().astype(np.intp, copy=False)
+    n_labels = int(flat.max()) + 1 if flat.size else 1
+    height, width = frame.shape
+
+    # pixel coordinates, in the same order as flat
+    rows = np.repeat(np.arange(height, dtype=np.float64), width)
+    cols = np.tile(np.arange(width, dtype=np.float64), height)
+
+    # raw moments up to second order
+    area = np.bincount(flat, minlength=n_labels).astype(np.float64)
+    sum_r = np.bincount(flat, weights=rows, minlength=n_labels)
+    sum_c = np.bincount(flat, weights=cols, minlength=n_labels)
+    sum_rr = np.bincount(flat, weights=rows * rows, minlength=n_labels)
+    sum_cc = np.bincount(flat, weights=cols * cols, minlength=n_labels)
+    sum_rc = np.bincount(flat, weights=rows * cols, minlength=n_labels)
+
+    # central second moments
+    safe_area = np.maximum(area, 1)
+    mean_r, mean_c = sum_r / safe_area, sum_c / safe_area
+    mu_rr = sum_rr / safe_area - mean_r ** 2
+    mu_cc = sum_cc / safe_area - mean_c ** 2
+    mu_rc = sum_rc / safe_area - mean_r * mean_c
+
+    # inertia tensor eigenvalues -> eccentricity (same definition as regionprops)
+    half_trace = (mu_rr + mu_cc) / 2
+    delta = np.sqrt(np.maximum(((mu_rr - mu_cc) / 2) ** 2 + mu_rc ** 2, 0))
+    major, minor = half_trace + delta, np.maximum(half_trace - delta, 0)
+    eccentricity = np.where(major > 0, np.sqrt(1 - minor / np.where(major > 0, major, 1)), 0)
+
+    # border contact, from the label bounding boxes
+    border = np.zeros(n_labels, dtype=bool)
+    for label, slices in enumerate(find_objects(frame), start=1):
+        if slices is None:
+            continue
+        border[label] = (slices[0].start == 0 or slices[1].start == 0
+                         or slices[0].stop == height or slices[1].stop == width)
+
+    return {"area"          : area,
+            "border"        : border,
+            "eccentricity"  : eccentricity}
+
+def filter_frame(frame:np.ndarray,
+                 min_area:float = 0,
+                 max_area:float = np.inf,
+                 remove_border:bool = False,
+                 max_eccentricity:float = 1.0,
+                 min_dtype = np.uint8) -> np.ndarray:
+    """
+    Function that drops labels by area, border contact and eccentricity
+    and relabels the remaining ones sequentially
+
+    params:
+    frame:np.ndarray | 2D labels image
+    min_area:float | smallest area kept (pixels)
+    max_area:float | greatest area kept (pixels)
+    remove_border:bool | whether to drop labels touching the border
+    max_eccentricity:float | greatest eccentricity kept (1 keeps all)
+    min_dtype | smallest output dtype allowed
+
+    returns:
+    relabelled frame in the smallest sufficient dtype
+    """
+    props = label_properties(frame)
+
+    keep = (props["area"] > 0) & (props["area"] >= min_area) & (props["area"] <= max_area)
+    if remove_border:
+        keep &= ~props["border"]
+    if max_eccentricity < 1:
+        keep &= props["eccentricity"] <= max_eccentricity
+    keep[0] = False
+
+    n_kept = int(keep.sum())
+    dtype = smallest_label_dtype(n_kept, min_dtype=min_dtype)
+
+    # lookup table old label -> new sequential label
+    lut = np.zeros(len(keep), dtype=dtype)
+    lut[keep] = np.arange(1, n_kept + 1, dtype=dtype)
+
+    return lut[frame]
+
+def filter_labels_video(video, n_workers:int = None, **filter_kwargs) -> np.ndarray:
+    """
+    Function that filters every frame of a labels video in parallel
+
+    params:
+    video | (T, Y, X) labels video (NumPy or Dask)
+    n_workers:int | number of processes, all cores if None
+    filter_kwargs | thresholds passed to filter_frame
+
+    returns:
+    filtered (T, Y, X) labels video
+    """
+    frames = (np.asarray(frame) for frame in video)
+
+    with Pool(n_workers) as pool:
+        filtered = list(pool.imap(partial(filter_frame, **filter_kwargs), frames))
+
+    # stacking promotes every frame to the smallest dtype sufficient for all
+    return np.stack(filtered)
+
+def filter_file(filename:str, input_path:str, output_path:str, **filter_kwargs) -> int:
+    """
+    Function that filters a single mask file and saves it
+
+    params:
+    filename:str | name of the mask file
+    input_path:str | folder containing the input masks
+    output_path:str | folder where filtered masks will be saved
+    filter_kwargs | thresholds passed to filter_frame
+
+    returns:
+    number of kept labels
+    """
+    filtered = filter_frame(imread(os.path.join(input_path, filename)), **filter_kwargs)
+    imwrite(os.path.join(output_path, filename), filtered)
+    return int(filtered.max())
+
+def run_label_filtering(input_path:str, output_path:str, n_workers:int = None, **filter_kwargs) -> None:
+    """
+    Function that filters all masks in a folder, streaming frames
+    through a process pool
+
+    params:
+    input_path:str  | path to folder containing segmentation masks
+    output_path:str | path to folder where filtered masks will be saved
+    n_workers:int | number of processes, all cores if None
+    filter_kwargs | thresholds passed to filter_frame
+    """
+    filenames = sorted([f for f in os.listdir(input_path) if f.lower().endswith(('.tif', '.tiff'))])
+
+    os.makedirs(output_path, exist_ok=True)
+
+    # files are written individually, so keep a common dtype for stacking them later
+    filter_kwargs.setdefault("min_dtype", np.uint16)
+
+    worker = partial(filter_file, input_path=input_path, output_path=output_path, **filter_kwargs)
+
+    with Pool(n_workers) as pool:
+        n_kept = list(tqdm(pool.imap(worker, filenames), total=len(filenames), desc="Filtering labels"))
+
+    print(f"Kept {sum(n_kept)} labels in {len(filenames)} frames")
+
+def read_area_limits(config_path:str) -> tuple:
+    """
+    Function that reads min_area and max_area from an ultrack config
+
+    params:
+    config_path:str | path to ultrack config (.toml)
+
+    returns:
+    (min_area, max_area)
+    """
+    with open(config_path, "rb") as file:
+        segmentation_config = tomllib.load(file).get("segmentation", {})
+
+    return segmentation_config.get("min_area", 0), segmentation_config.get("max_area", np.inf)
+
+#########################################
+# Define main function
+def main() -> None:
+    """
+    Code's main function
+    """
+    parser = ArgumentParser()
+
+    parser.add_argument("-i", "--input",
+                        action="store",
+                        dest="input_path",
+                        required=True,
+                        help="Path to folder containing segmentation masks.")
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        dest="output_path",
+                        required=True,
+                        help="Path to folder where filtered masks will be saved.")
+
+    parser.add_argument("-c", "--config",
+                        action="store",
+                        dest="config_path",
+                        required=False,
+                        default=None,
+                        help="Ultrack config (.toml) to read min_area/max_area from.")
+
+    parser.add_argument("--min_area",
+                        action="store",
+                        type=float,
+                        required=False,
+                        default=None,
+                        help="Smallest label area kept (overrides config).")
+
+    parser.add_argument("--max_area",
+                        action="store",
+                        type=float,
+                        required=False,
+                        default=None,
+                        help="Greatest label area kept (overrides config).")
+
+    parser.add_argument("--remove_border",
+                        action="store_true",
+                        required=False,
+                        help="Drop labels touching the image border.")
+
+    parser.add_argument("--max_eccentricity",
+                        action="store",
+                        type=float,
+                        required=False,
+                        default=1.0,
+                        help="Greatest label eccentricity kept (default: 1, keeps all).")
+
+    parser.add_argument("--n_workers",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=None,
+                        help="Number of processes (default: all cores).")
+
+    args = parser.parse_args()
+
+    min_area, max_area = read_area_limits(args.config_path) if args.config_path else (0, np.inf)
+
+    run_label_filtering(args.input_path, args.output_path,
+                        n_workers=args.n_workers,
+                        min_area=args.min_area if args.min_area is not None else min_area,
+                        max_area=args.max_area if args.max_area is not None else max_area,
+                        remove_border=args.remove_border,
+                        max_eccentricity=args.max_eccentricity)
+
+    print("Label filtering complete!")
+
+#########################################
+# Execute if run directly
+if __name__ == "__main__": main()
@@ -4,21 +4,18 @@ Module that tracks a segmentation masks video and exports its tracking table
 ####################################
 from argparse import ArgumentParser
 
-
-from pathlib import Path
-from ultrack.utils import estimate_parameters_from_labels, labels_to_contours
 from ultrack.config.config import MainConfig
-from ultrack import load_config, track, to_tracks_layer
-from ultrack.tracks import close_tracks_gaps
-from ultrack.imgproc import tracks_properties
-from ultrack.core.export import to_ctc
-
-from matplotlib.pyplot import show
+from ultrack import load_config
 
 from dask.array.image import imread
 from dask.array.core import Array
 from pandas import DataFrame
 
+from ultrack_modules.tracking.ultrack_track_engine import track_segmentation as track_once
+from ultrack_modules.tracking.ultrack_track_engine import export_tracks, plot_areas_graph, WINDOWS_REPORT
+from ultrack_modules.tracking.tracking_profiler import StageProfiler, RUN_REPORT
+
+from os import makedirs
 from os.path import join
 
 ####################################
@@ -61,7 +58,21 @@ def get_args_dict() -> dict:
                         action="store_true",
                         required=False,
                         dest="make_graph",
-                        help="Whether to make areas graph to tune configs")
+                        help="Save areas/distances histograms and a suggested config, then exit")
+
+    parser.add_argument("--memory_budget",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=None,
+                        dest="memory_budget",
+                        help="Solver memory budget in GB, enables windowed tracking sized to fit it")
+
+    parser.add_argument("--profile",
+                        action="store_true",
+                        required=False,
+                        dest="profile",
+                        help=f"Record time, CPU, peak memory and counts of every stage into {RUN_REPORT}")
     
     # creating arguments dictionary
     args_dict = vars(parser.parse_args())
@@ -72,34 +83,32 @@ def get_args_dict() -> dict:
 ####################################
 # Defining helper functions
 
-def track_segmentation(video:Array, config_file:MainConfig, output_dir:str) -> DataFrame:
+def track_segmentation(video:Array,
+                       config_file:MainConfig,
+                       output_dir:str,
+                       memory_budget:float = None,
+                       profile:bool = False) -> DataFrame:
     """
-    Function that tracks a segmentation masks video
+    Function that tracks a segmentation masks video once and exports
+    it as csv and CTC from the same solution
     :video: dask.Array | Array contaning the video data
-    :config_file: str | path to the ultrack configuration file
-    :return: pandas.DataFrame | tracks_df with tracking data 
-    """ 
-    # Create detection and edges
-    detection, edges = labels_to_contours(video, sigma=4.5)
-    
-    # track the video
-    track(
-        detection=detection,
-        edges=edges,
-        config=config_file,
-        overwrite=True,
-    )
-    
-    # create tracks df
-    tracks_df, _ = to_tracks_layer(config_file)
-    
-    # close tracks gaps
-    print("[Using function close_tracks_gaps, to disable comment line 94!]")
-    tracks_df = close_tracks_gaps(tracks_df, 50, 50, spatial_columns=["x", "y"])
+    :config_file: MainConfig | ultrack configuration
+    :output_dir: str | folder to save the exports
+    :memory_budget: float | solver memory budget (bytes), solves in windows when set
+    :profile: bool | whether to save a per stage run report
+    :return: pandas.DataFrame | tracks_df with tracking data
+    """
+    makedirs(output_dir, exist_ok=True)
+    profiler = StageProfiler(enabled=profile)
+
+    tracks_df = track_once(video, config_file, memory_budget=memory_budget,
+                           windows_report=join(output_dir, WINDOWS_REPORT),
+                           profiler=profiler)
 
-    to_ctc(Path(output_dir),config_file)
+    export_tracks(tracks_df, config_file, ["csv", "ctc"], output_dir, profiler=profiler)
+
+    profiler.save(join(output_dir, RUN_REPORT), shape=video.shape)
 
-    # return tracks_df
     return tracks_df
 
 ####################################
@@ -118,23 +127,22 @@ def main() -> None:
     config_file     = args_dict["config_file"]
     output_file     = args_dict["output"]
     make_graph      = args_dict["make_graph"]
+    memory_budget   = args_dict["memory_budget"]
 
     # Open segmentation mask
     segmentation_video = imread(input_folder + "/*")
     
     # if make graph is true, make the graph and exit function
     if make_graph:
-        params_df = estimate_parameters_from_labels(segmentation_video, is_timelapse=True)
-        params_df["area"].plot(kind="hist", bins=100, title="Area histogram")
-        show()
+        plot_areas_graph(segmentation_video, config_file, output_file)
         return
 
     conf_obj = load_config(config_file)
 
-    # else, track the video
-    tracks_df = track_segmentation(video=segmentation_video, config_file=conf_obj, output_dir=output_file)
-    
-    tracks_df.to_csv(join(output_file, "trackings.csv"))
+    # else, track the video (exports trackings.csv and CTC files)
+    track_segmentation(video=segmentation_video, config_file=conf_obj, output_dir=output_file,
+                       memory_budget=memory_budget * 1e9 if memory_budget else None,
+                       profile=args_dict["profile"])
 
     print("Done!")
     
@@ -0,0 +1,215 @@
+"""
+Module that appends newly acquired frames to an existing tracking.
+Only a trailing window overlapping the previous solution plus the new
+frames is tracked, and its tracks are matched to the previous ones in
+the last tracked frame, so an update costs as much as the new frames.
+"""
+####################################
+from json import dump, load
+from os import makedirs
+from os.path import exists, join
+from shutil import rmtree
+
+from ultrack.config.config import MainConfig
+
+from dask.array.core import Array
+from pandas import DataFrame, concat, read_csv
+
+import numpy as np
+
+from ultrack_modules.tracking.ultrack_track_engine import track_segmentation, isolated_config
+from ultrack_modules.tracking.close_gaps import MAX_GAP, MAX_DISTANCE
+from ultrack_modules.misc.match_detections import match_detections
+
+####################################
+# Define global variables
+
+STATE_DIR : str     = ".append_state"
+STATE_FILE : str    = "state.json"
+TAIL_FILE : str     = "tail.csv"
+
+# frames of the previous solution tracked again with every update
+OVERLAP : int       = 10
+
+####################################
+# Defining helper functions
+
+def load_state(output_dir:str) -> tuple:
+    """
+    Function that reads the state left by the previous run
+    :output_dir: str | output folder of the tracking
+    :return: tuple | (state dict, tail DataFrame) or (None, None) on first run
+    """
+    state_path = join(output_dir, STATE_DIR, STATE_FILE)
+    if not exists(state_path):
+        return None, None
+
+    with open(state_path) as file:
+        state = load(file)
+
+    return state, read_csv(join(output_dir, STATE_DIR, TAIL_FILE))
+
+def save_state(output_dir:str, tracks_df:DataFrame, state:dict, overlap:int) -> None:
+    """
+    Function that saves what the next update needs: counters and the
+    rows of the last overlap frames
+    :output_dir: str | output folder of the tracking
+    :tracks_df: DataFrame | rows of the last run (at least the tail frames)
+    :state: dict | n_frames, max_track_id and max_node_id
+    :overlap: int | frames kept as tail
+    """
+    makedirs(join(output_dir, STATE_DIR), exist_ok=True)
+
+    tail = tracks_df[tracks_df["t"] > state["n_frames"] - 1 - overlap]
+    tail.to_csv(join(output_dir, STATE_DIR, TAIL_FILE), index=False)
+
+    with open(join(output_dir, STATE_DIR, STATE_FILE), "w") as file:
+        dump(state, file, indent=2)
+
+def map_to_previous(window_df:DataFrame,
+                    tail:DataFrame,
+                    last_frame:int,
+                    tolerance:float) -> tuple:
+    """
+    Function that matches the window tracks to the previous tracks
+    using their detections in the last previously tracked frame
+    :window_df: DataFrame | window tracks, in movie frames
+    :tail: DataFrame | previous rows of the overlap frames
+    :last_frame: int | last previously tracked frame
+    :tolerance: float | greatest centroid distance between matched detections
+    :return: tuple | (window track -> previous track, window node -> previous node)
+    """
+    window_last = window_df[window_df["t"] == last_frame]
+    previous_last = tail[tail["t"] == last_frame]
+
+    window_idx, previous_idx = match_detections(window_last[["y", "x"]].to_numpy(),
+                                                previous_last[["y", "x"]].to_numpy(),
+                                                tolerance)
+
+    track_map = dict(zip(window_last["track_id"].to_numpy()[window_idx],
+                         previous_last["track_id"].to_numpy()[previous_idx]))
+    node_map = dict(zip(window_last["id"].to_numpy()[window_idx],
+                        previous_last["id"].to_numpy()[previous_idx]))
+
+    return track_map, node_map
+
+def relabel_window(window_df:DataFrame,
+                   track_map:dict,
+                   node_map:dict,
+                   state:dict) -> DataFrame:
+    """
+    Function that gives the new rows of the window the previous ids when
+    they continue a previous track, and fresh ids otherwise
+    :window_df: DataFrame | window rows after the last tracked frame
+    :track_map: dict | window track -> previous track
+    :node_map: dict | window node -> previous node (last tracked frame)
+    :state: dict | max_track_id and max_node_id of the previous runs
+    :return: DataFrame | rows with ids continuing the previous solution
+    """
+    window_df = window_df.copy()
+
+    # fresh track ids for tracks born in the window
+    track_ids = np.unique(np.concatenate([window_df["track_id"].to_numpy(),
+                                          window_df["parent_track_id"].to_numpy()]))
+    track_ids = track_ids[(track_ids > 0) & ~np.isin(track_ids, list(track_map))]
+    track_map = {**track_map,
+                 **dict(zip(track_ids, np.arange(1, len(track_ids) + 1) + state["max_track_id"]))}
+
+    # node ids are shifted past the previous ones
+    node_offset = state["max_node_id"]
+
+    window_df["track_id"] = window_df["track_id"].map(track_map)
+    window_df["parent_track_id"] = window_df["parent_track_id"].map(track_map).fillna(-1).astype(np.int64)
+
+    parent_ids = window_df["parent_id"].to_numpy()
+    continued = np.isin(parent_ids, list(node_map))
+    window_df["parent_id"] = np.where(continued,
+                                      window_df["parent_id"].map(node_map).fillna(-1),
+                                      np.where(parent_ids > 0, parent_ids + node_offset, -1)).astype(np.int64)
+
+    # parents inside the dropped overlap frames are not known anymore
+    window_nodes = set(window_df["id"])
+    orphan = (~continued) & (parent_ids > 0) & ~np.isin(parent_ids, list(window_nodes))
+    window_df.loc[orphan, "parent_id"] = -1
+
+    window_df["id"] = window_df["id"] + node_offset
+
+    return window_df
+
+def track_append(video:Array,
+                 config_file:MainConfig,
+                 output_dir:str,
+                 csv_path:str,
+                 overlap:int = OVERLAP,
+                 tolerance:float = 5.0,
+                 max_gap:int = MAX_GAP,
+                 max_distance:float = MAX_DISTANCE) -> DataFrame:
+    """
+    Function that tracks a growing movie. The first run tracks every
+    frame; later runs track the last overlap frames plus the new ones
+    and append the new rows to csv_path.
+    :video: dask.Array | whole segmentation masks video acquired so far
+    :config_file: MainConfig | ultrack configuration
+    :output_dir: str | output folder, holds the append state
+    :csv_path: str | tracking table the new rows are appended to
+    :overlap: int | previous frames tracked again to link the new ones
+    :tolerance: float | greatest centroid distance between matched detections
+    :max_gap: int | greatest number of frames closed between tracklets
+    :max_distance: float | greatest distance between joined tracklets endpoints
+    :return: DataFrame | rows added by this run
+    """
+    state, tail = load_state(output_dir)
+    n_frames = video.shape[0]
+
+    # first run, track everything
+    if state is None:
+        tracks_df = track_segmentation(video, config_file, max_gap=max_gap, max_distance=max_distance)
+        tracks_df.to_csv(csv_path, index=False)
+
+        save_state(output_dir, tracks_df,
+                   {"n_frames"      : n_frames,
+                    "max_track_id"  : int(tracks_df["track_id"].max()),
+                    "max_node_id"   : int(tracks_df["id"].max())},
+                   overlap)
+        return tracks_df
+
+    if n_frames <= state["n_frames"]:
+        print("No new frames to track.")
+        return tail.iloc[:0]
+
+    last_frame = state["n_frames"] - 1
+    window_start = max(state["n_frames"] - overlap, 0)
+    print(f"Tracking frames {window_start}-{n_frames - 1} "
+          f"({n_frames - state['n_frames']} new, {state['n_frames'] - window_start} overlap)")
+
+    # window tracked in its own working directory, the main database is left untouched
+    working_dir = join(output_dir, STATE_DIR, "window")
+    rmtree(working_dir, ignore_errors=True)
+    window_config = isolated_config(config_file, working_dir)
+
+    window_df = track_segmentation(video[window_start:], window_config,
+                                   max_gap=max_gap, max_distance=max_distance)
+    window_df["t"] += window_start
+
+    track_map, node_map = map_to_previous(window_df, tail, last_frame, tolerance)
+    print(f"{len(track_map)} of {tail[tail['t'] == last_frame]['track_id'].nunique()} tracks continued")
+
+    new_rows = relabel_window(window_df[window_df["t"] > last_frame], track_map, node_map, state)
+
+    # continued tracks keep the parent they had in the previous solution
+    previous_parents = tail.groupby("track_id")["parent_track_id"].first()
+    continued = new_rows["track_id"].isin(previous_parents.index)
+    new_rows.loc[continued, "parent_track_id"] = new_rows.loc[continued, "track_id"].map(previous_parents)
+    new_rows = new_rows.reindex(columns=tail.columns)
+
+    new_rows.to_csv(csv_path, mode="a", header=False, index=False)
+
+    save_state(output_dir, concat([tail, new_rows], ignore_index=True),
+               {"n_frames"      : n_frames,
+                "max_track_id"  : int(max(state["max_track_id"], new_rows["track_id"].max())),
+                "max_node_id"   : int(max(state["max_node_id"], new_rows["id"].max()))},
+               overlap)
+
+    return new_rows
+
+# End of current module
@@ -0,0 +1,220 @@
+"""
+Module that benchmarks close_gaps against ultrack's close_tracks_gaps
+on a synthetic table of broken random-walk tracks, checking both close
+the same gaps
+"""
+####################################
+from argparse import ArgumentParser
+
+from time import perf_counter
+
+from pandas import DataFrame
+
+import numpy as np
+
+from ultrack_modules.tracking.close_gaps import close_gaps
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Module that benchmarks gap closing on a synthetic tracking table"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-n", "--n_rows",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=1_000_000,
+                        dest="n_rows",
+                        help="Approximate number of rows of the synthetic table")
+
+    parser.add_argument("--max_gap",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=50,
+                        dest="max_gap",
+                        help="Greatest number of frames between joined tracklets")
+
+    parser.add_argument("--max_distance",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=50.0,
+                        dest="max_distance",
+                        help="Greatest distance between joined tracklets endpoints")
+
+    parser.add_argument("--field_size",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=1000.0,
+                        dest="field_size",
+                        help="Side of the field in pixels, ~500 cells per frame at the default 1M rows")
+
+    parser.add_argument("--skip_ultrack",
+                        action="store_true",
+                        required=False,
+                        dest="skip_ultrack",
+                        help="Only time close_gaps")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining helper functions
+
+def make_broken_tracks(n_rows:int,
+                       track_length:int = 100,
+                       n_frames:int = 2000,
+                       gap:int = 5,
+                       field_size:float = 1000.0,
+                       seed:int = 0) -> DataFrame:
+    """
+    Function that creates random-walk tracks, each one split in two
+    tracklets by a gap of missing frames
+    :n_rows: int | approximate number of rows
+    :track_length: int | frames of every track, gap included
+    :n_frames: int | frames of the movie
+    :gap: int | missing frames in the middle of every track
+    :field_size: float | side of the field the tracks start in
+    :seed: int | random seed
+    :return: DataFrame | ultrack-like tracking table
+    """
+    rng = np.random.default_rng(seed)
+    n_tracks = max(n_rows // (track_length - gap), 1)
+
+    step = np.tile(np.arange(track_length), n_tracks)
+    t = step + np.repeat(rng.integers(0, n_frames - track_length, n_tracks), track_length)
+
+    walk = rng.normal(0, 1.5, (n_tracks, track_length, 2)).cumsum(axis=1).reshape(-1, 2)
+    origin = np.repeat(rng.uniform(0, field_size, (n_tracks, 2)), track_length, axis=0)
+    y, x = (origin + walk).T
+
+    # second half of every track gets its own id, middle frames are dropped
+    track_id = np.repeat(np.arange(1, n_tracks + 1), track_length)
+    half = track_length // 2
+    track_id = np.where(step >= half, track_id + n_tracks, track_id)
+    keep = (step < half - gap) | (step >= half)
+
+    ids = np.arange(1, len(t) + 1)
+    parent_id = np.where(step == 0, -1, ids - 1)
+
+    tracks_df = DataFrame({"track_id"           : track_id[keep],
+                           "t"                  : t[keep],
+                           "y"                  : y[keep],
+                           "x"                  : x[keep],
+                           "id"                 : ids[keep],
+                           "parent_track_id"    : -1,
+                           "parent_id"          : parent_id[keep]})
+
+    # first node after the gap has no parent node
+    tracks_df.loc[tracks_df["t"].diff().fillna(1).to_numpy() > 1, "parent_id"] = -1
+
+    return tracks_df
+
+def joined_starts(tracks_df:DataFrame, result:DataFrame) -> set:
+    """
+    Function that finds the tracklet starts joined to an earlier track,
+    as the start nodes whose track id changed
+    :tracks_df: DataFrame | tracks before gap closing
+    :result: DataFrame | tracks after gap closing
+    :return: set | node ids of the joined starts
+    """
+    starts = tracks_df.loc[tracks_df.groupby("track_id")["t"].idxmin()]
+    starts = starts[starts["parent_track_id"] <= 0]
+
+    # interpolated nodes may copy a node id, the (id, t) pair is unique
+    merged = starts.merge(result, on=["id", "t"], suffixes=("", "_closed"))
+
+    return set(merged.loc[merged["track_id"] != merged["track_id_closed"], "id"].tolist())
+
+def node_rows(result:DataFrame, spatial_columns:list = ("x", "y")) -> np.ndarray:
+    """
+    Function that lists the (t, coordinates) of every node, interpolated
+    ones included, in a comparable order
+    :result: DataFrame | tracks after gap closing
+    :spatial_columns: list | coordinates columns
+    :return: np.ndarray | sorted rows
+    """
+    rows = np.round(result[["t", *spatial_columns]].to_numpy(dtype=np.float64), 4)
+    return rows[np.lexsort(rows.T[::-1])]
+
+def check_same_gaps(tracks_df:DataFrame, result:DataFrame, reference:DataFrame) -> None:
+    """
+    Function that checks close_gaps joined the same tracklets and created
+    the same nodes as close_tracks_gaps (track ids may differ along chains
+    of joins, ultrack only relabels them within one gap size)
+    :tracks_df: DataFrame | tracks before gap closing
+    :result: DataFrame | close_gaps output
+    :reference: DataFrame | close_tracks_gaps output
+    :return: None
+    """
+    result_joins, reference_joins = joined_starts(tracks_df, result), joined_starts(tracks_df, reference)
+    assert result_joins == reference_joins, \
+        f"{len(result_joins ^ reference_joins)} joins differ from close_tracks_gaps"
+
+    assert np.array_equal(node_rows(result), node_rows(reference)), \
+        f"rows differ from close_tracks_gaps ({len(result)} and {len(reference)} rows)"
+
+def time_function(function, *args, **kwargs) -> tuple:
+    """
+    Function that times a single call
+    :function: callable | function to be timed
+    :return: tuple | (result, seconds)
+    """
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return result, perf_counter() - start
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    max_gap, max_distance = args_dict["max_gap"], args_dict["max_distance"]
+
+    tracks_df = make_broken_tracks(args_dict["n_rows"], field_size=args_dict["field_size"])
+    n_tracklets = tracks_df["track_id"].nunique()
+    per_frame = tracks_df.groupby("t").size().mean()
+    print(f"{len(tracks_df)} rows, {n_tracklets} tracklets, {per_frame:.0f} cells per frame")
+
+    result, seconds = time_function(close_gaps, tracks_df.copy(), max_gap, max_distance)
+    print(f"close_gaps:        {seconds:8.2f}s, {len(joined_starts(tracks_df, result))} joined")
+
+    if not args_dict["skip_ultrack"]:
+        # imported here so --skip_ultrack runs without ultrack installed
+        from ultrack.tracks import close_tracks_gaps
+
+        reference, seconds = time_function(close_tracks_gaps, tracks_df.copy(), max_gap, max_distance,
+                                           spatial_columns=["x", "y"])
+        print(f"close_tracks_gaps: {seconds:8.2f}s, {len(joined_starts(tracks_df, reference))} joined")
+
+        check_same_gaps(tracks_df, result, reference)
+        print("Same joins and rows as close_tracks_gaps")
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
@@ -0,0 +1,349 @@
+"""
+Module that closes gaps between tracklets, joining the end of a track
+without children to the start of a later track without parent, as a
+faster replacement of ultrack's close_tracks_gaps for large tables
+"""
+####################################
+from argparse import ArgumentParser
+
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+from scipy.optimize import linear_sum_assignment
+
+from pandas import DataFrame, concat
+
+import numpy as np
+
+from ultrack_modules.misc.track_store import read_tracks, write_tracks
+
+####################################
+# Define global variables
+
+# default limits, same values the tracking scripts used to hardcode
+MAX_GAP : int           = 50
+MAX_DISTANCE : float    = 50.0
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Module that closes gaps between tracklets of a tracking table"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-i", "--input",
+                        action="store",
+                        required=True,
+                        dest="input",
+                        help="Tracking table (.csv or .parquet)")
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        required=True,
+                        dest="output",
+                        help="Path to save the table with closed gaps (.csv or .parquet)")
+
+    parser.add_argument("--max_gap",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=MAX_GAP,
+                        dest="max_gap",
+                        help="Greatest number of missing frames between joined tracklets")
+
+    parser.add_argument("--max_distance",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=MAX_DISTANCE,
+                        dest="max_distance",
+                        help="Distance between joined tracklets endpoints must be smaller")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining helper functions
+
+def track_boundaries(track_ids:np.ndarray) -> tuple:
+    """
+    Function that finds the first and last row of every track
+    :track_ids: np.ndarray | track ids sorted by track
+    :return: tuple | (first_rows, last_rows) indices
+    """
+    change = np.flatnonzero(track_ids[1:] != track_ids[:-1]) + 1
+    first_rows = np.concatenate([[0], change])
+    last_rows = np.concatenate([change - 1, [len(track_ids) - 1]])
+    return first_rows, last_rows
+
+def find_candidates(end_t:np.ndarray,
+                    end_xy:np.ndarray,
+                    start_t:np.ndarray,
+                    start_xy:np.ndarray,
+                    max_gap:int,
+                    max_distance:float) -> tuple:
+    """
+    Function that finds every (end, start) pair with 1 to max_gap missing
+    frames between them (start_t - end_t - 1, as ultrack's gap) closer
+    than max_distance, querying one KD-tree per start frame built on the
+    ends of the preceding frame window
+    :end_t: np.ndarray | last frame of the ends, sorted
+    :end_xy: np.ndarray | last position of the ends
+    :start_t: np.ndarray | first frame of the starts
+    :start_xy: np.ndarray | first position of the starts
+    :max_gap: int | greatest number of missing frames between end and start
+    :max_distance: float | distance between end and start must be smaller
+    :return: tuple | (end_indices, start_indices) of the pairs
+    """
+    ends, starts = [], []
+
+    start_order = np.argsort(start_t, kind="stable")
+    frames, frame_first = np.unique(start_t[start_order], return_index=True)
+    frame_last = np.append(frame_first[1:], len(start_order))
+
+    for frame, first, last in zip(frames, frame_first, frame_last):
+        # ends in [frame - max_gap - 1, frame - 2]
+        lo = np.searchsorted(end_t, frame - max_gap - 1, side="left")
+        hi = np.searchsorted(end_t, frame - 1, side="left")
+        if lo == hi:
+            continue
+
+        frame_starts = start_order[first:last]
+        pairs = cKDTree(end_xy[lo:hi]).sparse_distance_matrix(cKDTree(start_xy[frame_starts]),
+                                                              max_distance, output_type="ndarray")
+        pairs = pairs[pairs["v"] < max_distance]
+
+        ends.append(pairs["i"] + lo)
+        starts.append(frame_starts[pairs["j"]])
+
+    if not ends:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    return np.concatenate(ends), np.concatenate(starts)
+
+def match_gaps(end_t:np.ndarray,
+               end_xy:np.ndarray,
+               start_t:np.ndarray,
+               start_xy:np.ndarray,
+               max_gap:int,
+               max_distance:float) -> tuple:
+    """
+    Function that joins ends to starts as ultrack's close_tracks_gaps:
+    gap by gap from 1 to max_gap, the open ends of every frame are matched
+    to the open starts gap + 1 frames later by a linear assignment of
+    their distances, keeping the pairs closer than max_distance. Only the
+    frame pairs with a candidate are solved.
+    :end_t: np.ndarray | last frame of the ends, sorted
+    :end_xy: np.ndarray | last position of the ends
+    :start_t: np.ndarray | first frame of the starts
+    :start_xy: np.ndarray | first position of the starts
+    :max_gap: int | greatest number of missing frames between end and start
+    :max_distance: float | distance between end and start must be smaller
+    :return: tuple | (end_indices, start_indices) of joined pairs
+    """
+    end_idx, start_idx = find_candidates(end_t, end_xy, start_t, start_xy, max_gap, max_distance)
+    if len(end_idx) == 0:
+        return end_idx, start_idx
+
+    # ends and starts of every frame, in table (track) order
+    start_order = np.argsort(start_t, kind="stable")
+    end_frames, end_first = np.unique(end_t, return_index=True)
+    start_frames, start_first = np.unique(start_t[start_order], return_index=True)
+    end_last = np.append(end_first[1:], len(end_t))
+    start_last = np.append(start_first[1:], len(start_order))
+
+    end_open = np.ones(len(end_t), dtype=bool)
+    start_open = np.ones(len(start_t), dtype=bool)
+
+    gaps = start_t[start_idx] - end_t[end_idx] - 1
+    joined_ends, joined_starts = [], []
+
+    for gap in range(1, max_gap + 1):
+        # frame pairs of one gap share no end or start, so they are independent
+        pairs = (gaps == gap) & end_open[end_idx] & start_open[start_idx]
+
+        for frame in np.unique(end_t[end_idx[pairs]]):
+            e = np.searchsorted(end_frames, frame)
+            s = np.searchsorted(start_frames, frame + gap + 1)
+
+            rows = np.arange(end_first[e], end_last[e])
+            cols = start_order[start_first[s]:start_last[s]]
+            rows, cols = rows[end_open[rows]], cols[start_open[cols]]
+
+            distances = cdist(end_xy[rows], start_xy[cols])
+            row_sol, col_sol = linear_sum_assignment(distances)
+            valid = distances[row_sol, col_sol] < max_distance
+            row_sol, col_sol = rows[row_sol[valid]], cols[col_sol[valid]]
+
+            end_open[row_sol] = False
+            start_open[col_sol] = False
+            joined_ends.append(row_sol)
+            joined_starts.append(col_sol)
+
+    if not joined_ends:
+        return end_idx[:0], start_idx[:0]
+
+    return np.concatenate(joined_ends), np.concatenate(joined_starts)
+
+def interpolate_gaps(tracks_df:DataFrame,
+                     end_rows:np.ndarray,
+                     start_rows:np.ndarray,
+                     spatial_columns:list) -> DataFrame:
+    """
+    Function that creates a node for every missing frame of the closed
+    gaps, copying the end node with linearly interpolated coordinates as
+    ultrack does. New nodes get ids above the table ones and chain the
+    parent_id from the end node to the start node.
+    :tracks_df: DataFrame | tracks with the joined track ids
+    :end_rows: np.ndarray | end row of every joined pair
+    :start_rows: np.ndarray | start row of every joined pair
+    :spatial_columns: list | coordinates columns
+    :return: DataFrame | tracks with the new nodes
+    """
+    t = tracks_df["t"].to_numpy()
+    missing = t[start_rows] - t[end_rows] - 1
+
+    pair = np.repeat(np.arange(len(end_rows)), missing)
+    step = np.arange(len(pair)) - np.repeat(np.cumsum(missing) - missing, missing) + 1
+
+    new_nodes = tracks_df.iloc[end_rows[pair]].reset_index(drop=True)
+    new_nodes["t"] = t[end_rows[pair]] + step
+
+    weight = (step / (missing[pair] + 1))[:, None]
+    end_xy = tracks_df[spatial_columns].to_numpy()[end_rows[pair]]
+    start_xy = tracks_df[spatial_columns].to_numpy()[start_rows[pair]]
+    new_nodes[spatial_columns] = end_xy + (start_xy - end_xy) * weight
+
+    # ids above the table, every node points to the one before it
+    ids = tracks_df["id"].to_numpy()
+    new_ids = int(ids.max()) + 1 + np.arange(len(pair))
+    new_nodes["id"] = new_ids
+    new_nodes["parent_id"] = np.where(step == 1, ids[end_rows[pair]], new_ids - 1)
+
+    last_nodes = np.cumsum(missing) - 1
+    parent_ids = tracks_df["parent_id"].to_numpy().copy()
+    parent_ids[start_rows] = new_ids[last_nodes]
+    tracks_df["parent_id"] = parent_ids
+
+    return concat([tracks_df, new_nodes], ignore_index=True)
+
+def close_gaps(tracks_df:DataFrame,
+               max_gap:int = MAX_GAP,
+               max_distance:float = MAX_DISTANCE,
+               spatial_columns:list = ("x", "y")) -> DataFrame:
+    """
+    Function that joins tracklets separated by 1 to max_gap missing
+    frames, as ultrack's close_tracks_gaps. Only ends of tracks without
+    children and starts of tracks without parent are joined; the joined
+    track keeps the earlier track id and gets a linearly interpolated
+    node in every missing frame (see interpolate_gaps).
+    :tracks_df: DataFrame | tracks with track_id, t, parent_track_id, id, parent_id
+    :max_gap: int | greatest number of missing frames between end and start
+    :max_distance: float | distance between end and start must be smaller
+    :spatial_columns: list | coordinates columns
+    :return: DataFrame | tracks sorted by track_id and t
+    """
+    spatial_columns = list(spatial_columns)
+    track_ids = tracks_df["track_id"].to_numpy()
+    t = tracks_df["t"].to_numpy()
+
+    # NumPy arrays sorted by track, then frame
+    order = np.lexsort((t, track_ids))
+    tracks_df = tracks_df.iloc[order].reset_index(drop=True)
+
+    if max_gap <= 0 or tracks_df.empty:
+        return tracks_df
+
+    track_ids, t = track_ids[order], t[order]
+    coords = tracks_df[spatial_columns].to_numpy(dtype=np.float64)
+    parent_track_ids = tracks_df["parent_track_id"].to_numpy()
+
+    first_rows, last_rows = track_boundaries(track_ids)
+    tracks = track_ids[first_rows]
+
+    # ends: tracks without children, starts: tracks without parent
+    has_children = np.isin(tracks, parent_track_ids)
+    has_parent = parent_track_ids[first_rows] > 0
+
+    end_rows = last_rows[~has_children]
+    end_rows = end_rows[np.argsort(t[end_rows], kind="stable")]
+    start_rows = first_rows[~has_parent]
+
+    end_idx, start_idx = match_gaps(t[end_rows], coords[end_rows],
+                                    t[start_rows], coords[start_rows],
+                                    max_gap, max_distance)
+
+    if len(end_idx) == 0:
+        return tracks_df
+
+    # start track -> end track, resolving chains A <- B <- C to A
+    joined_end_rows, joined_start_rows = end_rows[end_idx], start_rows[start_idx]
+    mapping = dict(zip(track_ids[joined_start_rows], track_ids[joined_end_rows]))
+    for start_track in mapping:
+        target = mapping[start_track]
+        while target in mapping:
+            target = mapping[target]
+        mapping[start_track] = target
+
+    lookup = np.arange(int(track_ids.max()) + 1)
+    lookup[list(mapping)] = list(mapping.values())
+
+    new_track_ids = lookup[track_ids]
+    new_parent_track_ids = np.where(parent_track_ids > 0,
+                                    lookup[np.clip(parent_track_ids, 0, None)],
+                                    parent_track_ids)
+
+    # joined rows inherit the parent of the earlier track
+    joined = new_track_ids != track_ids
+    first_parent = dict(zip(track_ids[first_rows], new_parent_track_ids[first_rows]))
+    new_parent_track_ids[joined] = [first_parent[track] for track in new_track_ids[joined]]
+
+    tracks_df["track_id"] = new_track_ids
+    tracks_df["parent_track_id"] = new_parent_track_ids
+
+    tracks_df = interpolate_gaps(tracks_df, joined_end_rows, joined_start_rows, spatial_columns)
+
+    # keep frames sorted inside the joined tracks
+    order = np.lexsort((tracks_df["t"].to_numpy(), tracks_df["track_id"].to_numpy()))
+
+    return tracks_df.iloc[order].reset_index(drop=True)
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    tracks_df = read_tracks(args_dict["input"])
+
+    n_tracks = tracks_df["track_id"].nunique()
+    tracks_df = close_gaps(tracks_df, args_dict["max_gap"], args_dict["max_distance"])
+    print(f"Joined {n_tracks - tracks_df['track_id'].nunique()} tracklets")
+
+    write_tracks(tracks_df, args_dict["output"])
+
+    print("Done!")
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
@@ -0,0 +1,207 @@
+"""
+Module that caches the labels_to_contours detection and edges maps on
+disk, so re-tracking the same segmentation with another config skips
+straight to node extraction
+"""
+####################################
+from argparse import ArgumentParser
+
+from hashlib import blake2b
+from os import environ, getpid, listdir, makedirs, rename, utime, walk
+from os.path import exists, expanduser, getsize, getmtime, isdir, join
+from shutil import rmtree
+
+from ultrack.utils import labels_to_contours
+
+from dask.array.image import imread
+from dask.array.core import Array
+
+import numpy as np
+import zarr
+
+####################################
+# Define global variables
+
+CACHE_DIR : str         = environ.get("LABSINAL_CONTOURS_CACHE",
+                                      join(expanduser("~"), ".cache", "labsinal", "contours"))
+MAX_CACHE_BYTES : float = 50e9
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Module that fills or evicts the labels_to_contours cache"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-i", "--input",
+                        action="store",
+                        required=False,
+                        default=None,
+                        dest="input",
+                        help="Input folder with segmentation masks to be cached")
+
+    parser.add_argument("--sigma",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=4.5,
+                        dest="sigma",
+                        help="labels_to_contours sigma")
+
+    parser.add_argument("--cache_dir",
+                        action="store",
+                        required=False,
+                        default=CACHE_DIR,
+                        dest="cache_dir",
+                        help="Folder holding the cache entries")
+
+    parser.add_argument("--cache_size",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=MAX_CACHE_BYTES / 1e9,
+                        dest="cache_size",
+                        help="Maximum total cache size in GB")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining helper functions
+
+def labels_hash(labels:Array, sigma:float) -> str:
+    """
+    Function that hashes the labels content together with sigma,
+    reading one frame at a time
+    :labels: dask.Array | segmentation masks video
+    :sigma: float | labels_to_contours sigma
+    :return: str | hex digest used as cache key
+    """
+    digest = blake2b(digest_size=16)
+    digest.update(repr((tuple(labels.shape), str(labels.dtype), float(sigma))).encode())
+
+    for t in range(labels.shape[0]):
+        digest.update(np.ascontiguousarray(np.asarray(labels[t])).data)
+
+    return digest.hexdigest()
+
+def entry_size(entry_path:str) -> int:
+    """
+    Function that computes the size of a cache entry on disk
+    :entry_path: str | cache entry folder
+    :return: int | size in bytes
+    """
+    return sum(getsize(join(root, name)) for root, _, files in walk(entry_path) for name in files)
+
+def evict_cache(cache_dir:str, max_bytes:float, keep:str = None) -> None:
+    """
+    Function that removes the least recently used entries until
+    the cache fits max_bytes
+    :cache_dir: str | folder holding the cache entries
+    :max_bytes: float | maximum total cache size (bytes)
+    :keep: str | cache key never evicted (the entry in use)
+    """
+    if not isdir(cache_dir):
+        return
+
+    entries = [join(cache_dir, name) for name in listdir(cache_dir)
+               if isdir(join(cache_dir, name)) and not name.endswith(".tmp")]
+
+    # oldest first, entries are touched on every hit
+    entries.sort(key=getmtime)
+    sizes = {entry : entry_size(entry) for entry in entries}
+    total = sum(sizes.values())
+
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        if keep is not None and entry == join(cache_dir, keep):
+            continue
+        rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+
+def cached_labels_to_contours(labels:Array,
+                              sigma:float = 4.5,
+                              cache_dir:str = CACHE_DIR,
+                              max_bytes:float = MAX_CACHE_BYTES) -> tuple:
+    """
+    Function that returns labels_to_contours detection and edges,
+    computing them only when no cache entry exists for the labels and sigma
+    :labels: dask.Array | segmentation masks video
+    :sigma: float | labels_to_contours sigma
+    :cache_dir: str | folder holding the cache entries
+    :max_bytes: float | maximum total cache size (bytes)
+    :return: tuple | (detection, edges) zarr arrays
+    """
+    key = labels_hash(labels, sigma)
+    entry = join(cache_dir, key)
+
+    if exists(join(entry, "edges.zarr")):
+        print(f"Using cached contours {key}...")
+        utime(entry)
+    else:
+        # build in a private folder and publish it with an atomic rename
+        tmp_entry = f"{entry}.{getpid()}.tmp"
+        rmtree(tmp_entry, ignore_errors=True)
+        makedirs(tmp_entry)
+
+        labels_to_contours(labels, sigma=sigma,
+                           foreground_store_or_path=join(tmp_entry, "detection.zarr"),
+                           contours_store_or_path=join(tmp_entry, "edges.zarr"))
+
+        if exists(entry):  # another process published it first
+            rmtree(tmp_entry, ignore_errors=True)
+        else:
+            rename(tmp_entry, entry)
+
+    evict_cache(cache_dir, max_bytes, keep=key)
+
+    detection = zarr.open(join(entry, "detection.zarr"), mode="r")
+    edges = zarr.open(join(entry, "edges.zarr"), mode="r")
+
+    return detection, edges
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    # Assign cli arguments to variables
+    input_folder    = args_dict["input"]
+    sigma           = args_dict["sigma"]
+    cache_dir       = args_dict["cache_dir"]
+    max_bytes       = args_dict["cache_size"] * 1e9
+
+    # without input, only evict
+    if input_folder is None:
+        evict_cache(cache_dir, max_bytes)
+    else:
+        cached_labels_to_contours(imread(input_folder + "/*"), sigma=sigma,
+                                  cache_dir=cache_dir, max_bytes=max_bytes)
+
+    print("Done!")
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
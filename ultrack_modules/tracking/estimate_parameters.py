@@ -0,0 +1,253 @@
+"""
+Module that estimates tracking parameters (min_area, max_area,
+max_distance) from a sample of frames of a segmentation movie,
+saving a histogram figure and a config with the suggested values
+"""
+####################################
+from argparse import ArgumentParser
+
+from os import makedirs
+from os.path import join
+
+from scipy.spatial import cKDTree
+from matplotlib.figure import Figure
+
+from dask.array.image import imread
+from dask.array.core import Array
+
+import numpy as np
+import toml
+
+####################################
+# Define global variables
+
+SAMPLE_FRAMES : int     = 20
+FIGURE_FILE : str       = "parameters_histogram.png"
+CONFIG_FILE : str       = "suggested_config.toml"
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Module that estimates tracking parameters from a sample of segmentation frames"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-i", "--input",
+                        action="store",
+                        required=True,
+                        dest="input",
+                        help="Input folder with segmentation masks")
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        required=True,
+                        dest="output",
+                        help="Output folder for the histogram and the suggested config")
+
+    parser.add_argument("-c", "--config",
+                        action="store",
+                        required=True,
+                        dest="config_file",
+                        help="Config (.toml) the suggested values are written over")
+
+    parser.add_argument("-k", "--sample_frames",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=SAMPLE_FRAMES,
+                        dest="sample_frames",
+                        help="Number of frames sampled")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining helper functions
+
+def sample_frame_indices(n_frames:int, n_samples:int) -> np.ndarray:
+    """
+    Function that picks evenly spaced frames, each one with a next frame
+    :n_frames: int | number of frames of the movie
+    :n_samples: int | number of frames to sample
+    :return: np.ndarray | sampled frame indices
+    """
+    last = max(n_frames - 2, 0)
+    return np.unique(np.linspace(0, last, min(n_samples, last + 1)).round().astype(int))
+
+def frame_centroids(frame:np.ndarray) -> tuple:
+    """
+    Function that computes area and centroid of every label of a frame
+    :frame: np.ndarray | 2D labels image
+    :return: tuple | (areas, (N, 2) centroids) of the present labels
+    """
+    flat = frame.ravel().astype(np.intp, copy=False)
+    rows, cols = np.divmod(np.arange(flat.size), frame.shape[1])
+
+    areas = np.bincount(flat)
+    sum_r = np.bincount(flat, weights=rows, minlength=len(areas))
+    sum_c = np.bincount(flat, weights=cols, minlength=len(areas))
+
+    present = np.flatnonzero(areas)
+    present = present[present > 0]
+
+    centroids = np.column_stack([sum_r[present], sum_c[present]]) / areas[present, None]
+
+    return areas[present], centroids
+
+def sample_statistics(video:Array, n_samples:int = SAMPLE_FRAMES) -> dict:
+    """
+    Function that gathers areas, nearest neighbour distances inside a
+    frame and displacements to the next frame over sampled frames
+    :video: dask.Array | segmentation masks video
+    :n_samples: int | number of frames to sample
+    :return: dict | arrays of areas, neighbour distances and displacements
+    """
+    areas, neighbours, displacements = [], [], []
+
+    for t in sample_frame_indices(video.shape[0], n_samples):
+        frame_areas, centroids = frame_centroids(np.asarray(video[t]))
+        areas.append(frame_areas)
+
+        if len(centroids) > 1:
+            distances, _ = cKDTree(centroids).query(centroids, k=2)
+            neighbours.append(distances[:, 1])
+
+        if t + 1 < video.shape[0] and len(centroids):
+            _, next_centroids = frame_centroids(np.asarray(video[t + 1]))
+            if len(next_centroids):
+                distances, _ = cKDTree(next_centroids).query(centroids)
+                displacements.append(distances)
+
+    def join_arrays(arrays):
+        return np.concatenate(arrays) if arrays else np.empty(0)
+
+    return {"areas"         : join_arrays(areas),
+            "neighbours"    : join_arrays(neighbours),
+            "displacements" : join_arrays(displacements)}
+
+def suggest_parameters(statistics:dict) -> dict:
+    """
+    Function that suggests config values from the sampled statistics
+    :statistics: dict | output of sample_statistics
+    :return: dict | min_area, max_area and max_distance
+    """
+    areas = statistics["areas"]
+    displacements = statistics["displacements"]
+
+    suggestion = {}
+    if len(areas):
+        suggestion["min_area"] = int(np.floor(0.5 * np.percentile(areas, 1)))
+        suggestion["max_area"] = int(np.ceil(2.0 * np.percentile(areas, 99)))
+    if len(displacements):
+        suggestion["max_distance"] = float(np.ceil(1.5 * np.percentile(displacements, 99)))
+
+    return suggestion
+
+def save_histograms(statistics:dict, suggestion:dict, figure_path:str) -> None:
+    """
+    Function that saves the areas, neighbour distance and displacement
+    histograms, marking the suggested limits (no display needed)
+    :statistics: dict | output of sample_statistics
+    :suggestion: dict | output of suggest_parameters
+    :figure_path: str | path to the .png file
+    """
+    figure = Figure(figsize=(15, 4))
+    axes = figure.subplots(1, 3)
+
+    panels = [("areas", "Area (px)", ["min_area", "max_area"]),
+              ("neighbours", "Nearest neighbour distance (px)", []),
+              ("displacements", "Displacement to next frame (px)", ["max_distance"])]
+
+    for ax, (key, title, limits) in zip(axes, panels):
+        ax.hist(statistics[key], bins=100)
+        for limit in limits:
+            if limit in suggestion:
+                ax.axvline(suggestion[limit], color="red", linestyle="--", label=limit)
+        ax.set_title(title)
+        if limits:
+            ax.legend()
+
+    figure.tight_layout()
+    figure.savefig(figure_path, dpi=100)
+
+def write_suggested_config(config_path:str, suggestion:dict, output_path:str) -> None:
+    """
+    Function that writes a copy of a config with the suggested values
+    :config_path: str | base config (.toml)
+    :suggestion: dict | output of suggest_parameters
+    :output_path: str | path to the suggested config (.toml)
+    """
+    config = toml.load(config_path)
+
+    for key in ("min_area", "max_area"):
+        if key in suggestion:
+            config.setdefault("segmentation", {})[key] = suggestion[key]
+    if "max_distance" in suggestion:
+        config.setdefault("linking", {})["max_distance"] = suggestion["max_distance"]
+
+    with open(output_path, "w") as file:
+        toml.dump(config, file)
+
+def estimate_parameters(video:Array,
+                        config_path:str,
+                        output_dir:str,
+                        n_samples:int = SAMPLE_FRAMES) -> dict:
+    """
+    Function that estimates the parameters and saves the histogram
+    figure and the suggested config into output_dir
+    :video: dask.Array | segmentation masks video
+    :config_path: str | base config (.toml)
+    :output_dir: str | folder for the figure and the config
+    :n_samples: int | number of frames to sample
+    :return: dict | suggested values
+    """
+    makedirs(output_dir, exist_ok=True)
+
+    statistics = sample_statistics(video, n_samples)
+    suggestion = suggest_parameters(statistics)
+
+    save_histograms(statistics, suggestion, join(output_dir, FIGURE_FILE))
+    write_suggested_config(config_path, suggestion, join(output_dir, CONFIG_FILE))
+
+    print(f"Suggested parameters: {suggestion}")
+    print(f"Histograms -> {join(output_dir, FIGURE_FILE)}")
+    print(f"Config -> {join(output_dir, CONFIG_FILE)}")
+
+    return suggestion
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    estimate_parameters(imread(args_dict["input"] + "/*"),
+                        args_dict["config_file"],
+                        args_dict["output"],
+                        n_samples=args_dict["sample_frames"])
+
+    print("Done!")
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
@@ -0,0 +1,251 @@
+"""
+Module that extracts per label features from several intensity
+channels, processing frames in parallel with one bincount per channel
+per frame, and joins them onto a tracks table by (t, label)
+"""
+####################################
+from argparse import ArgumentParser
+
+from multiprocessing import Pool
+
+from dask.array.image import imread
+from pandas import DataFrame, concat
+
+import numpy as np
+
+from ultrack_modules.misc.track_store import read_tracks, write_tracks
+
+####################################
+# Define global variables
+
+PERCENTILES : tuple = (10, 50, 90)
+
+# labels and channels shared with the worker processes
+_WORKER_LABELS = None
+_WORKER_CHANNELS = None
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Module that extracts multi-channel features of labels and joins them to a tracks table"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-l", "--labels",
+                        action="store",
+                        required=True,
+                        dest="labels",
+                        help="Folder with labels masks (label values must match label_column)")
+
+    parser.add_argument("--channel",
+                        action="append",
+                        required=True,
+                        dest="channels",
+                        help="Intensity channel as name=folder, may be repeated")
+
+    parser.add_argument("-t", "--tracks",
+                        action="store",
+                        required=False,
+                        default=None,
+                        dest="tracks",
+                        help="Tracks table (.csv or .parquet) the features are joined to")
+
+    parser.add_argument("--label_column",
+                        action="store",
+                        required=False,
+                        default="track_id",
+                        dest="label_column",
+                        help="Tracks table column holding the label value")
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        required=True,
+                        dest="output",
+                        help="Output table (.csv or .parquet)")
+
+    parser.add_argument("--n_workers",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=None,
+                        dest="n_workers",
+                        help="Number of processes (default: all cores)")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining helper functions
+
+def parse_channels(items:list) -> dict:
+    """
+    Function that parses name=folder items into lazily read channels
+    :items: list | e.g. ["green=registered/green", "red=registered/red"]
+    :return: dict | channel name -> dask.Array
+    """
+    channels = {}
+    for item in items or []:
+        name, folder = item.split("=", 1)
+        channels[name.strip()] = imread(folder.strip() + "/*")
+    return channels
+
+def label_percentiles(labels:np.ndarray, values:np.ndarray, counts:np.ndarray, percentiles:tuple) -> dict:
+    """
+    Function that computes intensity percentiles of every label with a
+    single lexsort, linearly interpolated as numpy.percentile
+    :labels: np.ndarray | label of every foreground pixel
+    :values: np.ndarray | intensity of every foreground pixel
+    :counts: np.ndarray | pixels per label, indexed by label
+    :percentiles: tuple | percentiles to compute
+    :return: dict | percentile -> values indexed by label
+    """
+    order = np.lexsort((values, labels))
+    sorted_values = values[order].astype(np.float64)
+
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    last = np.maximum(counts - 1, 0)
+
+    result = {}
+    for q in percentiles:
+        position = last * (q / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, last)
+        fraction = position - low
+
+        with np.errstate(invalid="ignore"):
+            value = ((1 - fraction) * sorted_values[np.minimum(starts + low, len(sorted_values) - 1)]
+                     + fraction * sorted_values[np.minimum(starts + high, len(sorted_values) - 1)])
+        result[q] = np.where(counts > 0, value, np.nan)
+
+    return result
+
+def frame_features(t:int, labels:np.ndarray, channels:dict, percentiles:tuple = PERCENTILES) -> DataFrame:
+    """
+    Function that computes area, centroid and per channel mean, sum and
+    percentiles for every label of a frame
+    :t: int | frame index
+    :labels: np.ndarray | 2D labels image
+    :channels: dict | channel name -> 2D intensity image
+    :percentiles: tuple | percentiles to compute
+    :return: DataFrame | one row per label
+    """
+    foreground = np.flatnonzero(labels.ravel())
+    flat = labels.ravel()[foreground].astype(np.intp)
+
+    n_labels = int(flat.max()) + 1 if flat.size else 1
+    rows, cols = np.divmod(foreground, labels.shape[1])
+
+    counts = np.bincount(flat, minlength=n_labels)
+    present = np.flatnonzero(counts)
+    safe_counts = np.maximum(counts, 1)
+
+    features = {"t"             : np.full(len(present), t),
+                "label"         : present,
+                "area"          : counts[present],
+                "centroid_y"    : (np.bincount(flat, weights=rows, minlength=n_labels) / safe_counts)[present],
+                "centroid_x"    : (np.bincount(flat, weights=cols, minlength=n_labels) / safe_counts)[present]}
+
+    for name, image in channels.items():
+        values = np.asarray(image).ravel()[foreground]
+        sums = np.bincount(flat, weights=values, minlength=n_labels)
+
+        features[f"{name}_sum"] = sums[present]
+        features[f"{name}_mean"] = (sums / safe_counts)[present]
+
+        if percentiles:
+            for q, value in label_percentiles(flat, values, counts, percentiles).items():
+                features[f"{name}_p{q}"] = value[present]
+
+    return DataFrame(features)
+
+def _init_worker(labels, channels:dict) -> None:
+    """
+    Worker initializer, keeps the lazy arrays so jobs only carry a frame index
+    :labels: labels video (dask, zarr or NumPy)
+    :channels: dict | channel name -> intensity video
+    """
+    global _WORKER_LABELS, _WORKER_CHANNELS
+    _WORKER_LABELS, _WORKER_CHANNELS = labels, channels
+
+def _frame_features_job(job:tuple) -> DataFrame:
+    """
+    Function that reads one frame of every array and computes its features
+    :job: tuple | (t, percentiles)
+    :return: DataFrame | one row per label
+    """
+    t, percentiles = job
+    frames = {name : np.asarray(video[t]) for name, video in _WORKER_CHANNELS.items()}
+    return frame_features(t, np.asarray(_WORKER_LABELS[t]), frames, percentiles)
+
+def extract_features(labels,
+                     channels:dict,
+                     percentiles:tuple = PERCENTILES,
+                     n_workers:int = None) -> DataFrame:
+    """
+    Function that extracts the features of every frame in parallel.
+    Workers read their own frames, so only a few frames are in memory.
+    :labels: labels video (dask, zarr or NumPy)
+    :channels: dict | channel name -> intensity video, registered to labels
+    :percentiles: tuple | percentiles to compute
+    :n_workers: int | number of processes, all cores if None
+    :return: DataFrame | one row per (t, label)
+    """
+    jobs = [(t, percentiles) for t in range(labels.shape[0])]
+
+    with Pool(n_workers, initializer=_init_worker, initargs=(labels, channels)) as pool:
+        frames = list(pool.imap(_frame_features_job, jobs))
+
+    return concat(frames, ignore_index=True) if frames else DataFrame()
+
+def join_features(tracks_df:DataFrame, features_df:DataFrame, label_column:str = "track_id") -> DataFrame:
+    """
+    Function that adds the features to the tracks table by (t, label)
+    :tracks_df: DataFrame | tracks table
+    :features_df: DataFrame | output of extract_features
+    :label_column: str | tracks table column holding the label value
+    :return: DataFrame | tracks table with the features columns
+    """
+    features_df = features_df.rename(columns={"label" : label_column})
+    return tracks_df.merge(features_df, on=["t", label_column], how="left")
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    labels = imread(args_dict["labels"] + "/*")
+    channels = parse_channels(args_dict["channels"])
+
+    features_df = extract_features(labels, channels, n_workers=args_dict["n_workers"])
+
+    if args_dict["tracks"] is not None:
+        features_df = join_features(read_tracks(args_dict["tracks"]), features_df, args_dict["label_column"])
+
+    write_tracks(features_df, args_dict["output"])
+
+    print("Done!")
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
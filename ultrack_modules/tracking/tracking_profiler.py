@@ -0,0 +1,216 @@
+"""
+Module that instruments the tracking stages, recording wall time, CPU
+time, peak RSS and counts of every stage into a JSON run report
+"""
+####################################
+from contextlib import contextmanager
+from json import dump
+from os import getpid, makedirs
+from os.path import join
+from resource import getrusage, RUSAGE_SELF, RUSAGE_CHILDREN
+from threading import Event, Thread
+from time import perf_counter
+from datetime import datetime
+
+from psutil import Process, NoSuchProcess
+
+from ultrack.config.config import MainConfig
+from ultrack.core.database import NodeDB, LinkDB
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session
+
+####################################
+# Define global variables
+
+RUN_REPORT : str        = "run_report.json"
+DUMP_BACKENDS : tuple   = ("cprofile", "pyinstrument")
+
+# how often the memory of the process tree is sampled (seconds)
+RSS_INTERVAL : float    = 0.1
+
+####################################
+# Defining helper functions
+
+def cpu_seconds() -> float:
+    """
+    Function that returns the CPU time used so far by this process
+    and its finished children (ultrack workers)
+    :return: float | user + system seconds
+    """
+    own, children = getrusage(RUSAGE_SELF), getrusage(RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def database_counts(config_file:MainConfig) -> dict:
+    """
+    Function that counts the candidate nodes, links and selected nodes
+    stored in the ultrack database
+    :config_file: MainConfig | ultrack configuration
+    :return: dict | nodes, links and selected_nodes counts
+    """
+    engine = create_engine(config_file.data_config.database_path)
+
+    with Session(engine) as session:
+        return {"nodes"             : session.query(func.count(NodeDB.id)).scalar(),
+                "links"             : session.query(func.count(LinkDB.source_id)).scalar(),
+                "selected_nodes"    : session.query(func.count(NodeDB.id)).filter(NodeDB.selected).scalar()}
+
+def tree_rss(process:Process) -> int:
+    """
+    Function that sums the resident memory of a process and its children
+    :process: psutil.Process | root process
+    :return: int | bytes
+    """
+    total = 0
+    for item in [process, *process.children(recursive=True)]:
+        try:
+            total += item.memory_info().rss
+        except NoSuchProcess:
+            pass
+    return total
+
+class RSSMonitor:
+    """
+    Background thread keeping the peak RSS of the process tree
+    """
+    def __init__(self, interval:float = RSS_INTERVAL):
+        self.interval = interval
+        self.process = Process(getpid())
+        self.peak = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss(self.process))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RSSMonitor":
+        self.peak = tree_rss(self.process)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, tree_rss(self.process))
+
+####################################
+# Defining profiler class
+
+class StageProfiler:
+    """
+    Records one entry per tracking stage. When disabled every stage
+    runs untouched, so callers do not need to branch on it.
+    :enabled: bool | whether to measure the stages
+    :dump_backend: str | "cprofile" or "pyinstrument" to also dump every stage
+    :dump_dir: str | folder for the per stage dumps
+    """
+    def __init__(self, enabled:bool = False, dump_backend:str = None, dump_dir:str = "."):
+        if dump_backend is not None and dump_backend not in DUMP_BACKENDS:
+            raise ValueError(f"Unknown profile dump backend: {dump_backend}. "
+                             f"Choose from: {', '.join(DUMP_BACKENDS)}")
+
+        self.enabled = enabled
+        self.dump_backend = dump_backend if enabled else None
+        self.dump_dir = dump_dir
+        self.stages = []
+        self.started = datetime.now().isoformat(timespec="seconds")
+
+    @contextmanager
+    def stage(self, name:str):
+        """
+        Context manager measuring one stage. It yields a dict where the
+        caller adds counts (rows, nodes, ...) known inside the stage.
+        :name: str | stage name
+        """
+        record = {"stage" : name}
+
+        if not self.enabled:
+            yield record
+            return
+
+        dumper = self._start_dump()
+        wall, cpu = perf_counter(), cpu_seconds()
+
+        with RSSMonitor() as monitor:
+            try:
+                yield record
+            finally:
+                record["wall_seconds"] = round(perf_counter() - wall, 3)
+                record["cpu_seconds"] = round(cpu_seconds() - cpu, 3)
+
+        record["peak_rss_mb"] = round(monitor.peak / 2**20, 1)
+
+        if dumper is not None:
+            record["dump"] = self._stop_dump(dumper, name)
+
+        self.stages.append(record)
+        print(f"[profile] {name}: {record['wall_seconds']}s wall, "
+              f"{record['cpu_seconds']}s CPU, {record['peak_rss_mb']} MB peak")
+
+    def _start_dump(self):
+        """
+        Function that starts the optional per stage profiler
+        :return: profiler object or None
+        """
+        if self.dump_backend == "cprofile":
+            from cProfile import Profile
+            dumper = Profile()
+            dumper.enable()
+            return dumper
+
+        if self.dump_backend == "pyinstrument":
+            from pyinstrument import Profiler
+            dumper = Profiler()
+            dumper.start()
+            return dumper
+
+        return None
+
+    def _stop_dump(self, dumper, name:str) -> str:
+        """
+        Function that stops the per stage profiler and saves its dump
+        :dumper: profiler object
+        :name: str | stage name
+        :return: str | path of the dump
+        """
+        makedirs(self.dump_dir, exist_ok=True)
+
+        if self.dump_backend == "cprofile":
+            dumper.disable()
+            path = join(self.dump_dir, f"{name}.prof")
+            dumper.dump_stats(path)
+        else:
+            dumper.stop()
+            path = join(self.dump_dir, f"{name}.html")
+            with open(path, "w") as file:
+                file.write(dumper.output_html())
+
+        return path
+
+    def report(self, **extra) -> dict:
+        """
+        Function that builds the run report
+        :extra: run level information (inputs, config, ...)
+        :return: dict | run report
+        """
+        return {"started"       : self.started,
+                "finished"      : datetime.now().isoformat(timespec="seconds"),
+                **extra,
+                "total_wall_seconds" : round(sum(item.get("wall_seconds", 0) for item in self.stages), 3),
+                "stages"        : self.stages}
+
+    def save(self, path:str, **extra) -> None:
+        """
+        Function that writes the run report as JSON, if enabled
+        :path: str | path to the .json file
+        :extra: run level information (inputs, config, ...)
+        """
+        if not self.enabled:
+            return
+
+        with open(path, "w") as file:
+            dump(self.report(**extra), file, indent=2, default=str)
+
+# End of current module
@@ -0,0 +1,584 @@
+"""
+Module that tracks a segmentation masks video once and exports the
+solution in any combination of formats (csv, parquet, ctc, trackmate, features)
+"""
+####################################
+print("Importing required libraries...")
+from argparse import ArgumentParser
+
+from copy import deepcopy
+from time import perf_counter
+from pathlib import Path
+from os import makedirs
+from os.path import join, dirname
+from warnings import warn
+
+from ultrack.utils import labels_to_contours
+from ultrack.config.config import MainConfig
+from ultrack import load_config, segment, link, solve, to_tracks_layer
+from ultrack.core.export import to_ctc, to_trackmate, tracks_to_zarr
+
+from ultrack_modules.tracking.contours_cache import cached_labels_to_contours, MAX_CACHE_BYTES
+from ultrack_modules.tracking.windowed_tracking import solve_windowed, check_track_continuity
+from ultrack_modules.tracking.close_gaps import close_gaps, MAX_GAP, MAX_DISTANCE
+from ultrack_modules.tracking.track_features import extract_features, join_features, parse_channels
+from ultrack_modules.tracking.estimate_parameters import estimate_parameters, SAMPLE_FRAMES
+from ultrack_modules.tracking.tracking_profiler import StageProfiler, database_counts, RUN_REPORT, DUMP_BACKENDS
+from ultrack_modules.misc.track_store import write_tracks
+
+from dask.array.image import imread
+from dask.array.core import Array
+from pandas import DataFrame
+
+print("All libraries imported sucessfully!")
+
+####################################
+# Define global variables
+
+DEFAULT_CONFIG : str = join(dirname(dirname(__file__)), "ultrack_config.toml")
+
+# labels_to_contours smoothing
+SIGMA : float = 4.5
+
+# export format -> file (or folder) created inside the output folder
+EXPORT_FORMATS : dict = {"csv"          : "trackings.csv",
+                         "parquet"      : "trackings.parquet",
+                         "ctc"          : ".",
+                         "trackmate"    : "tracks.xml",
+                         "features"     : "features.csv"}
+
+# per window solve report of the windowed mode
+WINDOWS_REPORT : str = "windows.csv"
+
+# track labelled masks written to the working directory by export_features
+TRACK_LABELS : str = "tracks_labels.zarr"
+
+# appear/disappear/division weights found by the bayesian optimization,
+# applied over the config weights by the csv and features entry points
+APPEAR_WEIGHT : float       = -26.984591838275453
+DISAPPEAR_WEIGHT : float    = -13.422214979542472
+DIVISION_WEIGHT : float     = 0
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Module that tracks a segmentation video once and exports it in several formats"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-i", "--input",
+                        action="store",
+                        required=True,
+                        dest="input",
+                        help="Input folder with segmentation masks to be tracked")
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        required=True,
+                        dest="output",
+                        help="Output folder to save the exported tracking")
+
+    parser.add_argument("-c", "--config",
+                        action="store",
+                        required=False,
+                        default=DEFAULT_CONFIG,
+                        dest="config_file",
+                        help="path to a config file")
+
+    parser.add_argument("-e", "--export",
+                        action="store",
+                        required=False,
+                        default="csv",
+                        dest="export",
+                        help=f"Comma separated export formats, any of: {','.join(EXPORT_FORMATS)}")
+
+    parser.add_argument("-im", "--images",
+                        action="store",
+                        required=False,
+                        default=None,
+                        dest="images",
+                        help="Folder containing images related to segmentation (features export)")
+
+    parser.add_argument("--channel",
+                        action="append",
+                        required=False,
+                        default=None,
+                        dest="channels",
+                        help="Extra registered channel as name=folder for the features export, may be repeated")
+
+    parser.add_argument("--areas_graph",
+                        action="store_true",
+                        required=False,
+                        dest="make_graph",
+                        help="Save areas/distances histograms and a suggested config, then exit")
+
+    parser.add_argument("--sample_frames",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=SAMPLE_FRAMES,
+                        dest="sample_frames",
+                        help="Frames sampled by --areas_graph")
+
+    parser.add_argument("--contours_cache",
+                        action="store",
+                        required=False,
+                        default=None,
+                        dest="contours_cache",
+                        help="Folder to cache detection/edges maps, reused when re-tracking the same masks")
+
+    parser.add_argument("--cache_size",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=MAX_CACHE_BYTES / 1e9,
+                        dest="cache_size",
+                        help="Maximum total size of the contours cache in GB")
+
+    parser.add_argument("--memory_budget",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=None,
+                        dest="memory_budget",
+                        help="Solver memory budget in GB, enables windowed tracking sized to fit it")
+
+    parser.add_argument("--max_gap",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=MAX_GAP,
+                        dest="max_gap",
+                        help="Greatest number of missing frames between tracklets joined by gap closing")
+
+    parser.add_argument("--max_distance",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=MAX_DISTANCE,
+                        dest="max_distance",
+                        help="Greatest distance between tracklets endpoints joined by gap closing")
+
+    parser.add_argument("--no_gap_closing",
+                        action="store_true",
+                        required=False,
+                        dest="no_gap_closing",
+                        help="Skip gap closing")
+
+    parser.add_argument("--appear_weight",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=APPEAR_WEIGHT,
+                        dest="appear_weight",
+                        help="Tracking appear_weight, overrides the config")
+
+    parser.add_argument("--disappear_weight",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=DISAPPEAR_WEIGHT,
+                        dest="disappear_weight",
+                        help="Tracking disappear_weight, overrides the config")
+
+    parser.add_argument("--division_weight",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=DIVISION_WEIGHT,
+                        dest="division_weight",
+                        help="Tracking division_weight, overrides the config")
+
+    parser.add_argument("--config_weights",
+                        action="store_true",
+                        required=False,
+                        dest="config_weights",
+                        help="Keep the appear/disappear/division weights of the config file")
+
+    parser.add_argument("--profile",
+                        action="store_true",
+                        required=False,
+                        dest="profile",
+                        help=f"Record time, CPU, peak memory and counts of every stage into {RUN_REPORT}")
+
+    parser.add_argument("--profile_dumps",
+                        action="store",
+                        required=False,
+                        default=None,
+                        choices=DUMP_BACKENDS,
+                        dest="profile_dumps",
+                        help="Also dump a per stage profile (needs --profile)")
+
+    parser.add_argument("--append",
+                        action="store_true",
+                        required=False,
+                        dest="append",
+                        help="Only track the frames added since the last --append run and "
+                             "append their rows to the csv (csv export only)")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining helper functions
+
+def parse_export_formats(export:str) -> list:
+    """
+    Function that parses a comma separated list of export formats
+    :export: str | e.g. "csv,ctc,trackmate"
+    :return: list | validated export formats
+    """
+    formats = [item.strip().lower() for item in export.split(",") if item.strip()]
+
+    unknown = [item for item in formats if item not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown export format(s): {', '.join(unknown)}. "
+                         f"Choose from: {', '.join(EXPORT_FORMATS)}")
+
+    return formats
+
+def apply_tracking_weights(config_file:MainConfig,
+                           appear_weight:float = APPEAR_WEIGHT,
+                           disappear_weight:float = DISAPPEAR_WEIGHT,
+                           division_weight:float = DIVISION_WEIGHT) -> MainConfig:
+    """
+    Function that overrides the appear/disappear/division weights of a config
+    :config_file: MainConfig | ultrack configuration, changed in place
+    :appear_weight: float | cost of a track appearing
+    :disappear_weight: float | cost of a track disappearing
+    :division_weight: float | cost of a division
+    :return: MainConfig | the same configuration
+    """
+    config_file.tracking_config.appear_weight = appear_weight
+    config_file.tracking_config.disappear_weight = disappear_weight
+    config_file.tracking_config.division_weight = division_weight
+
+    return config_file
+
+def isolated_config(config_file:MainConfig, working_dir:str, n_workers:int = None) -> MainConfig:
+    """
+    Function that copies a config giving it a private working directory,
+    and so a private SQLite database, to run several trackings at once
+    :config_file: MainConfig | ultrack configuration
+    :working_dir: str | private working directory, created if missing
+    :n_workers: int | if set, caps the config workers and threads
+    :return: MainConfig | isolated copy of the configuration
+    """
+    makedirs(working_dir, exist_ok=True)
+
+    isolated = deepcopy(config_file)
+    isolated.data_config.working_dir = Path(working_dir)
+
+    if n_workers is not None:
+        isolated.data_config.n_workers = min(isolated.data_config.n_workers, n_workers)
+        isolated.segmentation_config.n_workers = min(isolated.segmentation_config.n_workers, n_workers)
+        isolated.linking_config.n_workers = min(isolated.linking_config.n_workers, n_workers)
+        # n_threads <= 0 means every core
+        n_threads = isolated.tracking_config.n_threads
+        isolated.tracking_config.n_threads = n_workers if n_threads <= 0 else min(n_threads, n_workers)
+
+    return isolated
+
+def plot_areas_graph(video:Array,
+                     config_file:str = DEFAULT_CONFIG,
+                     output_dir:str = ".",
+                     n_samples:int = SAMPLE_FRAMES) -> dict:
+    """
+    Function that estimates area and distance limits from sampled frames,
+    saving their histograms and a suggested config to tune configs
+    :video: dask.Array | segmentation masks video
+    :config_file: str | base config (.toml) of the suggested config
+    :output_dir: str | folder for the histograms and the suggested config
+    :n_samples: int | number of frames to sample
+    :return: dict | suggested min_area, max_area and max_distance
+    """
+    return estimate_parameters(video, config_file, output_dir, n_samples=n_samples)
+
+def track_segmentation(video:Array,
+                       config_file:MainConfig,
+                       contours_cache:str = None,
+                       cache_size:float = MAX_CACHE_BYTES,
+                       memory_budget:float = None,
+                       windows_report:str = None,
+                       max_gap:int = MAX_GAP,
+                       max_distance:float = MAX_DISTANCE,
+                       profiler:StageProfiler = None) -> DataFrame:
+    """
+    Function that tracks a segmentation masks video.
+    The solution stays in the config database, so every
+    export can be made from it without tracking again.
+    :video: dask.Array | Array contaning the video data
+    :config_file: MainConfig | ultrack configuration
+    :contours_cache: str | folder caching detection/edges, None disables it
+    :cache_size: float | maximum total size of the cache (bytes)
+    :memory_budget: float | solver memory budget (bytes), solves in windows when set
+    :windows_report: str | path to save the per window report (windowed mode)
+    :max_gap: int | greatest number of frames closed between tracklets, 0 disables gap closing
+    :max_distance: float | greatest distance between joined tracklets endpoints
+    :profiler: StageProfiler | records every stage, disabled when None
+    :return: pandas.DataFrame | tracks_df with tracking data
+    """
+    profiler = profiler or StageProfiler(enabled=False)
+
+    # Create detection and edges, they only depend on the labels and sigma
+    with profiler.stage("labels_to_contours") as record:
+        if contours_cache is not None:
+            detection, edges = cached_labels_to_contours(video, sigma=SIGMA,
+                                                         cache_dir=contours_cache,
+                                                         max_bytes=cache_size)
+        else:
+            detection, edges = labels_to_contours(video, sigma=SIGMA)
+        record["frames"] = video.shape[0]
+
+    # the same stages as ultrack's track, so each one can be measured
+    with profiler.stage("segment") as record:
+        segment(detection, edges, config_file, overwrite=True)
+        if profiler.enabled:
+            record["nodes"] = database_counts(config_file)["nodes"]
+
+    with profiler.stage("link") as record:
+        link(config_file, overwrite=True)
+        if profiler.enabled:
+            record["links"] = database_counts(config_file)["links"]
+
+    with profiler.stage("solve") as record:
+        tracking_config = config_file.tracking_config
+        if memory_budget is None:
+            start = perf_counter()
+            solve(config_file, overwrite=True)
+            # ultrack does not return the final MIP gap, report the target
+            # and whether the solver used the whole time limit
+            record["hit_time_limit"] = 0 < tracking_config.time_limit <= perf_counter() - start
+        else:
+            report = solve_windowed(config_file, video.shape[0], memory_budget)
+            if windows_report is not None:
+                report.to_csv(windows_report, index=False)
+            record["windows"] = len(report)
+            record["hit_time_limit"] = bool(report["hit_time_limit"].any())
+        record["solution_gap"] = tracking_config.solution_gap
+        if profiler.enabled:
+            record["selected_nodes"] = database_counts(config_file)["selected_nodes"]
+
+    # create tracks df
+    with profiler.stage("to_tracks_layer") as record:
+        tracks_df, _ = to_tracks_layer(config_file)
+        record["rows"] = len(tracks_df)
+
+    # check the windows were stitched, warns about tracks broken at the seams
+    if memory_budget is not None:
+        with profiler.stage("check_continuity") as record:
+            record.update(check_track_continuity(tracks_df, config_file.tracking_config.window_size,
+                                                 config_file.linking_config.max_distance))
+
+    # close tracks gaps
+    with profiler.stage("close_gaps") as record:
+        tracks_df = close_gaps(tracks_df, max_gap, max_distance, spatial_columns=["x", "y"])
+        record["rows"] = len(tracks_df)
+        record["tracks"] = int(tracks_df["track_id"].nunique())
+
+    # return tracks_df
+    return tracks_df
+
+def export_csv(tracks_df:DataFrame, output_path:str) -> None:
+    """
+    Function that exports the tracks table as csv
+    :tracks_df: DataFrame | tracking data
+    :output_path: str | path to the .csv file
+    """
+    tracks_df.to_csv(output_path, index=False)
+
+def export_parquet(tracks_df:DataFrame, output_path:str) -> None:
+    """
+    Function that exports the tracks table as Parquet (see track_store)
+    :tracks_df: DataFrame | tracking data
+    :output_path: str | path to the .parquet file
+    """
+    write_tracks(tracks_df, output_path)
+
+def export_ctc(config_file:MainConfig, output_dir:str) -> None:
+    """
+    Function that exports the solution in Cell Tracking Challenge format
+    :config_file: MainConfig | ultrack configuration holding the solution
+    :output_dir: str | folder to save the CTC files
+    """
+    to_ctc(Path(output_dir), config_file)
+
+def export_trackmate(config_file:MainConfig, output_path:str) -> None:
+    """
+    Function that exports the solution as TrackMate xml
+    :config_file: MainConfig | ultrack configuration holding the solution
+    :output_path: str | path to the .xml file
+    """
+    to_trackmate(config_file, Path(output_path))
+
+def export_features(tracks_df:DataFrame,
+                    config_file:MainConfig,
+                    channels:dict,
+                    n_workers:int = None) -> DataFrame:
+    """
+    Function that adds area, centroid and per channel intensity features
+    to the tracks table. Features are measured on the track labelled
+    masks of the solution, so they join by (t, track_id). Rows without a
+    node in the solution (frames interpolated by close_gaps) have no mask.
+    :tracks_df: DataFrame | tracking data
+    :config_file: MainConfig | ultrack configuration holding the solution
+    :channels: dict | channel name -> intensity video registered to the labels
+    :n_workers: int | number of processes, all cores if None
+    :return: DataFrame | tracks_df with features columns
+    """
+    tracks_path = join(str(config_file.data_config.working_dir), TRACK_LABELS)
+    # tracks_to_zarr looks the nodes up by index, close_gaps returns a range index
+    track_labels = tracks_to_zarr(config_file, tracks_df.set_index("id"), store_or_path=tracks_path, overwrite=True)
+
+    features_df = extract_features(track_labels, channels, n_workers=n_workers)
+
+    painted = features_df["label"].unique() if len(features_df) else []
+    missing = tracks_df.loc[~tracks_df["track_id"].isin(painted), "track_id"].unique()
+    if len(missing):
+        warn(f"{len(missing)} tracks missing from {TRACK_LABELS} (e.g. track {missing[0]})", RuntimeWarning)
+
+    return join_features(tracks_df, features_df, label_column="track_id")
+
+def export_tracks(tracks_df:DataFrame,
+                  config_file:MainConfig,
+                  formats:list,
+                  output_dir:str,
+                  channels:dict = None,
+                  profiler:StageProfiler = None) -> dict:
+    """
+    Function that exports one tracking solution in several formats
+    :tracks_df: DataFrame | tracking data
+    :config_file: MainConfig | ultrack configuration holding the solution
+    :formats: list | export formats (see EXPORT_FORMATS)
+    :output_dir: str | folder to save the exports
+    :channels: dict | channel name -> intensity video (features export)
+    :profiler: StageProfiler | records every export, disabled when None
+    :return: dict | export format -> output path
+    """
+    profiler = profiler or StageProfiler(enabled=False)
+    makedirs(output_dir, exist_ok=True)
+
+    outputs = {item : join(output_dir, EXPORT_FORMATS[item]) for item in formats}
+
+    if "features" in formats and not channels:
+        raise ValueError("features export requires --images or --channel")
+
+    for item in formats:
+        with profiler.stage(f"export_{item}") as record:
+            if item == "csv":
+                export_csv(tracks_df, outputs["csv"])
+            elif item == "parquet":
+                export_parquet(tracks_df, outputs["parquet"])
+            elif item == "ctc":
+                export_ctc(config_file, output_dir)
+            elif item == "trackmate":
+                export_trackmate(config_file, outputs["trackmate"])
+            elif item == "features":
+                features_df = export_features(tracks_df, config_file, channels)
+                features_df.to_csv(outputs["features"], index=False)
+                record["rows"] = len(features_df)
+
+    return outputs
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    # Assign cli arguments to variables
+    input_folder    = args_dict["input"]
+    config_file     = args_dict["config_file"]
+    output_dir      = args_dict["output"]
+    images_folder   = args_dict["images"]
+    make_graph      = args_dict["make_graph"]
+    contours_cache  = args_dict["contours_cache"]
+    cache_size      = args_dict["cache_size"] * 1e9
+    memory_budget   = args_dict["memory_budget"]
+    max_gap         = 0 if args_dict["no_gap_closing"] else args_dict["max_gap"]
+    max_distance    = args_dict["max_distance"]
+    formats         = parse_export_formats(args_dict["export"])
+
+    # Open segmentation mask
+    segmentation_video = imread(input_folder + "/*")
+
+    # if make graph is true, make the graph and exit function
+    if make_graph:
+        plot_areas_graph(segmentation_video, config_file, output_dir, n_samples=args_dict["sample_frames"])
+        return
+
+    channels = parse_channels(args_dict["channels"])
+    if images_folder:
+        channels = {"intensity" : imread(images_folder + "/*"), **channels}
+
+    conf_obj = load_config(config_file)
+
+    if not args_dict["config_weights"]:
+        apply_tracking_weights(conf_obj, args_dict["appear_weight"],
+                               args_dict["disappear_weight"], args_dict["division_weight"])
+
+    if args_dict["append"]:
+        if formats != ["csv"]:
+            raise ValueError("--append only supports the csv export")
+
+        # imported here, append_tracking builds on this module
+        from ultrack_modules.tracking.append_tracking import track_append
+
+        makedirs(output_dir, exist_ok=True)
+        new_rows = track_append(segmentation_video, conf_obj, output_dir,
+                                join(output_dir, EXPORT_FORMATS["csv"]),
+                                max_gap=max_gap, max_distance=max_distance)
+        print(f"{len(new_rows)} rows written")
+        return
+
+    makedirs(output_dir, exist_ok=True)
+    profiler = StageProfiler(enabled=args_dict["profile"],
+                             dump_backend=args_dict["profile_dumps"],
+                             dump_dir=join(output_dir, "profile"))
+
+    # track once
+    tracks_df = track_segmentation(video=segmentation_video, config_file=conf_obj,
+                                   contours_cache=contours_cache, cache_size=cache_size,
+                                   memory_budget=memory_budget * 1e9 if memory_budget else None,
+                                   windows_report=join(output_dir, WINDOWS_REPORT),
+                                   max_gap=max_gap, max_distance=max_distance,
+                                   profiler=profiler)
+
+    # export every requested format from the same solution
+    outputs = export_tracks(tracks_df, conf_obj, formats, output_dir,
+                            channels=channels,
+                            profiler=profiler)
+
+    profiler.save(join(output_dir, RUN_REPORT),
+                  input=input_folder, config=config_file, shape=segmentation_video.shape,
+                  export=formats)
+
+    for item, path in outputs.items():
+        print(f"{item} -> {path}")
+
+    print("Done!")
+
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
@@ -0,0 +1,281 @@
+"""
+Module that tracks several positions at once, each one in a private
+working directory and SQLite database, scheduling as many positions
+as fit the cores and memory budget
+"""
+####################################
+print("Importing required libraries...")
+from argparse import ArgumentParser
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from os import cpu_count, listdir, makedirs
+from os.path import basename, isdir, join, normpath
+from time import perf_counter
+
+from ultrack.config.config import MainConfig
+from ultrack import load_config
+
+from dask.array.image import imread
+from pandas import DataFrame
+
+from psutil import virtual_memory
+
+from ultrack_modules.tracking.ultrack_track_engine import DEFAULT_CONFIG, EXPORT_FORMATS
+from ultrack_modules.tracking.ultrack_track_engine import parse_export_formats, isolated_config
+from ultrack_modules.tracking.ultrack_track_engine import track_segmentation, export_tracks
+
+print("All libraries imported sucessfully!")
+
+####################################
+# Define global variables
+
+STATUS_TABLE : str = "positions_status.csv"
+
+# Peak memory of one tracking per label pixel: the labels, the float32
+# detection and edges maps and the segmentation hierarchy built from them
+BYTES_PER_PIXEL : int = 24
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Module that tracks several positions concurrently under a core and memory budget"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-i", "--input",
+                        action="store",
+                        required=True,
+                        nargs="+",
+                        dest="inputs",
+                        help="Segmentation masks folders, one per position, or a single "
+                             "folder containing one subfolder per position")
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        required=True,
+                        dest="output",
+                        help="Output folder, one subfolder is created per position")
+
+    parser.add_argument("-c", "--config",
+                        action="store",
+                        required=False,
+                        default=DEFAULT_CONFIG,
+                        dest="config_file",
+                        help="path to a config file")
+
+    parser.add_argument("-e", "--export",
+                        action="store",
+                        required=False,
+                        default="csv",
+                        dest="export",
+                        help=f"Comma separated export formats, any of: {','.join(EXPORT_FORMATS)}")
+
+    parser.add_argument("--cores",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=None,
+                        dest="cores",
+                        help="Cores available to the scheduler (default: all)")
+
+    parser.add_argument("--memory",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=None,
+                        dest="memory",
+                        help="Memory available to the scheduler in GB (default: 80%% of the available memory)")
+
+    parser.add_argument("--n_workers",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=None,
+                        dest="n_workers",
+                        help="Cap on the config workers/threads of each position (default: as in the config)")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining helper functions
+
+def list_positions(inputs:list) -> dict:
+    """
+    Function that lists the positions to be tracked
+    :inputs: list | masks folders, or a single folder of position folders
+    :return: dict | position name -> masks folder
+    """
+    if len(inputs) == 1:
+        subfolders = sorted(name for name in listdir(inputs[0]) if isdir(join(inputs[0], name)))
+        if subfolders:
+            return {name : join(inputs[0], name) for name in subfolders}
+
+    return {basename(normpath(folder)) : folder for folder in inputs}
+
+def config_cores(config_file:MainConfig) -> int:
+    """
+    Function that returns the cores one tracking of this config keeps busy
+    :config_file: MainConfig | ultrack configuration
+    :return: int | greatest workers/threads count of the tracking stages
+    """
+    n_threads = config_file.tracking_config.n_threads
+    return max(config_file.data_config.n_workers,
+               config_file.segmentation_config.n_workers,
+               config_file.linking_config.n_workers,
+               n_threads if n_threads > 0 else (cpu_count() or 1),
+               1)
+
+def position_memory(masks_folder:str) -> float:
+    """
+    Function that estimates the peak memory of tracking one position
+    :masks_folder: str | segmentation masks folder
+    :return: float | estimated peak memory (bytes)
+    """
+    video = imread(masks_folder + "/*")
+    return float(video.size) * (video.dtype.itemsize + BYTES_PER_PIXEL)
+
+def get_concurrency(n_positions:int,
+                    cores_per_position:int,
+                    memory_per_position:float,
+                    cores:int,
+                    memory:float) -> int:
+    """
+    Function that computes how many positions fit the budget at once
+    :n_positions: int | number of positions to be tracked
+    :cores_per_position: int | cores kept busy by one tracking
+    :memory_per_position: float | peak memory of one tracking (bytes)
+    :cores: int | cores available
+    :memory: float | memory available (bytes)
+    :return: int | positions tracked at once (at least one)
+    """
+    by_cores = cores // max(cores_per_position, 1)
+    by_memory = int(memory // max(memory_per_position, 1))
+
+    return max(min(n_positions, by_cores, by_memory), 1)
+
+def _track_position_job(job:tuple) -> dict:
+    """
+    Function that tracks one position in its private working directory
+    :job: tuple | (position, masks_folder, config_path, output_dir, formats, n_workers)
+    :return: dict | status row of the position
+    """
+    position, masks_folder, config_path, output_dir, formats, n_workers = job
+    start = perf_counter()
+
+    status = {"position" : position, "input" : masks_folder, "output" : output_dir}
+
+    try:
+        config = isolated_config(load_config(config_path), join(output_dir, "ultrack"), n_workers=n_workers)
+        video = imread(masks_folder + "/*")
+
+        tracks_df = track_segmentation(video, config)
+        export_tracks(tracks_df, config, formats, output_dir)
+
+        status.update({"status" : "done", "n_tracks" : tracks_df["track_id"].nunique(), "error" : ""})
+
+    except Exception as error:
+        status.update({"status" : "failed", "n_tracks" : 0, "error" : f"{type(error).__name__}: {error}"})
+
+    status["seconds"] = round(perf_counter() - start, 1)
+
+    return status
+
+def track_positions(positions:dict,
+                    config_path:str,
+                    output_dir:str,
+                    formats:list,
+                    cores:int = None,
+                    memory:float = None,
+                    n_workers:int = None) -> DataFrame:
+    """
+    Function that tracks every position, running as many at once as
+    the cores and memory allow, and keeps a status table up to date
+    :positions: dict | position name -> masks folder
+    :config_path: str | ultrack config file
+    :output_dir: str | output folder, one subfolder per position
+    :formats: list | export formats
+    :cores: int | cores available (default: all)
+    :memory: float | memory available in bytes (default: 80% of the available memory)
+    :n_workers: int | cap on the config workers/threads of each position
+    :return: DataFrame | status table
+    """
+    cores = cores or cpu_count() or 1
+    memory = memory or 0.8 * virtual_memory().available
+
+    config_file = load_config(config_path)
+    cores_per_position = config_cores(config_file) if n_workers is None else min(config_cores(config_file), n_workers)
+    memory_per_position = max(position_memory(folder) for folder in positions.values())
+
+    n_concurrent = get_concurrency(len(positions), cores_per_position, memory_per_position, cores, memory)
+    print(f"Tracking {len(positions)} positions, {n_concurrent} at once "
+          f"({cores_per_position} cores, {memory_per_position / 1e9:.1f} GB each)")
+
+    jobs = [(position, folder, config_path, join(output_dir, position), formats, n_workers)
+            for position, folder in positions.items()]
+
+    status_path = join(output_dir, STATUS_TABLE)
+    rows = []
+
+    # spawn, worker processes must be able to start their own pools
+    with ProcessPoolExecutor(n_concurrent, mp_context=get_context("spawn")) as executor:
+        futures = [executor.submit(_track_position_job, job) for job in jobs]
+
+        for future in as_completed(futures):
+            rows.append(future.result())
+            print(f"{rows[-1]['position']}: {rows[-1]['status']} in {rows[-1]['seconds']}s "
+                  f"({len(rows)}/{len(jobs)})")
+
+            # rewritten after every position, so it can be followed while running
+            DataFrame(rows).sort_values("position").to_csv(status_path, index=False)
+
+    return DataFrame(rows).sort_values("position").reset_index(drop=True)
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    # Assign cli arguments to variables
+    output_dir      = args_dict["output"]
+    config_file     = args_dict["config_file"]
+    formats         = parse_export_formats(args_dict["export"])
+    memory          = args_dict["memory"] * 1e9 if args_dict["memory"] else None
+
+    makedirs(output_dir, exist_ok=True)
+
+    positions = list_positions(args_dict["inputs"])
+
+    status = track_positions(positions, config_file, output_dir, formats,
+                             cores=args_dict["cores"], memory=memory,
+                             n_workers=args_dict["n_workers"])
+
+    print(status.to_string(index=False))
+
+    print("Done!")
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
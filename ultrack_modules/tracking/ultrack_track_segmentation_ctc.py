@@ -4,21 +4,16 @@ Module that tracks a segmentation masks video and exports its tracking table
 ####################################
 from argparse import ArgumentParser
 
-
-from pathlib import Path
-from ultrack.utils import estimate_parameters_from_labels, labels_to_contours
 from ultrack.config.config import MainConfig
-from ultrack import load_config, track, to_tracks_layer
-from ultrack.tracks import close_tracks_gaps
-from ultrack.imgproc import tracks_properties
-from ultrack.core.export import to_ctc
-
-from matplotlib.pyplot import show
+from ultrack import load_config
 
 from dask.array.image import imread
 from dask.array.core import Array
 from pandas import DataFrame
 
+from ultrack_modules.tracking.ultrack_track_engine import track_segmentation as track_once
+from ultrack_modules.tracking.ultrack_track_engine import export_ctc, plot_areas_graph
+
 ####################################
 # Define Argument Parsing Function
 
@@ -59,7 +54,7 @@ def get_args_dict() -> dict:
                         action="store_true",
                         required=False,
                         dest="make_graph",
-                        help="Whether to make areas graph to tune configs")
+                        help="Save areas/distances histograms and a suggested config, then exit")
     
     # creating arguments dictionary
     args_dict = vars(parser.parse_args())
@@ -72,32 +67,16 @@ def get_args_dict() -> dict:
 
 def track_segmentation(video:Array, config_file:MainConfig, output_dir:str) -> DataFrame:
     """
-    Function that tracks a segmentation masks video
+    Function that tracks a segmentation masks video and exports it in CTC format
     :video: dask.Array | Array contaning the video data
-    :config_file: str | path to the ultrack configuration file
-    :return: pandas.DataFrame | tracks_df with tracking data 
-    """ 
-    # Create detection and edges
-    detection, edges = labels_to_contours(video, sigma=4.5)
-    
-    # track the video
-    track(
-        detection=detection,
-        edges=edges,
-        config=config_file,
-        overwrite=True,
-    )
-    
-    # create tracks df
-    tracks_df, _ = to_tracks_layer(config_file)
-    
-    # close tracks gaps
-    print("[Using function close_tracks_gaps, to disable comment line 94!]")
-    tracks_df = close_tracks_gaps(tracks_df, 50, 50, spatial_columns=["x", "y"])
+    :config_file: MainConfig | ultrack configuration
+    :output_dir: str | folder to save the CTC files
+    :return: pandas.DataFrame | tracks_df with tracking data
+    """
+    tracks_df = track_once(video, config_file)
 
-    to_ctc(Path(output_dir),config_file)
+    export_ctc(config_file, output_dir)
 
-    # return tracks_df
     return tracks_df
 
 ####################################
@@ -122,9 +101,7 @@ def main() -> None:
     
     # if make graph is true, make the graph and exit function
     if make_graph:
-        params_df = estimate_parameters_from_labels(segmentation_video, is_timelapse=True)
-        params_df["area"].plot(kind="hist", bins=100, title="Area histogram")
-        show()
+        plot_areas_graph(segmentation_video, config_file, output_file)
         return
 
     conf_obj = load_config(config_file)
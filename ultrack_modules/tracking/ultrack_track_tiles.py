@@ -0,0 +1,355 @@
+"""
+Module that tracks a large field in overlapping XY tiles, each one in
+its own process with its own ultrack working directory and database,
+and stitches the tracks crossing the seams by matching the detections
+of the overlap bands
+"""
+####################################
+print("Importing required libraries...")
+from argparse import ArgumentParser
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os import cpu_count, makedirs
+from os.path import join
+
+from ultrack import load_config
+
+from dask.array.image import imread
+from pandas import DataFrame, concat
+
+import numpy as np
+
+from ultrack_modules.tracking.ultrack_track_engine import DEFAULT_CONFIG, EXPORT_FORMATS
+from ultrack_modules.tracking.ultrack_track_engine import track_segmentation, isolated_config
+from ultrack_modules.misc.match_detections import match_detections
+
+print("All libraries imported sucessfully!")
+
+####################################
+# Define Argument Parsing Function
+
+def get_args_dict() -> dict:
+    """
+    Function that reads the cli arguments and returns
+    a dict containing them.
+    :return: dict | Dictionary with cli passed arguments
+    """
+
+    # defining program description
+    description = "Module that tracks a large field in parallel XY tiles and stitches the seams"
+
+    # creating a parser instance
+    parser = ArgumentParser(description=description)
+
+    # adding arguments to parser
+    parser.add_argument("-i", "--input",
+                        action="store",
+                        required=True,
+                        dest="input",
+                        help="Input folder with segmentation masks to be tracked")
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        required=True,
+                        dest="output",
+                        help="Output folder to save the stitched tracking")
+
+    parser.add_argument("-c", "--config",
+                        action="store",
+                        required=False,
+                        default=DEFAULT_CONFIG,
+                        dest="config_file",
+                        help="path to a config file")
+
+    parser.add_argument("-t", "--tiles",
+                        action="store",
+                        required=False,
+                        default="4x4",
+                        dest="tiles",
+                        help="Tiles grid as ROWSxCOLS")
+
+    parser.add_argument("--overlap",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=128,
+                        dest="overlap",
+                        help="Width in pixels of the band shared by neighbouring tiles "
+                             "(at least two cell diameters)")
+
+    parser.add_argument("--tolerance",
+                        action="store",
+                        required=False,
+                        type=float,
+                        default=5.0,
+                        dest="tolerance",
+                        help="Greatest centroid distance to match detections of the overlap band")
+
+    parser.add_argument("--n_processes",
+                        action="store",
+                        required=False,
+                        type=int,
+                        default=None,
+                        dest="n_processes",
+                        help="Tiles tracked at once (default: one per tile, up to the cores)")
+
+    # creating arguments dictionary
+    args_dict = vars(parser.parse_args())
+
+    # returning the arguments dictionary
+    return args_dict
+
+####################################
+# Defining helper functions
+
+def get_tiles(height:int, width:int, n_rows:int, n_cols:int, overlap:int) -> list:
+    """
+    Function that splits a field into a grid of overlapping tiles.
+    The core of a tile is its share of the grid, detections are owned
+    by the tile whose core contains their centroid.
+    :height: int | field height
+    :width: int | field width
+    :n_rows: int | tiles along Y
+    :n_cols: int | tiles along X
+    :overlap: int | width of the band shared by neighbouring tiles
+    :return: list | dicts with index, bounds and core as (y0, y1, x0, x1)
+    """
+    y_edges = np.linspace(0, height, n_rows + 1).round().astype(int)
+    x_edges = np.linspace(0, width, n_cols + 1).round().astype(int)
+    half = overlap // 2
+
+    tiles = []
+    for row in range(n_rows):
+        for col in range(n_cols):
+            core = (y_edges[row], y_edges[row + 1], x_edges[col], x_edges[col + 1])
+            bounds = (max(core[0] - half, 0), min(core[1] + half, height),
+                      max(core[2] - half, 0), min(core[3] + half, width))
+            tiles.append({"index" : len(tiles), "bounds" : bounds, "core" : core})
+
+    return tiles
+
+def _track_tile_job(job:tuple) -> DataFrame:
+    """
+    Function that tracks one tile in its own working directory
+    :job: tuple | (tile, input_folder, config_path, working_dir, n_workers)
+    :return: DataFrame | tile tracks in field coordinates
+    """
+    tile, input_folder, config_path, working_dir, n_workers = job
+    y0, y1, x0, x1 = tile["bounds"]
+
+    config = isolated_config(load_config(config_path), working_dir, n_workers=n_workers)
+    video = imread(input_folder + "/*")[:, y0:y1, x0:x1]
+
+    tracks_df = track_segmentation(video, config)
+
+    # back to field coordinates
+    tracks_df["y"] += y0
+    tracks_df["x"] += x0
+    tracks_df["tile"] = tile["index"]
+
+    print(f"Tile {tile['index']} tracked: {tracks_df['track_id'].nunique()} tracks")
+
+    return tracks_df
+
+def find_root(parents:np.ndarray, key:int) -> int:
+    """
+    Function that finds the union-find root of a key, compressing the path
+    :parents: np.ndarray | union-find parent of every key
+    :key: int | key to look up
+    :return: int | root key
+    """
+    root = key
+    while parents[root] != root:
+        root = parents[root]
+    while parents[key] != root:
+        parents[key], key = root, parents[key]
+    return root
+
+def rebuild_node_links(tracks_df:DataFrame) -> DataFrame:
+    """
+    Function that rewrites node ids and parent node ids from the
+    track structure (parent_id of a track's first node is the last
+    node of its parent track)
+    :tracks_df: DataFrame | tracks with track_id, t and parent_track_id
+    :return: DataFrame | sorted tracks with consistent id and parent_id
+    """
+    tracks_df = tracks_df.sort_values(["track_id", "t"], kind="stable").reset_index(drop=True)
+
+    ids = np.arange(1, len(tracks_df) + 1, dtype=np.int64)
+    track_ids = tracks_df["track_id"].to_numpy()
+
+    first = np.ones(len(ids), dtype=bool)
+    first[1:] = track_ids[1:] != track_ids[:-1]
+    last = np.ones(len(ids), dtype=bool)
+    last[:-1] = first[1:]
+
+    parent_ids = np.empty(len(ids), dtype=np.int64)
+    parent_ids[~first] = ids[:-1][~first[1:]]
+
+    # first node of a track -> last node of its parent track
+    last_node = dict(zip(track_ids[last], ids[last]))
+    parent_tracks = tracks_df["parent_track_id"].to_numpy()[first]
+    parent_ids[first] = [last_node.get(parent, -1) for parent in parent_tracks]
+
+    tracks_df["id"] = ids
+    tracks_df["parent_id"] = parent_ids
+
+    return tracks_df
+
+def stitch_tiles(tiles_dfs:list, tiles:list, tolerance:float) -> DataFrame:
+    """
+    Function that joins the tracks of every tile into a single table.
+    Tracks whose detections match in an overlap band are merged and each
+    detection is kept only from the tile owning its centroid.
+    :tiles_dfs: list | tracks of every tile, in field coordinates
+    :tiles: list | tiles from get_tiles
+    :tolerance: float | greatest centroid distance between matched detections
+    :return: DataFrame | stitched tracks
+    """
+    tracks_df = concat(tiles_dfs, ignore_index=True)
+
+    # one key per (tile, track_id)
+    key_base = int(tracks_df["track_id"].max()) + 1
+    tile_col = tracks_df["tile"].to_numpy()
+    keys = tile_col * key_base + tracks_df["track_id"].to_numpy()
+    parents = np.arange(len(tiles) * key_base)
+
+    t = tracks_df["t"].to_numpy(dtype=np.float64)
+    y = tracks_df["y"].to_numpy(dtype=np.float64)
+    x = tracks_df["x"].to_numpy(dtype=np.float64)
+
+    # frames far apart in a third axis, so one query matches every frame
+    coords = np.column_stack([t * (2 * tolerance + 1), y, x])
+
+    for first in tiles:
+        for second in tiles[first["index"] + 1:]:
+            band_y0 = max(first["bounds"][0], second["bounds"][0])
+            band_y1 = min(first["bounds"][1], second["bounds"][1])
+            band_x0 = max(first["bounds"][2], second["bounds"][2])
+            band_x1 = min(first["bounds"][3], second["bounds"][3])
+            if band_y0 >= band_y1 or band_x0 >= band_x1:
+                continue
+
+            in_band = (y >= band_y0) & (y < band_y1) & (x >= band_x0) & (x < band_x1)
+            first_rows = np.flatnonzero(in_band & (tile_col == first["index"]))
+            second_rows = np.flatnonzero(in_band & (tile_col == second["index"]))
+
+            first_idx, second_idx = match_detections(coords[first_rows], coords[second_rows], tolerance)
+
+            for a, b in zip(keys[first_rows[first_idx]], keys[second_rows[second_idx]]):
+                root_a, root_b = find_root(parents, a), find_root(parents, b)
+                if root_a != root_b:
+                    parents[max(root_a, root_b)] = min(root_a, root_b)
+
+    # keep every detection only from its owner tile
+    cores = np.array([tile["core"] for tile in tiles])[tile_col]
+    owned = (y >= cores[:, 0]) & (y < cores[:, 1]) & (x >= cores[:, 2]) & (x < cores[:, 3])
+
+    roots = np.array([find_root(parents, key) for key in keys])
+    tracks_df["key"] = keys
+    tracks_df["group"] = roots
+    tracks_df = tracks_df[owned].copy()
+
+    # a merge that leaves two detections in the same frame is not trusted
+    conflicts = tracks_df.duplicated(["group", "t"], keep=False)
+    bad_groups = tracks_df.loc[conflicts, "group"].unique()
+    if len(bad_groups):
+        print(f"{len(bad_groups)} seam merges reverted (two detections in the same frame)")
+    reverted = tracks_df["group"].isin(bad_groups)
+    tracks_df.loc[reverted, "group"] = tracks_df.loc[reverted, "key"]
+
+    # sequential track ids and parents mapped through the merges
+    group_to_id = {group : i for i, group in enumerate(np.unique(tracks_df["group"]), start=1)}
+    key_to_id = dict(zip(tracks_df["key"], tracks_df["group"].map(group_to_id)))
+    for key in np.unique(keys):
+        key_to_id.setdefault(key, group_to_id.get(find_root(parents, key), -1))
+
+    # the parent of a merged track is the parent of its earliest member
+    tracks_df = tracks_df.sort_values(["group", "t"], kind="stable")
+    earliest = tracks_df.groupby("group", sort=False).first()
+    parent_keys = earliest["tile"].to_numpy() * key_base + earliest["parent_track_id"].to_numpy()
+    group_parent = {group : (key_to_id.get(key, -1) if parent > 0 else -1)
+                    for group, key, parent in zip(earliest.index, parent_keys, earliest["parent_track_id"])}
+
+    tracks_df["track_id"] = tracks_df["group"].map(group_to_id)
+    tracks_df["parent_track_id"] = tracks_df["group"].map(group_parent)
+    tracks_df.loc[tracks_df["parent_track_id"] == tracks_df["track_id"], "parent_track_id"] = -1
+
+    tracks_df = tracks_df.drop(columns=["key", "group", "tile"])
+
+    return rebuild_node_links(tracks_df)
+
+def track_tiles(input_folder:str,
+                config_path:str,
+                working_dir:str,
+                n_rows:int,
+                n_cols:int,
+                overlap:int = 128,
+                tolerance:float = 5.0,
+                n_processes:int = None) -> DataFrame:
+    """
+    Function that tracks every tile in parallel and stitches them
+    :input_folder: str | folder with segmentation masks
+    :config_path: str | ultrack config file
+    :working_dir: str | folder holding one working directory per tile
+    :n_rows: int | tiles along Y
+    :n_cols: int | tiles along X
+    :overlap: int | width of the band shared by neighbouring tiles
+    :tolerance: float | greatest centroid distance between matched detections
+    :n_processes: int | tiles tracked at once
+    :return: DataFrame | stitched tracks
+    """
+    height, width = imread(input_folder + "/*").shape[-2:]
+    tiles = get_tiles(height, width, n_rows, n_cols, overlap)
+
+    n_cores = cpu_count() or 1
+    n_processes = min(n_processes or len(tiles), len(tiles), n_cores)
+
+    # share the cores among the tiles running at once
+    n_workers = max(n_cores // n_processes, 1)
+
+    jobs = [(tile, input_folder, config_path, join(working_dir, f"tile_{tile['index']:03d}"), n_workers)
+            for tile in tiles]
+
+    # spawn, worker processes must be able to start their own pools
+    with ProcessPoolExecutor(n_processes, mp_context=get_context("spawn")) as executor:
+        tiles_dfs = list(executor.map(_track_tile_job, jobs))
+
+    return stitch_tiles(tiles_dfs, tiles, tolerance)
+
+####################################
+# Defining main function
+def main() -> None:
+    """
+    Code's main function.
+    :return: None
+    """
+
+    # Getting cli arguments dict
+    args_dict = get_args_dict()
+
+    # Assign cli arguments to variables
+    input_folder    = args_dict["input"]
+    output_dir      = args_dict["output"]
+    config_file     = args_dict["config_file"]
+    n_rows, n_cols  = map(int, args_dict["tiles"].lower().split("x"))
+
+    makedirs(output_dir, exist_ok=True)
+
+    tracks_df = track_tiles(input_folder, config_file,
+                            working_dir=join(output_dir, "tiles"),
+                            n_rows=n_rows, n_cols=n_cols,
+                            overlap=args_dict["overlap"],
+                            tolerance=args_dict["tolerance"],
+                            n_processes=args_dict["n_processes"])
+
+    tracks_df.to_csv(join(output_dir, EXPORT_FORMATS["csv"]), index=False)
+
+    print("Done!")
+
+####################################
+if __name__ == "__main__":
+    main()
+
+# End of current module
@@ -5,19 +5,17 @@ Module that tracks a video and exports its tracking table
 print("Importing required libraries...")
 from argparse import ArgumentParser
 
-from ultrack.utils import estimate_parameters_from_labels, labels_to_contours
-from ultrack.config.config import MainConfig
-from ultrack import load_config, track, to_tracks_layer
-from ultrack.tracks import close_tracks_gaps
-from ultrack.imgproc import tracks_properties
+from os.path import abspath, dirname
 
-from matplotlib.pyplot import show
+from ultrack import load_config
 
 from dask.array.image import imread
 from dask.array.core import Array
 from pandas import DataFrame
 
-from misc.segmentation_mask_stardist import segment_array
+from ultrack_modules.misc.segmentation_mask_stardist import segment_array
+from ultrack_modules.tracking.ultrack_track_engine import track_segmentation, export_features, plot_areas_graph
+from ultrack_modules.tracking.ultrack_track_engine import isolated_config
 
 print("All libraries imported sucessfully!")
 
@@ -61,7 +59,7 @@ def get_args_dict() -> dict:
                         action="store_true",
                         required=False,
                         dest="make_graph",
-                        help="Whether to make areas graph to tune configs")
+                        help="Save areas/distances histograms and a suggested config, then exit")
     
     # creating arguments dictionary
     args_dict = vars(parser.parse_args())
@@ -72,36 +70,34 @@ def get_args_dict() -> dict:
 ####################################
 # Defining helper functions
 
-def track_video(video:Array, config_file:str) -> DataFrame:
+def track_video(video:Array, config_file:str,
+                labels_path:str = None, n_workers:int = 1,
+                working_dir:str = None, config_workers:int = None) -> DataFrame:
     """
-    DESCRIPTION
+    Function that segments and tracks a video
+    :video: dask.Array | Array containing the video data
+    :config_file: str | path to the ultrack configuration file
+    :labels_path: str | if set, labels are written to this zarr array instead of RAM
+    :n_workers: int | number of segmentation worker processes (zarr mode only)
+    :working_dir: str | if set, private ultrack working directory (and database)
+    :config_workers: int | if set, caps the config workers and threads
+    :return: pandas.DataFrame | tracks_df with tracking data and properties
     """
     
     # create labels
-    labels = segment_array(video)
-    
-    # Create detection and edges
-    detection, edges = labels_to_contours(labels, sigma=4.5) 
+    labels = segment_array(video, labels_path=labels_path, n_workers=n_workers)
     
     # create config object
     config = load_config(config_file)
     
-    # track the video
-    track(
-        detection=detection,
-        edges=edges,
-        config=config,
-        overwrite=True,
-    )
-    
-    # create tracks df
-    tracks_df, _ = to_tracks_layer(config)
+    # private working directory, to track several videos at once
+    if working_dir is not None:
+        config = isolated_config(config, working_dir, n_workers=config_workers)
     
-    # close tracks gaps
-    print("[Using function close_tracks_gaps, to disable comment line 94!]")
-    tracks_df = close_tracks_gaps(tracks_df, 50, 50, spatial_columns=["x", "y"])
+    # track the labels
+    tracks_df = track_segmentation(labels, config)
     
-    tracks_df_areas = tracks_properties(labels, image=video, tracks_df=tracks_df)
+    tracks_df_areas = export_features(tracks_df, config, {"intensity" : video})
     
     # return tracks_df
     return tracks_df_areas
@@ -128,9 +124,7 @@ def main() -> None:
     
     # if make graph is true, make the graph and exit function
     if make_graph:
-        params_df = estimate_parameters_from_labels(segmentation_video, is_timelapse=True)
-        params_df["area"].plot(kind="hist", bins=100, title="Area histogram")
-        show()
+        plot_areas_graph(segmentation_video, config_file, dirname(abspath(output_file)))
         return
     
     # else, track the video
@@ -0,0 +1,203 @@
+"""
+Module that solves an ultrack candidate graph in temporal windows,
+sizing window_size/overlap_size from a memory budget instead of
+solving the whole movie at once
+"""
+####################################
+from time import perf_counter
+from warnings import warn
+
+from ultrack.config.config import MainConfig
+from ultrack.core.database import NodeDB
+from ultrack.core.solve.sqltracking import SQLTracking
+from ultrack import solve
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session
+
+from scipy.spatial.distance import cdist
+from scipy.optimize import linear_sum_assignment
+
+from pandas import DataFrame
+
+import numpy as np
+
+####################################
+# Define global variables
+
+# Rough solver memory per candidate node (variables, constraints and
+# the max_neighbors link variables attached to it), for max_neighbors = 5
+SOLVER_BYTES_PER_NODE : int = 16 * 1024
+REFERENCE_NEIGHBORS : int   = 5
+
+# Smallest window worth solving, shorter ones only add boundary effects
+MIN_WINDOW_SIZE : int       = 10
+
+####################################
+# Defining helper functions
+
+def count_nodes_per_frame(config_file:MainConfig) -> float:
+    """
+    Function that reads the mean number of candidate nodes per frame
+    from the segmentation already stored in the database
+    :config_file: MainConfig | ultrack configuration
+    :return: float | mean candidate nodes per frame
+    """
+    engine = create_engine(config_file.data_config.database_path)
+
+    with Session(engine) as session:
+        n_nodes, n_frames = session.query(func.count(NodeDB.id),
+                                          func.count(func.distinct(NodeDB.t))).one()
+
+    return n_nodes / max(n_frames, 1)
+
+def get_window_size(nodes_per_frame:float,
+                    memory_budget:float,
+                    max_neighbors:int = REFERENCE_NEIGHBORS) -> tuple:
+    """
+    Function that picks window_size and overlap_size fitting a memory budget
+    :nodes_per_frame: float | mean candidate nodes per frame
+    :memory_budget: float | memory available to the solver (bytes)
+    :max_neighbors: int | linking max_neighbors of the config
+    :return: tuple | (window_size, overlap_size)
+    """
+    bytes_per_node = SOLVER_BYTES_PER_NODE * max(max_neighbors, 1) / REFERENCE_NEIGHBORS
+    bytes_per_frame = max(nodes_per_frame, 1) * bytes_per_node
+
+    # window plus its overlap on both sides must fit the budget
+    window_size = max(int(memory_budget // bytes_per_frame), MIN_WINDOW_SIZE)
+    overlap_size = max(window_size // 10, 1)
+    window_size = max(window_size - 2 * overlap_size, MIN_WINDOW_SIZE)
+
+    return window_size, overlap_size
+
+def solve_windowed(config_file:MainConfig, n_frames:int, memory_budget:float) -> DataFrame:
+    """
+    Function that solves the linked candidate graph window by window.
+    window_size/overlap_size are written to the config, so exports read
+    the stitched solution as usual.
+    :config_file: MainConfig | ultrack configuration, already segmented and linked
+    :n_frames: int | number of frames of the movie
+    :memory_budget: float | memory available to the solver (bytes)
+    :return: DataFrame | per window report (frames, solve time, time limit hit)
+    """
+    nodes_per_frame = count_nodes_per_frame(config_file)
+    window_size, overlap_size = get_window_size(nodes_per_frame, memory_budget,
+                                                config_file.linking_config.max_neighbors)
+
+    tracking_config = config_file.tracking_config
+    tracking_config.window_size = window_size
+    tracking_config.overlap_size = overlap_size
+
+    # the same count solve checks batch_index against
+    n_windows = SQLTracking(config_file).num_batches
+    print(f"Solving {n_frames} frames in {n_windows} windows of {window_size} "
+          f"(+{overlap_size} overlap), {nodes_per_frame:.0f} nodes per frame")
+
+    report = []
+    for batch_index in range(n_windows):
+        start = perf_counter()
+        solve(config_file, overwrite=batch_index == 0, batch_index=batch_index)
+        elapsed = perf_counter() - start
+
+        # ultrack does not return the final MIP gap, a solve that used the
+        # whole time_limit stopped before reaching solution_gap
+        hit_limit = tracking_config.time_limit > 0 and elapsed >= tracking_config.time_limit
+        report.append({"window"         : batch_index,
+                       "first_frame"    : batch_index * window_size,
+                       "last_frame"     : min((batch_index + 1) * window_size, n_frames) - 1,
+                       "solve_time"     : elapsed,
+                       "solution_gap"   : tracking_config.solution_gap,
+                       "hit_time_limit" : hit_limit})
+
+        print(f"Window {batch_index + 1}/{n_windows}: {elapsed:.1f}s"
+              + (" (time limit reached, gap above target)" if hit_limit else ""))
+
+    return DataFrame(report)
+
+def count_seam_breaks(tracks_df:DataFrame,
+                      window_size:int,
+                      max_distance:float,
+                      spatial_columns:tuple = ("x", "y")) -> int:
+    """
+    Function that counts the tracks broken at window seams: a track ending
+    without children on the last frame of a window, continued by a track
+    without parent starting on the first frame of the next one. Ends and
+    starts of a seam are paired as in gap closing (linear assignment of
+    their distances, closer than max_distance), so births, deaths and
+    divisions away from each other are not counted.
+    :tracks_df: DataFrame | to_tracks_layer output
+    :window_size: int | window size used to solve
+    :max_distance: float | distance between end and start must be smaller
+    :spatial_columns: tuple | coordinates columns
+    :return: int | number of matched end/start pairs across the seams
+    """
+    spatial_columns = [column for column in spatial_columns if column in tracks_df.columns]
+    by_track = tracks_df.groupby("track_id")["t"]
+
+    starts = tracks_df.loc[by_track.idxmin()]
+    starts = starts[(starts["parent_track_id"] <= 0) & (starts["t"] > 0) & (starts["t"] % window_size == 0)]
+
+    ends = tracks_df.loc[by_track.idxmax()]
+    ends = ends[~ends["track_id"].isin(tracks_df["parent_track_id"]) & ((ends["t"] + 1) % window_size == 0)]
+
+    breaks = 0
+    for seam, seam_starts in starts.groupby("t"):
+        seam_ends = ends[ends["t"] == seam - 1]
+        if seam_ends.empty:
+            continue
+
+        distances = cdist(seam_ends[spatial_columns].to_numpy(dtype=np.float64),
+                          seam_starts[spatial_columns].to_numpy(dtype=np.float64))
+        rows, cols = linear_sum_assignment(distances)
+        breaks += int((distances[rows, cols] < max_distance).sum())
+
+    return breaks
+
+def check_track_continuity(tracks_df:DataFrame,
+                           window_size:int,
+                           max_distance:float,
+                           strict:bool = False) -> dict:
+    """
+    Function that verifies the stitched solution has continuous track ids,
+    i.e. one node per frame without holes, and that tracks do not break at
+    window seams (see count_seam_breaks). Discontinuities are reported
+    with a warning, or raised.
+    :tracks_df: DataFrame | to_tracks_layer output, before gap closing
+    :window_size: int | window size used to solve
+    :max_distance: float | greatest distance of a seam break, the linking max_distance
+    :strict: bool | raise a ValueError instead of warning
+    :return: dict | continuity summary
+    """
+    per_track = tracks_df.groupby("track_id")["t"].agg(["min", "max", "count", "nunique"])
+
+    duplicated = int((per_track["count"] != per_track["nunique"]).sum())
+    with_holes = int((per_track["max"] - per_track["min"] + 1 != per_track["nunique"]).sum())
+
+    # tracks without parent starting where a window starts
+    roots = tracks_df.groupby("track_id")["parent_track_id"].first() <= 0
+    starts = per_track["min"]
+    on_boundary = roots & (starts > 0) & (starts % window_size == 0)
+
+    seam_breaks = count_seam_breaks(tracks_df, window_size, max_distance)
+
+    summary = {"tracks"                 : len(per_track),
+               "duplicated_frames"      : duplicated,
+               "tracks_with_holes"      : with_holes,
+               "roots_on_window_start"  : int(on_boundary.sum()),
+               "seam_breaks"            : seam_breaks,
+               "continuous"             : duplicated == 0 and with_holes == 0 and seam_breaks == 0}
+
+    print(f"Track continuity: {summary}")
+
+    if not summary["continuous"]:
+        message = (f"tracks are not continuous across the {window_size} frame windows: "
+                   f"{duplicated} with duplicated frames, {with_holes} with holes, "
+                   f"{seam_breaks} broken at window seams")
+        if strict:
+            raise ValueError(message)
+        warn(message, RuntimeWarning, stacklevel=2)
+
+    return summary
+
+# End of current module